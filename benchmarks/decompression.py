@@ -0,0 +1,76 @@
+"""
+Measure how fast the lz4-compressed ASDF blocks are decompressed depending on the number of \
+blocks and threads.
+
+Usage: python3 benchmarks/decompression.py [--blocks 1 4 16 64] [--threads 1 2 4 8]
+
+"vs 1" is the speedup relative to one thread, "vs asdf" is the speedup relative to \
+the streaming decoder of asdf which is used without :mod:`modelforge.compression`.
+"""
+import argparse
+from io import BytesIO
+import os
+import time
+
+import asdf
+import numpy
+
+from modelforge.compression import parallel_compression
+
+BLOCK_SIZE = asdf.compression.DEFAULT_BLOCK_SIZE
+
+
+def make_file(blocks: int) -> bytes:
+    """Serialize an lz4-compressed array which spans the given number of blocks."""
+    rs = numpy.random.RandomState(0)
+    # low entropy data which is similar to the real arrays: ids, frequencies, offsets
+    data = rs.zipf(1.5, size=blocks * BLOCK_SIZE // 4).astype(numpy.uint32)
+    buffer = BytesIO()
+    with asdf.AsdfFile({"data": data}) as file:
+        file.set_array_compression(data, "lz4")
+        with parallel_compression():
+            file.write_to(buffer)
+    return buffer.getvalue()
+
+
+def measure(data: bytes, threads: int, repeat: int) -> float:
+    """Return the best time to read the file; 0 threads means the original asdf decoder."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if threads > 0:
+            with parallel_compression(threads):
+                asdf.open(BytesIO(data), copy_arrays=True, lazy_load=False).close()
+        else:
+            asdf.open(BytesIO(data), copy_arrays=True, lazy_load=False).close()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Print the decompression speed for every combination of blocks and threads."""
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--blocks", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Numbers of 4 MiB blocks in the array.")
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=sorted({1, 2, 4, 8, 16, 32, cpus} & set(range(1, cpus + 1))),
+                        help="Numbers of decompression threads.")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of N runs.")
+    args = parser.parse_args()
+    print("%d CPUs" % cpus)
+    print("%8s %8s %10s %10s %10s %10s" % (
+        "blocks", "threads", "seconds", "MiB/s", "vs 1", "vs asdf"))
+    for blocks in args.blocks:
+        data = make_file(blocks)
+        baseline = measure(data, 0, args.repeat)
+        serial = measure(data, 1, args.repeat)
+        for threads in args.threads:
+            elapsed = measure(data, threads, args.repeat) if threads > 1 else serial
+            print("%8d %8d %10.3f %10.1f %10.2f %10.2f" % (
+                blocks, threads, elapsed, blocks * BLOCK_SIZE / 2 ** 20 / elapsed,
+                serial / elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare the speed of :func:`modelforge.model.merge_strings()` with the previous implementation \
+which filled the lengths and the merged bytes in Python loops.
+
+Usage: python3 benchmarks/merge_strings.py [--size 1000000]
+
+The strings are random vocabulary-like tokens of 1-20 chars, a tenth of them non-ASCII.
+"""
+import argparse
+import time
+from typing import List, Union
+
+import numpy
+
+from modelforge.model import merge_strings, split_strings, squeeze_bits
+
+
+def merge_strings_loop(list_of_strings: Union[List[str], List[bytes]]) -> dict:
+    """The implementation of :func:`merge_strings()` before vectorization."""
+    with_str = not isinstance(list_of_strings[0], bytes)
+    if with_str:
+        strings = numpy.array(["".join(list_of_strings).encode("utf-8")])
+    else:
+        merged = bytearray(sum(len(s) for s in list_of_strings))
+        offset = 0
+        for s in list_of_strings:
+            merged[offset:offset + len(s)] = s
+            offset += len(s)
+        strings = numpy.frombuffer(merged, dtype="S%d" % len(merged))
+    lengths = [0] * len(list_of_strings)
+    for i, s in enumerate(list_of_strings):
+        lengths[i] = len(s)
+    lengths = squeeze_bits(numpy.array(lengths, dtype=int))
+    return {"strings": strings, "lengths": lengths, "str": with_str}
+
+
+def make_strings(size: int) -> List[str]:
+    """Generate the benchmarked vocabulary."""
+    rs = numpy.random.RandomState(0)
+    alphabet = numpy.array(list("abcdefghijklmnopqrstuvwxyz_0123456789"))
+    lengths = rs.randint(1, 21, size)
+    chars = alphabet[rs.randint(0, len(alphabet), lengths.sum())]
+    text = "".join(chars)
+    offsets = numpy.zeros(size + 1, dtype=int)
+    numpy.cumsum(lengths, out=offsets[1:])
+    strings = [text[offsets[i]:offsets[i + 1]] for i in range(size)]
+    for i in range(0, size, 10):
+        strings[i] = strings[i] + "ё"
+    return strings
+
+
+def measure(func, strings: list, repeat: int) -> float:
+    """Return the best time of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(strings)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Print the times of both implementations for str and bytes input."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=1000000, help="Number of strings.")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of N runs.")
+    args = parser.parse_args()
+    strings = make_strings(args.size)
+    inputs = (("str", strings), ("bytes", [s.encode("utf-8") for s in strings]))
+    print("%-6s %10s %10s %8s" % ("input", "loop s", "vector s", "speedup"))
+    for name, data in inputs:
+        merged = merge_strings(data)
+        expected = merge_strings_loop(data)
+        assert merged["strings"][0] == expected["strings"][0]
+        assert (merged["lengths"] == expected["lengths"]).all()
+        assert split_strings(merged)[:1000] == data[:1000]
+        loop = measure(merge_strings_loop, data, args.repeat)
+        vector = measure(merge_strings, data, args.repeat)
+        print("%-6s %10.3f %10.3f %8.1f" % (name, loop, vector, loop / vector))
+
+
+if __name__ == "__main__":
+    main()
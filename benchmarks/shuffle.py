@@ -0,0 +1,79 @@
+"""
+Measure how the byte shuffle filter changes the compression ratio and speed of the chunked \
+arrays.
+
+Usage: python3 benchmarks/shuffle.py [--codecs lz4 lz4hc zlib] [--threads 1]
+
+The arrays are the parts of a sparse matrix produced by \
+:func:`modelforge.model.disassemble_sparse_matrix()` and embedding matrices.
+"""
+import argparse
+from collections import OrderedDict
+import time
+
+import numpy
+import scipy.sparse
+
+from modelforge.chunked import chunk_array, ChunkedArray
+from modelforge.model import disassemble_sparse_matrix
+
+
+def make_arrays() -> "OrderedDict[str, numpy.ndarray]":
+    """Generate the benchmarked arrays."""
+    rs = numpy.random.RandomState(0)
+    arrays = OrderedDict()
+    # bag-of-words-like matrix: zipfian term frequencies weighted by idf
+    rows, cols, nnz = 20000, 100000, 2000000
+    matrix = scipy.sparse.csr_matrix(
+        (rs.zipf(1.8, nnz).astype(numpy.float32) * rs.choice(
+            numpy.linspace(1, 10, 1000, dtype=numpy.float32), nnz),
+         (rs.randint(0, rows, nnz), numpy.minimum(rs.zipf(1.2, nnz), cols) - 1)),
+        shape=(rows, cols))
+    matrix.sum_duplicates()
+    data, indices, lengths = disassemble_sparse_matrix(matrix)["data"]
+    arrays["sparse data %s" % data.dtype] = data
+    arrays["sparse indices %s" % indices.dtype] = indices
+    arrays["sparse lengths %s" % lengths.dtype] = lengths
+    embeddings = rs.normal(0, 0.3, size=(100000, 100)).astype(numpy.float32)
+    arrays["embeddings float32"] = embeddings
+    arrays["embeddings float16"] = embeddings.astype(numpy.float16)
+    # quantized embeddings, e.g. after product quantization or rounding
+    arrays["rounded embeddings float32"] = numpy.round(embeddings, 2)
+    return arrays
+
+
+def measure(arr: numpy.ndarray, codec: str, shuffle: bool, threads: int, repeat: int):
+    """Return the compression ratio and the best compression and decompression times."""
+    best_compress = best_decompress = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subtree = chunk_array(arr, threads=threads, codec=codec, shuffle=shuffle)
+        best_compress = min(best_compress, time.perf_counter() - start)
+        chunked = ChunkedArray(subtree, threads=threads)
+        start = time.perf_counter()
+        numpy.asarray(chunked)
+        best_decompress = min(best_decompress, time.perf_counter() - start)
+    return arr.nbytes / len(subtree["data"]), best_compress, best_decompress
+
+
+def main():
+    """Print the ratio and the speed with and without shuffling for every array and codec."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--codecs", nargs="+", default=["lz4", "lz4hc", "zlib"],
+                        help="Codec specifications, see modelforge.codecs.get_codec().")
+    parser.add_argument("--threads", type=int, default=1, help="Number of threads.")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of N runs.")
+    args = parser.parse_args()
+    print("%-28s %-6s %8s %8s %10s %10s" % (
+        "array", "codec", "shuffle", "ratio", "comp MB/s", "dec MB/s"))
+    for name, arr in make_arrays().items():
+        for codec in args.codecs:
+            for shuffle in (False, True):
+                ratio, comp, dec = measure(arr, codec, shuffle, args.threads, args.repeat)
+                print("%-28s %-6s %8s %8.2f %10.1f %10.1f" % (
+                    name, codec, shuffle, ratio, arr.nbytes / 1e6 / comp,
+                    arr.nbytes / 1e6 / dec))
+
+
+if __name__ == "__main__":
+    main()
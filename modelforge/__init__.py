@@ -1,6 +1,9 @@
 # flake8: noqa
-from modelforge.model import Model, merge_strings, split_strings, \
-    assemble_sparse_matrix, disassemble_sparse_matrix, squeeze_bits
+from modelforge.model import Model, merge_strings, split_strings, merge_mapping, \
+    merge_ragged, split_ragged, assemble_sparse_matrix, disassemble_sparse_matrix, squeeze_bits
 from modelforge.models import register_model, GenericModel
+from modelforge.ragged import RaggedArray
+from modelforge.sparse import CompactSparseMatrix
+from modelforge.strings import StringArray, StringMap
 from modelforge.version import __version__
 import modelforge.gcs_backend
@@ -34,6 +34,8 @@ def main():
                        help="Url of the remote Git repository.")
         p.add_argument("--cache", default=None,
                        help="Path to the folder where the Git repository will be cached.")
+        p.add_argument("--offline", action="store_true", default=None,
+                       help="Do not access the network and use the cached Git repository.")
         p.add_argument("-s", "--signoff", action="store_true",
                        help="Add Signed-off-by line by the committer at the end of the commit log "
                             "message. The meaning of a signoff depends on the project, but it "
@@ -60,10 +62,10 @@ def main():
     add_backend_args(init_parser)
     # ------------------------------------------------------------------------
     dump_parser = subparsers.add_parser(
-        "dump", help="Print a brief information about the model to stdout.")
+        "dump", help="Print a brief information about the models to stdout.")
     dump_parser.set_defaults(handler=dump_model)
     dump_parser.add_argument(
-        "input", help="Path to the model file, URL or UUID.")
+        "input", nargs="+", help="Paths to the model files, URLs or UUIDs.")
     add_index_args(dump_parser)
     add_backend_args(dump_parser)
     # ------------------------------------------------------------------------
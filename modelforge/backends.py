@@ -1,15 +1,23 @@
 from functools import wraps
+import inspect
 import logging
-from typing import BinaryIO, Optional, Type, Union
+import os
+import threading
+from typing import BinaryIO, Optional, Tuple, Type, Union
 
+from modelforge.cache import get_model_cache
+from modelforge.checksum import StreamingChecksum
 import modelforge.configuration as config
-from modelforge.http_ import download as download_http
+from modelforge.http_ import download as download_http, download_prefix as download_prefix_http
 from modelforge.index import GitIndex
 from modelforge.storage_backend import StorageBackend
 
 
 __registry__ = {}
 __downloaders__ = {"http": download_http, "https": download_http}
+__prefix_downloaders__ = {"http": download_prefix_http, "https": download_prefix_http}
+_default_backend = None
+_default_backend_lock = threading.Lock()
 
 
 def register_backend(cls: Type[StorageBackend]):
@@ -20,11 +28,19 @@ def register_backend(cls: Type[StorageBackend]):
     # DOWNLOADERS is expected to be a tuple of tuples, not a dict
     # that's because we want it to be immutable
     # we want immutability because extending class-levels dicts in inheritors is messy
+    # a downloader is called as (source, output, log, chunk_size) and should also accept
+    # the optional checksum="<algorithm>:<hex digest>" keyword to verify the data as it streams
     for key, downloader in getattr(cls, "DOWNLOADERS", tuple()):
         if key in __downloaders__:
             raise TypeError("%s.DOWNLOADERS contain %s which is already set to %s" % (
                 cls.__name__, key, __downloaders__[key]))
         __downloaders__[key] = downloader
+    # PREFIX_DOWNLOADERS is optional and follows the same rules as DOWNLOADERS
+    for key, downloader in getattr(cls, "PREFIX_DOWNLOADERS", tuple()):
+        if key in __prefix_downloaders__:
+            raise TypeError("%s.PREFIX_DOWNLOADERS contain %s which is already set to %s" % (
+                cls.__name__, key, __prefix_downloaders__[key]))
+        __prefix_downloaders__[key] = downloader
     return cls
 
 
@@ -47,6 +63,32 @@ def create_backend(name: str=None, git_index: GitIndex=None, args: str=None) ->
     return __registry__[name](**kwargs)
 
 
+def get_default_backend() -> StorageBackend:
+    """
+    Return the process-wide StorageBackend created with the default parameters. \
+    It is built lazily on the first call, so the Git index is fetched only once per process. \
+    Thread-safe. Failures are not cached.
+    """
+    global _default_backend
+    backend = _default_backend
+    if backend is None:
+        with _default_backend_lock:
+            if _default_backend is None:
+                _default_backend = create_backend()
+            backend = _default_backend
+    return backend
+
+
+def invalidate_default_backend() -> None:
+    """
+    Forget the process-wide StorageBackend so that the next :func:`get_default_backend()` \
+    call constructs it and fetches the index again, e.g. after the configuration has changed.
+    """
+    global _default_backend
+    with _default_backend_lock:
+        _default_backend = None
+
+
 def create_backend_noexc(log: logging.Logger, name: str=None, git_index: GitIndex=None,
                          args: str=None) -> Optional[StorageBackend]:
     """Initialize a new Backend, return None if there was a known problem."""
@@ -61,7 +103,8 @@ def create_backend_noexc(log: logging.Logger, name: str=None, git_index: GitInde
         return None
 
 
-def supply_backend(optional: Union[callable, bool]=False, index_exists: bool=True):
+def supply_backend(optional: Union[callable, bool]=False, index_exists: bool=True,
+                   read_only: bool=False):
     """
     Decorator to pass the initialized backend to the decorated callable. \
     Used by command line entries. If the backend cannot be created, return 1.
@@ -70,6 +113,9 @@ def supply_backend(optional: Union[callable, bool]=False, index_exists: bool=Tru
                      construct the backend object if it does not exist in the wrapped function's \
                      `args`: `True` means we shouldn't.
     :param index_exists: Whether the Git model index exists on the remote side or not.
+    :param read_only: Whether the wrapped function only reads the index. Only then the cached \
+                      index is trusted for `configuration.INDEX_TTL` seconds, otherwise it is \
+                      always synced with the remote.
     """
     real_optional = False if callable(optional) else optional
 
@@ -84,6 +130,8 @@ def supply_backend(optional: Union[callable, bool]=False, index_exists: bool=Tru
                     git_index = GitIndex(remote=args.index_repo, username=args.username,
                                          password=args.password, cache=args.cache,
                                          exists=index_exists, signoff=args.signoff,
+                                         ttl=None if read_only else 0,
+                                         offline=getattr(args, "offline", None),
                                          log_level=args.log_level)
                 except ValueError:
                     return 1
@@ -98,7 +146,7 @@ def supply_backend(optional: Union[callable, bool]=False, index_exists: bool=Tru
 
 
 def download_file(source: str, output: Union[str, BinaryIO], log: logging.Logger,
-                  chunk_size: int = -1) -> None:
+                  chunk_size: int = -1, checksum: str = None) -> None:
     """
     Download a file by its URL.
 
@@ -106,6 +154,64 @@ def download_file(source: str, output: Union[str, BinaryIO], log: logging.Logger
     :param output: Written file name or file object.
     :param log: Logger to use.
     :param chunk_size: Buffer size, if the underlying downloader supports setting it.
+    :param checksum: Expected checksum of the file in the "<algorithm>:<hex digest>" format, \
+                     see :mod:`modelforge.checksum`. None disables the verification.
     :return: None
+    :raise ValueError: If the offline mode is on.
+    """
+    if config.OFFLINE:
+        log.error("Cannot fetch %s in the offline mode", source)
+        raise ValueError("Cannot fetch %s in the offline mode" % source)
+    downloader = __downloaders__[source[:source.find("://")]]
+    if checksum is None:
+        downloader(source, output, log, chunk_size)
+    elif _accepts_checksum(downloader):
+        downloader(source, output, log, chunk_size, checksum=checksum)
+    elif isinstance(output, str):
+        downloader(source, output, log, chunk_size)
+        hasher = StreamingChecksum(checksum)
+        hasher.update_from_file(output)
+        try:
+            hasher.verify()
+        except ValueError:
+            os.remove(output)
+            raise
+    else:
+        raise ValueError("The downloader of %s does not support checksums, so it cannot verify "
+                         "the data written to a file object" % source)
+    if isinstance(output, str):
+        get_model_cache().add(output)
+
+
+def _accepts_checksum(downloader: callable) -> bool:
+    try:
+        parameters = inspect.signature(downloader).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == "checksum" or p.kind == inspect.Parameter.VAR_KEYWORD
+               for p in parameters)
+
+
+def download_file_prefix(source: str, terminator: bytes, log: logging.Logger,
+                         chunk_size: int = -1) -> Tuple[bytes, Optional[int]]:
     """
-    __downloaders__[source[:source.find("://")]](source, output, log, chunk_size)
+    Download the beginning of a file by its URL, up to the first occurrence of `terminator`.
+
+    :param source: URL to fetch.
+    :param terminator: Byte sequence which ends the prefix.
+    :param log: Logger to use.
+    :param chunk_size: Initial size of the fetched range, if the underlying downloader \
+                       supports setting it.
+    :return: The prefix including `terminator` and the total size of the file if known.
+    :raise ValueError: If the offline mode is on or the URL scheme does not support \
+                       partial downloads.
+    """
+    if config.OFFLINE:
+        log.error("Cannot fetch %s in the offline mode", source)
+        raise ValueError("Cannot fetch %s in the offline mode" % source)
+    scheme = source[:source.find("://")]
+    try:
+        downloader = __prefix_downloaders__[scheme]
+    except KeyError:
+        raise ValueError("Partial downloads are not supported for %s" % source) from None
+    return downloader(source, terminator, log, chunk_size)
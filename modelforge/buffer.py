@@ -0,0 +1,103 @@
+import io
+import os
+from typing import BinaryIO, Union
+
+import asdf.generic_io
+import numpy
+
+
+def read_buffer(source: Union[str, BinaryIO]) -> numpy.ndarray:
+    """
+    Read the whole file into a single read-only buffer without intermediate copies. \
+    The files on disk are memory mapped privately, so the buffer is backed by the page cache \
+    instead of the heap; the file objects are read at once.
+
+    :param source: Path to the file or a file object, which is read from the current position.
+    :return: Read-only flat uint8 array.
+    """
+    if isinstance(source, str):
+        if os.path.getsize(source) == 0:
+            return numpy.empty(0, dtype=numpy.uint8)
+        buffer = numpy.memmap(source, dtype=numpy.uint8, mode="c")
+        buffer.flags.writeable = False
+        return buffer
+    try:
+        pos = source.tell()
+        size = source.seek(0, os.SEEK_END) - pos
+        source.seek(pos, os.SEEK_SET)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        size = None
+    if size is None or not hasattr(source, "readinto"):
+        buffer = numpy.frombuffer(bytearray(source.read()), dtype=numpy.uint8)
+    else:
+        buffer = numpy.empty(size, dtype=numpy.uint8)
+        view = memoryview(buffer)
+        read = 0
+        while read < size:
+            chunk = source.readinto(view[read:])
+            if not chunk:
+                raise IOError("Unexpected end of file after %d bytes out of %d" % (read, size))
+            read += chunk
+    buffer.flags.writeable = False
+    return buffer
+
+
+class _BufferIO(io.RawIOBase):
+    """Binary file interface to a memory buffer which does not copy it, unlike io.BytesIO."""
+
+    def __init__(self, buffer: numpy.ndarray):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        size = max(min(len(b), len(self._view) - self._pos), 0)
+        b[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("Negative seek position %d" % offset)
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class BufferFile(asdf.generic_io.RandomAccessFile):
+    """
+    ASDF file which is entirely in memory. Unlike :class:`asdf.generic_io.MemoryIO`, the data \
+    of the uncompressed blocks are the views of the buffer instead of the copies, and \
+    the compressed blocks are decompressed straight from the buffer.
+    """
+
+    def __init__(self, buffer: numpy.ndarray, uri: str = None):
+        """
+        Initialize a new instance of :class:`BufferFile`.
+
+        :param buffer: Flat uint8 array with the file contents, see :func:`read_buffer()`.
+        :param uri: The file path or URI, used to resolve the relative references.
+        """
+        super().__init__(_BufferIO(buffer), "r", close=True, uri=uri)
+        self._buffer = buffer
+        self._size = len(buffer)
+
+    def read_into_array(self, size: int) -> numpy.ndarray:
+        """Return the view of the next `size` bytes of the buffer."""
+        pos = self.tell()
+        if size < 0:
+            size = self._size - pos
+        self.seek(size, os.SEEK_CUR)
+        return self._buffer[pos:pos + size]
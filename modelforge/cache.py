@@ -0,0 +1,268 @@
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+import humanize
+import xxhash
+
+import modelforge.configuration as config
+from modelforge.locks import FileLock
+
+
+class ModelCache:
+    """
+    Size-bounded storage of the downloaded models. Each model is kept as \
+    `<root>/<model name>/<uuid>.asdf`. The last access time of every file is tracked through \
+    its atime which we update explicitly on each hit, so that `noatime` mounts work, too. \
+    When the total size exceeds the budget, the least recently used files are evicted. \
+    The decompressed copies of the models are stored next to them as \
+    `<uuid>.<fingerprint>.decompressed.asdf` and share the budget. The models which have \
+    nothing to decompress get the empty `<uuid>.<fingerprint>.uncompressed` markers instead.
+    """
+
+    EXTENSIONS = (".asdf",)  #: Suffixes of the files which are managed by the cache.
+    LOCK_SUFFIX = ".lock"  #: Suffix of the lock files which guard the downloads.
+    #: Suffix of the decompressed copies of the models.
+    DECOMPRESSED_SUFFIX = ".decompressed.asdf"
+    #: Suffix of the markers of the models which are not compressed.
+    UNCOMPRESSED_SUFFIX = ".uncompressed"
+
+    def __init__(self, root: str = None, max_size: int = None, log_level: int = logging.INFO):
+        """
+        Initialize a new instance of :class:`ModelCache`.
+
+        :param root: Directory where the models are stored. Defaults to `vendor_cache_dir()`.
+        :param max_size: Byte budget of the cache. Defaults to `configuration.CACHE_MAX_SIZE`. \
+                         0 means unlimited.
+        :param log_level: The logging level of this instance.
+        """
+        self._log = logging.getLogger(type(self).__name__)
+        self._log.setLevel(log_level)
+        self._root = root
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def root(self) -> str:
+        """Return the directory where the models are stored."""
+        if self._root is not None:
+            return self._root
+        return config.vendor_cache_dir()
+
+    @property
+    def max_size(self) -> int:
+        """Return the maximum allowed total size of the cached models in bytes."""
+        if self._max_size is not None:
+            return self._max_size
+        return int(config.CACHE_MAX_SIZE)
+
+    def manages(self, path: str) -> bool:
+        """Check whether the given file belongs to the cache."""
+        try:
+            root = os.path.abspath(self.root)
+        except RuntimeError:
+            # modelforge is not configured, so there is no cache
+            return False
+        path = os.path.abspath(path)
+        return os.path.commonpath((root, path)) == root and path.endswith(self.EXTENSIONS)
+
+    def lookup(self, path: str) -> bool:
+        """
+        Check whether the model file exists and update the hit/miss counters.
+
+        :param path: Path to the model file.
+        :return: True if this is a cache hit, otherwise False.
+        """
+        try:
+            self.touch(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            self._log.debug("miss %s", path)
+            return False
+        with self._lock:
+            self.hits += 1
+        self._log.debug("hit %s", path)
+        return True
+
+    def lock(self, path: str, timeout: float = None) -> FileLock:
+        """
+        Return the inter-process lock which must be held while the file is being populated. \
+        The first process downloads the model and the rest wait and then read the result.
+
+        :param path: Path to the model file.
+        :param timeout: Maximum number of seconds to wait, None means forever.
+        :return: :class:`modelforge.locks.FileLock`, not acquired.
+        """
+        return FileLock(path + self.LOCK_SUFFIX, timeout=timeout, log=self._log)
+
+    def touch(self, path: str) -> None:
+        """
+        Mark the file as recently used. Only the owner of the file may set its times, so this \
+        is best effort in the caches which are shared between users.
+
+        :param path: Path to the model file.
+        :raise FileNotFoundError: If the file does not exist.
+        """
+        mtime = os.stat(path).st_mtime
+        try:
+            os.utime(path, (time.time(), mtime))
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            self._log.debug("Failed to update the access time of %s: %s", path, e)
+
+    def add(self, path: str, keep: Iterable[str] = tuple()) -> None:
+        """
+        Register the newly written file and evict the least recently used ones if the cache \
+        grows beyond its budget. The added file is never evicted.
+
+        :param path: Path to the model file.
+        :param keep: Other paths which must not be evicted.
+        :return: None
+        """
+        if not self.manages(path):
+            return
+        self.touch(path)
+        self.evict(keep=(path,) + tuple(keep))
+
+    def decompressed_path(self, path: str) -> str:
+        """
+        Return the path to the decompressed copy of the cached model file. The name contains \
+        the fingerprint of the size and the modification time of the model file, so \
+        the copy becomes stale once the model is downloaded again.
+
+        :param path: Path to the model file, it must exist.
+        :return: Path to the decompressed copy, it may not exist.
+        """
+        stat = os.stat(path)
+        fingerprint = xxhash.xxh64("%d:%d" % (stat.st_size, stat.st_mtime_ns)).hexdigest()
+        stem = os.path.splitext(path)[0]
+        return "%s.%s%s" % (stem, fingerprint, self.DECOMPRESSED_SUFFIX)
+
+    def uncompressed_marker_path(self, path: str) -> str:
+        """
+        Return the path to the marker which records that the cached model file with \
+        the current fingerprint is not compressed, see :meth:`decompressed_path()`.
+
+        :param path: Path to the model file, it must exist.
+        :return: Path to the marker, it may not exist.
+        """
+        copy = self.decompressed_path(path)
+        return copy[:-len(self.DECOMPRESSED_SUFFIX)] + self.UNCOMPRESSED_SUFFIX
+
+    def remove_stale_decompressed(self, path: str) -> int:
+        """
+        Delete the decompressed copies of the model file, their lock files and the markers \
+        of the uncompressed model which do not match its current fingerprint.
+
+        :param path: Path to the model file.
+        :return: Number of deleted files.
+        """
+        copy = self.decompressed_path(path)
+        current = {os.path.abspath(p) for p in (
+            copy, copy + self.LOCK_SUFFIX, self.uncompressed_marker_path(path))}
+        stem = glob.escape(os.path.splitext(path)[0]) + ".*"
+        removed = 0
+        for suffix in (self.DECOMPRESSED_SUFFIX, self.DECOMPRESSED_SUFFIX + self.LOCK_SUFFIX,
+                       self.UNCOMPRESSED_SUFFIX):
+            for stale in glob.glob(stem + suffix):
+                if os.path.abspath(stale) in current:
+                    continue
+                # nobody waits for the stale locks: the fingerprint of the model has changed
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                self._log.info("Removed the stale %s", stale)
+        return removed
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        List all the managed files.
+
+        :return: List of (last access time, size, path) tuples, the oldest first.
+        """
+        result = []
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file in files:
+                if not file.endswith(self.EXTENSIONS):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                result.append((stat.st_atime, stat.st_size, path))
+        result.sort()
+        return result
+
+    @property
+    def size(self) -> int:
+        """Return the total size of the cached models in bytes."""
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep: Iterable[str] = tuple()) -> int:
+        """
+        Delete the least recently used files until the total size fits into `max_size`.
+
+        :param keep: Paths which must not be evicted.
+        :return: Number of freed bytes.
+        """
+        max_size = self.max_size
+        if max_size <= 0:
+            return 0
+        keep = {os.path.abspath(p) for p in keep}
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        freed = 0
+        for _, size, path in entries:
+            if total - freed <= max_size:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            freed += size
+            with self._lock:
+                self.evictions += 1
+            self._log.info("Evicted %s (%s)", path, humanize.naturalsize(size))
+        if total - freed > max_size:
+            self._log.warning("Cache size %s exceeds the budget %s",
+                              humanize.naturalsize(total - freed),
+                              humanize.naturalsize(max_size))
+        return freed
+
+    def stats(self) -> dict:
+        """Return the hit/miss/eviction counters and the current size."""
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+        stats["size"] = self.size
+        stats["max_size"] = self.max_size
+        return stats
+
+    def reset_stats(self) -> None:
+        """Zero the hit/miss/eviction counters."""
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+_cache = None
+
+
+def get_model_cache() -> ModelCache:
+    """Return the process-wide :class:`ModelCache`."""
+    global _cache
+    if _cache is None:
+        _cache = ModelCache()
+    return _cache
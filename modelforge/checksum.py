@@ -0,0 +1,91 @@
+import hashlib
+from typing import BinaryIO, Union
+
+import xxhash
+
+
+ALGORITHMS = {
+    "xxh64": xxhash.xxh64,
+    "sha256": hashlib.sha256,
+}
+DEFAULT_ALGORITHM = "xxh64"  #: xxhash is an order of magnitude faster than sha256.
+CHUNK_SIZE = 1 << 20
+
+
+class ChecksumMismatchError(ValueError):
+    """
+    The downloaded data does not match the checksum from the index.
+    """
+
+    pass
+
+
+class StreamingChecksum:
+    """
+    Incrementally hash the data as it goes through and compare the result with \
+    the expected checksum in the end.
+    """
+
+    def __init__(self, checksum: str):
+        """
+        Initialize a new instance of :class:`StreamingChecksum`.
+
+        :param checksum: Expected checksum in the "<algorithm>:<hex digest>" format.
+        :raise ValueError: If the algorithm is not supported.
+        """
+        try:
+            algorithm, self.expected = checksum.split(":", 1)
+            self._hasher = ALGORITHMS[algorithm]()
+        except (KeyError, ValueError):
+            raise ValueError("Unsupported checksum: %s" % checksum) from None
+        self.algorithm = algorithm
+
+    def update(self, data: Union[bytes, memoryview]) -> None:
+        """Feed the next portion of the data."""
+        self._hasher.update(data)
+
+    def update_from_file(self, file: Union[str, BinaryIO], size: int = -1) -> None:
+        """
+        Feed the data read from the file.
+
+        :param file: Path to the file or a binary file object.
+        :param size: Number of bytes to read, negative value means until the end.
+        """
+        if isinstance(file, str):
+            with open(file, "rb") as fin:
+                self.update_from_file(fin, size)
+            return
+        while size != 0:
+            chunk = file.read(CHUNK_SIZE if size < 0 else min(size, CHUNK_SIZE))
+            if not chunk:
+                break
+            self.update(chunk)
+            size -= len(chunk) if size > 0 else 0
+
+    @property
+    def actual(self) -> str:
+        """Return the digest of the data fed so far."""
+        return self._hasher.hexdigest()
+
+    def verify(self) -> None:
+        """
+        Compare the expected and the actual checksums.
+
+        :raise ChecksumMismatchError: If they are not equal.
+        """
+        if self.actual != self.expected:
+            raise ChecksumMismatchError("%s checksum mismatch: expected %s, got %s" % (
+                self.algorithm, self.expected, self.actual))
+
+
+def calculate_checksum(file: Union[str, BinaryIO], algorithm: str = DEFAULT_ALGORITHM) -> str:
+    """
+    Hash the whole file.
+
+    :param file: Path to the file or a binary file object.
+    :param algorithm: Name of the hashing algorithm, see `ALGORITHMS`.
+    :return: Checksum in the "<algorithm>:<hex digest>" format.
+    """
+    checksum = StreamingChecksum(algorithm + ":")
+    checksum.update_from_file(file)
+    return "%s:%s" % (algorithm, checksum.actual)
@@ -0,0 +1,330 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+import operator
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy
+
+from modelforge.codecs import Codec, get_codec
+from modelforge.compression import get_compression_threads, shuffle_bytes, unshuffle_bytes
+
+
+CHUNKED_KEY = "chunked"  #: Marks the subtree which stores a chunked array, the value is the codec.
+DEFAULT_CHUNK_SIZE = 1 << 20  #: Default uncompressed size of a chunk in bytes.
+SHUFFLE_FILTER = "shuffle"  #: Filter which shuffles the bytes of each chunk by item.
+#: Filters which can be applied to the chunks before the compression, in the order of application.
+FILTERS = (SHUFFLE_FILTER,)
+
+
+def is_chunked(subtree) -> bool:
+    """Check whether the ASDF subtree was produced by :func:`chunk_array()`."""
+    return isinstance(subtree, dict) and CHUNKED_KEY in subtree and "offsets" in subtree
+
+
+def can_chunk(arr) -> bool:
+    """Check whether the array can be stored with :func:`chunk_array()`."""
+    return isinstance(arr, numpy.ndarray) and arr.ndim > 0 and arr.dtype.fields is None \
+        and not arr.dtype.hasobject
+
+
+def chunk_array(arr: numpy.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                threads: int = -1, codec: Union[str, Codec] = "lz4hc",
+                shuffle: bool = False) -> dict:
+    """
+    Split the array along the first axis into chunks of fixed size and compress each of \
+    them independently. The chunks are compressed in parallel. \
+    :class:`ChunkedArray` does the inverse.
+
+    :param arr: The array to chunk. Structured and object dtypes are not supported.
+    :param chunk_size: Approximate uncompressed size of a chunk in bytes. A chunk contains \
+                       at least one row.
+    :param threads: Number of compression threads, see \
+                    :func:`modelforge.compression.get_compression_threads()`.
+    :param codec: :class:`modelforge.codecs.Codec` or its specification, see \
+                  :func:`modelforge.codecs.get_codec()`.
+    :param shuffle: Shuffle the bytes of each chunk before the compression, see \
+                    :func:`modelforge.compression.shuffle_bytes()`. Ignored for 1-byte items.
+    :return: :class:`dict` with the concatenated compressed chunks ("data"), \
+             the chunk offsets in "data" ("offsets"), "shape", "dtype" and "chunk_rows". \
+             "filters" lists the applied filters if there are any.
+    """
+    if not can_chunk(arr):
+        raise TypeError("Only non-scalar arrays of plain dtypes can be chunked")
+    codec = get_codec(codec)
+    if codec is None:
+        raise ValueError("Chunks must be compressed")
+    arr = numpy.ascontiguousarray(arr)
+    row_size = arr.dtype.itemsize * reduce(operator.mul, arr.shape[1:], 1)
+    chunk_rows = max(1, chunk_size // max(row_size, 1))
+    itemsize = arr.dtype.itemsize
+    shuffle = shuffle and itemsize > 1
+
+    def compress(start):
+        chunk = arr[start:start + chunk_rows].reshape(-1).view(numpy.uint8)
+        if shuffle:
+            chunk = shuffle_bytes(chunk, itemsize)
+        return codec.compress(chunk)
+
+    starts = range(0, arr.shape[0], chunk_rows)
+    threads = min(get_compression_threads(threads), len(starts))
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            chunks = list(pool.map(compress, starts))
+    else:
+        chunks = [compress(start) for start in starts]
+    offsets = numpy.zeros(len(chunks) + 1, dtype=numpy.uint64)
+    numpy.cumsum([len(c) for c in chunks], out=offsets[1:])
+    data = numpy.empty(int(offsets[-1]), dtype=numpy.uint8)
+    for chunk, start, end in zip(chunks, offsets[:-1], offsets[1:]):
+        data[start:end] = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    subtree = {CHUNKED_KEY: codec.NAME,
+               "data": data,
+               "offsets": offsets,
+               "shape": [int(d) for d in arr.shape],
+               "dtype": arr.dtype.str,
+               "chunk_rows": int(chunk_rows)}
+    if shuffle:
+        subtree["filters"] = [SHUFFLE_FILTER]
+    return subtree
+
+
+class ChunkedArray:
+    """
+    Read-only array which is stored as independently compressed chunks, see \
+    :func:`chunk_array()`. Indexing decompresses only the chunks which contain the requested \
+    rows; several chunks are decompressed in parallel. If the compressed data is memory \
+    mapped, only the covered bytes are read from disk.
+    """
+
+    def __init__(self, subtree: dict, threads: int = -1):
+        """
+        Initialize a new instance of :class:`ChunkedArray`.
+
+        :param subtree: The dict produced by :func:`chunk_array()`.
+        :param threads: Number of decompression threads, see \
+                        :func:`modelforge.compression.get_compression_threads()`.
+        """
+        if not is_chunked(subtree):
+            raise ValueError("The subtree does not contain a chunked array")
+        self._codec = get_codec(subtree[CHUNKED_KEY])
+        self._data = subtree["data"]
+        self._offsets = numpy.asarray(subtree["offsets"], dtype=numpy.uint64)
+        self._shape = tuple(int(d) for d in subtree["shape"])
+        self._dtype = numpy.dtype(subtree["dtype"])
+        self._chunk_rows = int(subtree["chunk_rows"])
+        filters = list(subtree.get("filters", []))
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise ValueError("Unknown chunk filters: %s" % ", ".join(sorted(unknown)))
+        self._shuffle = SHUFFLE_FILTER in filters
+        self._threads = get_compression_threads(threads)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Return the shape of the array."""
+        return self._shape
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        """Return the dtype of the array."""
+        return self._dtype
+
+    @property
+    def ndim(self) -> int:
+        """Return the number of dimensions."""
+        return len(self._shape)
+
+    @property
+    def size(self) -> int:
+        """Return the number of elements."""
+        return reduce(operator.mul, self._shape, 1)
+
+    @property
+    def nbytes(self) -> int:
+        """Return the uncompressed size of the array in bytes."""
+        return self.size * self._dtype.itemsize
+
+    @property
+    def chunk_rows(self) -> int:
+        """Return the number of rows in each chunk except maybe the last one."""
+        return self._chunk_rows
+
+    @property
+    def chunks(self) -> int:
+        """Return the number of chunks."""
+        return len(self._offsets) - 1
+
+    def __len__(self) -> int:
+        """Return the size of the first dimension."""
+        return self._shape[0]
+
+    def __repr__(self) -> str:
+        """Describe the array without decompressing it."""
+        return "ChunkedArray(shape=%s, dtype=%s, chunks=%d%s)" % (
+            self._shape, self._dtype, self.chunks, ", shuffled" if self._shuffle else "")
+
+    def __array__(self, dtype=None) -> numpy.ndarray:
+        """Decompress the whole array."""
+        arr = self._rows(0, self._shape[0])
+        return arr if dtype is None else arr.astype(dtype, copy=False)
+
+    def __getitem__(self, item) -> Union[numpy.ndarray, numpy.generic]:
+        """Decompress the chunks which contain the selected rows and index them."""
+        if not isinstance(item, tuple):
+            item = (item,)
+        if not item:
+            return numpy.asarray(self)
+        first, rest = item[0], item[1:]
+        if first is Ellipsis or first is None:
+            return numpy.asarray(self)[item]
+        length = self._shape[0]
+        if isinstance(first, slice):
+            rows = range(*first.indices(length))
+            if len(rows) == 0:
+                result = numpy.empty((0,) + self._shape[1:], dtype=self._dtype)
+            else:
+                lo, hi = min(rows), max(rows) + 1
+                result = self._rows(lo, hi)[rows.start - lo::rows.step][:len(rows)]
+            return result[(slice(None),) + rest]
+        if isinstance(first, (int, numpy.integer)):
+            index = int(first)
+            if index < -length or index >= length:
+                raise IndexError("index %d is out of bounds for axis 0 with size %d" %
+                                 (index, length))
+            index %= length
+            return self._rows(index, index + 1)[0][rest]
+        index = numpy.asarray(first)
+        if index.dtype == bool:
+            if index.shape != (length,):
+                raise IndexError("boolean index does not match the array length %d" % length)
+            index = numpy.flatnonzero(index)
+        elif not numpy.issubdtype(index.dtype, numpy.integer) and index.size > 0:
+            raise IndexError("only integers, slices, ellipsis and integer or boolean arrays "
+                             "are valid indices")
+        index = index.astype(numpy.int64)
+        if ((index < -length) | (index >= length)).any():
+            raise IndexError("index is out of bounds for axis 0 with size %d" % length)
+        index %= max(length, 1)
+        return self._gather(index)[(slice(None),) + rest]
+
+    def _decompress_into(self, chunks: List[int], out: numpy.ndarray) -> None:
+        """Decompress the given chunks one after another into the flat byte buffer."""
+        row_size = out.nbytes // max(out.shape[0], 1) if out.ndim else 0
+        flat = out.reshape(-1).view(numpy.uint8)
+        positions = []
+        pos = 0
+        for chunk in chunks:
+            positions.append(pos)
+            rows = min(self._chunk_rows, self._shape[0] - chunk * self._chunk_rows)
+            pos += rows * row_size
+        positions.append(pos)
+
+        def unpack(i):
+            chunk, start, end = chunks[i], positions[i], positions[i + 1]
+            raw = self._codec.decompress(
+                self._data[int(self._offsets[chunk]):int(self._offsets[chunk + 1])],
+                end - start)
+            raw = numpy.frombuffer(raw, dtype=numpy.uint8)
+            if self._shuffle:
+                unshuffle_bytes(raw, self._dtype.itemsize, flat[start:end])
+            else:
+                flat[start:end] = raw
+
+        self._map(unpack, list(range(len(chunks))))
+
+    def _map(self, func: Callable, args: list) -> None:
+        if self._threads > 1 and len(args) > 1:
+            with ThreadPoolExecutor(max_workers=min(self._threads, len(args))) as pool:
+                for _ in pool.map(func, args):
+                    pass
+        else:
+            for arg in args:
+                func(arg)
+
+    def _rows(self, start: int, stop: int) -> numpy.ndarray:
+        """Decompress the rows [start, stop)."""
+        if start >= stop:
+            return numpy.empty((0,) + self._shape[1:], dtype=self._dtype)
+        first, last = start // self._chunk_rows, (stop - 1) // self._chunk_rows
+        base = first * self._chunk_rows
+        out = numpy.empty((min(self._shape[0], (last + 1) * self._chunk_rows) - base,) +
+                          self._shape[1:], dtype=self._dtype)
+        self._decompress_into(list(range(first, last + 1)), out)
+        if start == base and stop - base == out.shape[0]:
+            return out
+        return out[start - base:stop - base]
+
+    def _gather(self, index: numpy.ndarray) -> numpy.ndarray:
+        """Decompress the chunks which contain the given rows and pick them."""
+        chunk_ids = index // self._chunk_rows
+        chunks = numpy.unique(chunk_ids)
+        if len(chunks) == 0:
+            return numpy.empty(index.shape + self._shape[1:], dtype=self._dtype)
+        # only the last chunk can be shorter, so the rows of the sorted chunks stay aligned
+        last = int(chunks[-1])
+        rows = (len(chunks) - 1) * self._chunk_rows + \
+            min(self._chunk_rows, self._shape[0] - last * self._chunk_rows)
+        buffer = numpy.empty((rows,) + self._shape[1:], dtype=self._dtype)
+        self._decompress_into([int(c) for c in chunks], buffer)
+        positions = numpy.searchsorted(chunks, chunk_ids) * self._chunk_rows + \
+            index % self._chunk_rows
+        return buffer[positions]
+
+
+def chunk_arrays(tree, chunk_codec: Callable[[str, numpy.ndarray], Optional[Codec]],
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, path: str = "",
+                 shuffle: Callable[[str], bool] = None):
+    """
+    Replace the arrays in the tree with :func:`chunk_array()` subtrees.
+
+    :param tree: ASDF tree. It is not modified, the changed containers are copied.
+    :param chunk_codec: Returns the codec to compress the chunks given the array's tree path \
+                        ("/key/subkey/") and the array itself. None means that the array \
+                        must not be chunked.
+    :param chunk_size: Approximate uncompressed size of a chunk in bytes.
+    :param path: Tree path of `tree`.
+    :param shuffle: Returns whether to shuffle the bytes of the chunks given the array's \
+                    tree path. None means never.
+    :return: The new tree.
+    """
+    if isinstance(tree, dict):
+        result = {key: chunk_arrays(val, chunk_codec, chunk_size, path + "/" + key, shuffle)
+                  for key, val in tree.items()}
+        if all(result[key] is val for key, val in tree.items()):
+            return tree
+        return result
+    if isinstance(tree, (list, tuple)):
+        result = [chunk_arrays(child, chunk_codec, chunk_size, path, shuffle) for child in tree]
+        if all(new is old for new, old in zip(result, tree)):
+            return tree
+        return type(tree)(result)
+    if can_chunk(tree):
+        codec = chunk_codec(path + "/", tree)
+        if codec is not None:
+            return chunk_array(tree, chunk_size, codec=codec,
+                               shuffle=shuffle is not None and shuffle(path + "/"))
+    return tree
+
+
+def unchunk_arrays(tree, lazy: bool = False):
+    """
+    Replace the :func:`chunk_array()` subtrees in the tree with arrays.
+
+    :param tree: ASDF tree. It is not modified, the changed containers are copied.
+    :param lazy: Create :class:`ChunkedArray`-s instead of decompressing the arrays.
+    :return: The new tree.
+    """
+    if is_chunked(tree):
+        arr = ChunkedArray(tree)
+        return arr if lazy else numpy.asarray(arr)
+    if isinstance(tree, dict):
+        result = {key: unchunk_arrays(val, lazy) for key, val in tree.items()}
+        if all(result[key] is val for key, val in tree.items()):
+            return tree
+        return result
+    if isinstance(tree, (list, tuple)):
+        result = [unchunk_arrays(child, lazy) for child in tree]
+        if all(new is old for new, old in zip(result, tree)):
+            return tree
+        return type(tree)(result)
+    return tree
@@ -0,0 +1,270 @@
+import bz2
+import struct
+from typing import Optional, Type, Union
+import zlib
+
+import lz4.block
+
+
+__codecs__ = {}
+
+
+def register_codec(cls: Type["Codec"]):
+    """
+    Include the given codec class into the registry.
+
+    :param cls: The class of the registered codec.
+    :return: cls
+    """
+    if not issubclass(cls, Codec):
+        raise TypeError("codec must be a subclass of Codec")
+    if cls.NAME in __codecs__:
+        raise TypeError("Codec %s is already registered: %s" % (cls.NAME, __codecs__[cls.NAME]))
+    __codecs__[cls.NAME] = cls
+    return cls
+
+
+def get_codec(spec: Union[str, "Codec", None]) -> Optional["Codec"]:
+    """
+    Create the codec from its specification.
+
+    :param spec: "<name>" or "<name>:<level>", e.g. "zlib:9" or "zstd:19". The existing \
+                 :class:`Codec` instance is returned as is. None means no compression.
+    :return: :class:`Codec` or None.
+    :raise ValueError: If the codec is unknown or the level is invalid.
+    """
+    if spec is None or isinstance(spec, Codec):
+        return spec
+    name, _, level = spec.partition(":")
+    try:
+        cls = __codecs__[name]
+    except KeyError:
+        raise ValueError("Unknown codec: %s. Registered codecs: %s" % (
+            name, ", ".join(sorted(__codecs__)))) from None
+    if not level:
+        return cls()
+    try:
+        level = int(level)
+    except ValueError:
+        raise ValueError("Invalid codec level: %s" % spec) from None
+    return cls(level)
+
+
+class Codec:
+    """
+    Base class of the compression codecs which are used to store the arrays.
+    """
+
+    NAME = None  #: Name of the codec in the registry and in the model files.
+    #: Name of the ASDF block compression which can read the output of this codec,
+    #: None if ASDF does not support it.
+    ASDF_COMPRESSION = None
+    MIN_LEVEL = None  #: Minimum compression level.
+    MAX_LEVEL = None  #: Maximum compression level.
+    DEFAULT_LEVEL = None  #: Compression level which ASDF uses.
+    PARALLEL = False  #: Whether the ASDF blocks can be compressed independently.
+
+    def __init__(self, level: int = None):
+        """
+        Initialize a new instance of the codec.
+
+        :param level: Compression level, None means `DEFAULT_LEVEL`.
+        """
+        if level is None:
+            level = self.DEFAULT_LEVEL
+        elif self.MIN_LEVEL is None or not self.MIN_LEVEL <= level <= self.MAX_LEVEL:
+            raise ValueError("%s supports levels from %s to %s, got %d" % (
+                self.NAME, self.MIN_LEVEL, self.MAX_LEVEL, level))
+        self.level = level
+
+    def __str__(self) -> str:
+        """Format the codec specification which :func:`get_codec()` parses."""
+        if self.level is None or self.level == self.DEFAULT_LEVEL:
+            return self.NAME
+        return "%s:%d" % (self.NAME, self.level)
+
+    def __repr__(self) -> str:
+        """Describe the codec."""
+        return "%s(%s)" % (type(self).__name__, self)
+
+    def __eq__(self, other) -> bool:
+        """Compare the codecs by the name and the level."""
+        return isinstance(other, Codec) and str(self) == str(other)
+
+    def __hash__(self) -> int:
+        """Hash the specification."""
+        return hash(str(self))
+
+    @property
+    def is_asdf_default(self) -> bool:
+        """Return True if ASDF produces the same output for its `ASDF_COMPRESSION`."""
+        return self.ASDF_COMPRESSION is not None and self.level == self.DEFAULT_LEVEL
+
+    def compress(self, data) -> bytes:
+        """
+        Compress the buffer as a single independent unit.
+
+        :param data: Buffer to compress.
+        :return: Compressed bytes.
+        """
+        raise NotImplementedError
+
+    def decompress(self, data, size: int) -> bytes:
+        """
+        Decompress the unit produced by :meth:`compress()`.
+
+        :param data: Compressed buffer.
+        :param size: Size of the uncompressed data.
+        :return: Decompressed bytes.
+        """
+        raise NotImplementedError
+
+    def asdf_encoder(self):
+        """
+        Create the encoder of the ASDF block stream with `ASDF_COMPRESSION`.
+
+        :return: Object with `compress(data) -> bytes` and optionally `flush() -> bytes`.
+        """
+        raise NotImplementedError
+
+
+class _Lz4AsdfEncoder:
+    """Frames each compressed block in the same way as ASDF does."""
+
+    def __init__(self, codec: Codec):
+        self._codec = codec
+
+    def compress(self, data) -> bytes:
+        output = self._codec.compress(data)
+        return struct.pack("!I", len(output)) + output
+
+
+@register_codec
+class Lz4Codec(Codec):
+    """Fast LZ4, the level is the acceleration: higher is faster and compresses worse."""
+
+    NAME = "lz4"
+    ASDF_COMPRESSION = "lz4"
+    MIN_LEVEL = 1
+    MAX_LEVEL = 65537
+    DEFAULT_LEVEL = 1
+    PARALLEL = True
+
+    @property
+    def is_asdf_default(self) -> bool:
+        """ASDF always writes LZ4 in the high compression mode."""
+        return False
+
+    def compress(self, data) -> bytes:
+        """Compress the buffer as a single independent unit."""
+        return lz4.block.compress(data, mode="fast", acceleration=self.level)
+
+    def decompress(self, data, size: int) -> bytes:
+        """Decompress the unit produced by :meth:`compress()`."""
+        return lz4.block.decompress(data)
+
+    def asdf_encoder(self):
+        """Create the encoder of the ASDF block stream."""
+        return _Lz4AsdfEncoder(self)
+
+
+@register_codec
+class Lz4HCCodec(Lz4Codec):
+    """LZ4 in the high compression mode, this is what ASDF writes."""
+
+    NAME = "lz4hc"
+    MIN_LEVEL = 1
+    MAX_LEVEL = 12
+    DEFAULT_LEVEL = 9
+
+    @property
+    def is_asdf_default(self) -> bool:
+        """Return True if ASDF produces the same output."""
+        return self.level == self.DEFAULT_LEVEL
+
+    def compress(self, data) -> bytes:
+        """Compress the buffer as a single independent unit."""
+        return lz4.block.compress(data, mode="high_compression", compression=self.level)
+
+
+@register_codec
+class ZlibCodec(Codec):
+    """DEFLATE with the zlib framing."""
+
+    NAME = "zlib"
+    ASDF_COMPRESSION = "zlib"
+    MIN_LEVEL = 0
+    MAX_LEVEL = 9
+    DEFAULT_LEVEL = 6
+
+    def compress(self, data) -> bytes:
+        """Compress the buffer as a single independent unit."""
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, size: int) -> bytes:
+        """Decompress the unit produced by :meth:`compress()`."""
+        return zlib.decompress(data, bufsize=max(size, 1))
+
+    def asdf_encoder(self):
+        """Create the encoder of the ASDF block stream."""
+        return zlib.compressobj(self.level)
+
+
+@register_codec
+class Bzip2Codec(Codec):
+    """bzip2, slow and strong."""
+
+    NAME = "bzp2"
+    ASDF_COMPRESSION = "bzp2"
+    MIN_LEVEL = 1
+    MAX_LEVEL = 9
+    DEFAULT_LEVEL = 9
+
+    def compress(self, data) -> bytes:
+        """Compress the buffer as a single independent unit."""
+        return bz2.compress(data, self.level)
+
+    def decompress(self, data, size: int) -> bytes:
+        """Decompress the unit produced by :meth:`compress()`."""
+        return bz2.decompress(data)
+
+    def asdf_encoder(self):
+        """Create the encoder of the ASDF block stream."""
+        return bz2.BZ2Compressor(self.level)
+
+
+@register_codec
+class ZstdCodec(Codec):
+    """
+    Zstandard. ASDF does not support it, so the arrays are stored in chunks, \
+    see :mod:`modelforge.chunked`. Requires the `zstandard` package.
+    """
+
+    NAME = "zstd"
+    MIN_LEVEL = 1
+    MAX_LEVEL = 22
+    DEFAULT_LEVEL = 3
+
+    def compress(self, data) -> bytes:
+        """Compress the buffer as a single independent unit."""
+        return self._zstd().ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data, size: int) -> bytes:
+        """Decompress the unit produced by :meth:`compress()`."""
+        return self._zstd().ZstdDecompressor().decompress(data, max_output_size=size)
+
+    @staticmethod
+    def _zstd():
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is not installed, so the zstd codec cannot be used. "
+                              "Install it with pip install modelforge[zstd].") from None
+        return zstandard
+
+
+#: The codecs which correspond to the ASDF block compression names.
+ASDF_CODECS = {"lz4": "lz4hc", "zlib": "zlib", "bzp2": "bzp2"}
+#: Specification which chooses between the default codec and no compression for each array \
+#: by trial compressing a sample of it, see :func:`modelforge.compression.estimate_ratio()`.
+AUTO_CODEC = "auto"
@@ -0,0 +1,278 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import struct
+import threading
+from typing import BinaryIO, Iterable, List, Tuple, Union
+
+import asdf.compression
+import asdf.util
+import lz4.block
+import numpy
+
+from modelforge.codecs import Codec
+import modelforge.configuration as config
+
+
+#: Compression methods which split the data into independently compressed blocks.
+PARALLEL_COMPRESSIONS = frozenset(("lz4",))
+
+_asdf_compress = asdf.compression.compress
+_asdf_decompress = asdf.compression.decompress
+_settings = threading.local()
+_install_lock = threading.Lock()
+_install_count = 0
+
+
+def get_compression_threads(threads: int = -1) -> int:
+    """
+    Resolve the number of threads which compress the array blocks.
+
+    :param threads: Requested number of threads. Negative value means \
+                    `configuration.COMPRESSION_THREADS`, 0 means the number of CPUs.
+    :return: Positive number of threads.
+    """
+    if threads < 0:
+        threads = int(config.COMPRESSION_THREADS)
+    if threads == 0:
+        threads = os.cpu_count() or 1
+    return threads
+
+
+def compress(fd: BinaryIO, data: Union[bytes, numpy.ndarray], compression: str,
+             block_size: int = asdf.compression.DEFAULT_BLOCK_SIZE) -> None:
+    """
+    Compress array data and write it to a file, the same as \
+    :func:`asdf.compression.compress()` but the blocks are compressed in parallel. \
+    The blocks are independent in the lz4 stream of ASDF, so the output is byte-identical \
+    to the serial version. The blocks are written in order and at most two blocks per thread \
+    are kept in memory. The arrays which were passed to :func:`parallel_compression()` \
+    in `codecs` are compressed with the corresponding codecs, e.g. with a different level.
+
+    :param fd: The file to write to.
+    :param data: The buffer of uncompressed data.
+    :param compression: The type of compression to use.
+    :param block_size: Input data is split into blocks of this size (in bytes) before \
+                       the compression.
+    :return: None
+    """
+    threads = getattr(_settings, "threads", 1)
+    compression = asdf.compression.validate(compression)
+    codec = getattr(_settings, "codecs", {}).get(id(data))
+    if codec is not None and (codec.is_asdf_default or codec.ASDF_COMPRESSION != compression):
+        codec = None
+    if codec is None:
+        if threads <= 1 or compression not in PARALLEL_COMPRESSIONS:
+            return _asdf_compress(fd, data, compression, block_size)
+        encoder = asdf.compression._get_encoder(compression)
+        parallel = True
+    else:
+        encoder = codec.asdf_encoder()
+        parallel = threads > 1 and codec.PARALLEL
+    if isinstance(data, numpy.ndarray):
+        # slicing the flat byte view does not copy, unlike tobytes()
+        data = numpy.ascontiguousarray(data).reshape(-1).view(numpy.uint8)
+    if not parallel or len(data) <= block_size:
+        for i in range(0, len(data), block_size):
+            fd.write(encoder.compress(data[i:i + block_size]))
+        if hasattr(encoder, "flush"):
+            fd.write(encoder.flush())
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for i in range(0, len(data), block_size):
+            if len(pending) >= 2 * threads:
+                fd.write(pending.popleft().result())
+            pending.append(pool.submit(encoder.compress, data[i:i + block_size]))
+        while pending:
+            fd.write(pending.popleft().result())
+
+
+def decompress(fd: "asdf.generic_io.GenericFile", used_size: int, data_size: int,
+               compression: str) -> numpy.ndarray:
+    """
+    Decompress binary data in a file, the same as :func:`asdf.compression.decompress()` \
+    but the blocks are decompressed in parallel. The compressed data is read at once, \
+    the block boundaries are found from the block headers and every block is unpacked \
+    straight to its place in the output buffer. Codecs other than lz4 are decoded serially.
+
+    :param fd: The file to read the compressed data from.
+    :param used_size: The size of the compressed data.
+    :param data_size: The size of the uncompressed data.
+    :param compression: The compression type used.
+    :return: A flat uint8 array with the decompressed data.
+    """
+    threads = getattr(_settings, "threads", 1)
+    compression = asdf.compression.validate(compression)
+    if compression not in PARALLEL_COMPRESSIONS:
+        return _decompress_stream(fd, used_size, data_size, compression)
+    data = fd.read_into_array(used_size)
+    blocks = split_lz4_blocks(data, data_size)
+    buffer = numpy.empty(data_size, numpy.uint8)
+
+    def unpack(block):
+        start, end, offset, size = block
+        buffer[offset:offset + size] = numpy.frombuffer(lz4.block.decompress(data[start:end]),
+                                                        numpy.uint8)
+
+    if threads <= 1 or len(blocks) <= 1:
+        # still much faster than the streaming decoder of asdf
+        for block in blocks:
+            unpack(block)
+        return buffer
+    with ThreadPoolExecutor(max_workers=min(threads, len(blocks))) as pool:
+        for _ in pool.map(unpack, blocks):
+            pass
+    return buffer
+
+
+def _decompress_stream(fd: "asdf.generic_io.GenericFile", used_size: int, data_size: int,
+                       compression: str) -> numpy.ndarray:
+    """
+    Decompress the stream serially, the same as :func:`asdf.compression.decompress()` \
+    but does not fail when the decoder flushes nothing at the end.
+    """
+    buffer = numpy.empty(data_size, numpy.uint8)
+    decoder = asdf.compression._get_decoder(compression)
+    pos = 0
+
+    def append(decoded):
+        nonlocal pos
+        if pos + len(decoded) > data_size:
+            raise ValueError("Decompressed data too long")
+        buffer[pos:pos + len(decoded)] = numpy.frombuffer(decoded, numpy.uint8)
+        pos += len(decoded)
+
+    for block in fd.read_blocks(used_size):
+        append(decoder.decompress(block))
+    if hasattr(decoder, "flush"):
+        append(decoder.flush())
+    if pos < data_size:
+        raise ValueError("Decompressed data too short")
+    return buffer
+
+
+def split_lz4_blocks(data: numpy.ndarray, data_size: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Find the independently compressed blocks in the lz4 stream written by ASDF. Each block \
+    is prefixed with its big-endian 32-bit size and starts with the little-endian 32-bit size \
+    of the uncompressed data.
+
+    :param data: Compressed stream.
+    :param data_size: Expected size of the uncompressed data.
+    :return: List of (start, end, uncompressed offset, uncompressed size).
+    :raise ValueError: If the stream is corrupted.
+    """
+    blocks = []
+    pos = offset = 0
+    view = memoryview(data)
+    while pos < len(data):
+        if pos + 8 > len(data):
+            raise ValueError("Truncated lz4 block header at %d" % pos)
+        size, = struct.unpack_from("!I", view, pos)
+        raw_size, = struct.unpack_from("<I", view, pos + 4)
+        blocks.append((pos + 4, pos + 4 + size, offset, raw_size))
+        pos += 4 + size
+        offset += raw_size
+    if pos != len(data):
+        raise ValueError("Truncated lz4 block at %d" % blocks[-1][0])
+    if offset > data_size:
+        raise ValueError("Decompressed data too long")
+    if offset < data_size:
+        raise ValueError("Decompressed data too short")
+    return blocks
+
+
+def shuffle_bytes(data: numpy.ndarray, itemsize: int) -> numpy.ndarray:
+    """
+    Group the bytes of the items by their position in the item: all the first bytes, then \
+    all the second bytes, etc. The high bytes of numbers and the exponents of floats change \
+    slowly, so the shuffled buffer compresses much better. :func:`unshuffle_bytes()` \
+    does the inverse.
+
+    :param data: Flat uint8 buffer, its size must be divisible by `itemsize`.
+    :param itemsize: Size of each item in bytes.
+    :return: The shuffled flat uint8 buffer.
+    """
+    return numpy.ascontiguousarray(data.reshape(-1, itemsize).T).reshape(-1)
+
+
+def unshuffle_bytes(data: numpy.ndarray, itemsize: int, out: numpy.ndarray = None
+                    ) -> numpy.ndarray:
+    """
+    Restore the original order of the bytes shuffled by :func:`shuffle_bytes()`.
+
+    :param data: Flat uint8 buffer with the shuffled bytes.
+    :param itemsize: Size of each item in bytes.
+    :param out: Flat uint8 buffer of the same size to write the result to.
+    :return: `out` or the new flat uint8 buffer.
+    """
+    if out is None:
+        out = numpy.empty(len(data), numpy.uint8)
+    items, lanes = out.reshape(-1, itemsize), data.reshape(itemsize, -1)
+    # one strided copy per byte is several times faster than assigning the transposed view
+    for i in range(itemsize):
+        items[:, i] = lanes[i]
+    return out
+
+
+def estimate_ratio(data: numpy.ndarray, codec: Codec, sample_size: int = 1 << 20,
+                   pieces: int = 16) -> float:
+    """
+    Estimate how well the codec compresses the array by compressing several evenly spaced \
+    pieces of it instead of the whole array.
+
+    :param data: The array to sample.
+    :param codec: The codec to try.
+    :param sample_size: Total size of the sampled pieces in bytes. Smaller arrays are \
+                        compressed entirely.
+    :param pieces: Number of the sampled pieces.
+    :return: The ratio of the uncompressed size to the compressed size of the sample.
+    """
+    data = numpy.ascontiguousarray(data).reshape(-1).view(numpy.uint8)
+    if len(data) == 0:
+        return 1.0
+    if len(data) <= sample_size:
+        samples = [data]
+    else:
+        piece = max(sample_size // pieces, 1)
+        step = (len(data) - piece) // max(pieces - 1, 1)
+        samples = [data[i * step:i * step + piece] for i in range(pieces)]
+    size = sum(len(sample) for sample in samples)
+    return size / sum(len(codec.compress(sample)) for sample in samples)
+
+
+@contextmanager
+def parallel_compression(threads: int = -1,
+                         codecs: Iterable[Tuple[numpy.ndarray, Codec]] = tuple()):
+    """
+    Compress the ASDF blocks which are written and decompress the blocks which are read \
+    in the current thread using several threads.
+
+    :param threads: Number of threads, see :func:`get_compression_threads()`.
+    :param codecs: Pairs of arrays and the codecs which must compress them instead of \
+                   the defaults of ASDF. The codecs must be compatible with the ASDF \
+                   compression which is set for the arrays, see `Codec.ASDF_COMPRESSION`.
+    :return: Context manager.
+    """
+    global _install_count
+    threads = get_compression_threads(threads)
+    previous = getattr(_settings, "threads", 1), getattr(_settings, "codecs", {})
+    _settings.threads = threads
+    # asdf keeps the base array of each view in the block
+    _settings.codecs = {id(asdf.util.get_array_base(arr)): codec for arr, codec in codecs}
+    with _install_lock:
+        if _install_count == 0:
+            asdf.compression.compress = compress
+            asdf.compression.decompress = decompress
+        _install_count += 1
+    try:
+        yield
+    finally:
+        with _install_lock:
+            _install_count -= 1
+            if _install_count == 0:
+                asdf.compression.compress = _asdf_compress
+                asdf.compression.decompress = _asdf_decompress
+        _settings.threads, _settings.codecs = previous
@@ -8,7 +8,14 @@ BACKEND = os.getenv("MODELFORGE_BACKEND", None)
 BACKEND_ARGS = os.getenv("MODELFORGE_BACKEND_ARGS", "")
 INDEX_REPO = os.getenv("MODELFORGE_INDEX_REPO", "")
 CACHE_DIR = os.getenv("MODELFORGE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache"))
+CACHE_MAX_SIZE = int(os.getenv("MODELFORGE_CACHE_MAX_SIZE", 0))
+CACHE_DECOMPRESSED = os.getenv("MODELFORGE_CACHE_DECOMPRESSED", "").lower() not in (
+    "", "0", "false", "no")
+DOWNLOAD_CONNECTIONS = int(os.getenv("MODELFORGE_DOWNLOAD_CONNECTIONS", 4))
+COMPRESSION_THREADS = int(os.getenv("MODELFORGE_COMPRESSION_THREADS", 0))
 ALWAYS_SIGNOFF = os.getenv("MODELFORGE_ALWAYS_SIGNOFF", False)
+INDEX_TTL = float(os.getenv("MODELFORGE_INDEX_TTL", 0))
+OFFLINE = os.getenv("MODELFORGE_OFFLINE", "").lower() not in ("", "0", "false", "no")
 OVERRIDE_FILE = "modelforgecfg.py"
 
 
@@ -1,51 +1,402 @@
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
 import math
 import os
-from typing import BinaryIO, Union
+import threading
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 import requests
 
+from modelforge.checksum import StreamingChecksum
+import modelforge.configuration as config
 from modelforge.progress_bar import progress_bar
 
 
 DEFAULT_DOWNLOAD_CHUNK_SIZE = 65536
+MIN_RANGE_SIZE = 16 * 1024 * 1024  #: Parallel downloads never request smaller byte ranges.
+PART_SUFFIX = ".part"  #: Unfinished downloads are written to files with this suffix.
+RANGES_SUFFIX = ".ranges"  #: Pending byte ranges of an unfinished parallel download.
+
+
+class RangesNotSupportedError(ValueError):
+    """
+    The server ignored the requested byte range.
+    """
+
+    pass
 
 
 def download(source: str, file: Union[str, BinaryIO], log: logging.Logger,
-             chunk_size: int = -1) -> None:
+             chunk_size: int = -1, connections: int = -1, checksum: str = None) -> None:
     """
     Download a file from an HTTP source.
 
+    If `file` is a path, the data is written to `file + PART_SUFFIX` first and the result is \
+    atomically renamed to `file` when the download succeeds. An existing part file is resumed \
+    using HTTP Range requests.
+
     :param source: URL to fetch.
     :param file: Where to store the downloaded data.
     :param log: Logger.
     :param chunk_size: Size of the download buffer.
+    :param connections: Maximum number of parallel connections. If the server supports \
+                        byte ranges and `file` is a path, the file is split into ranges which \
+                        are fetched simultaneously. Negative value means \
+                        `configuration.DOWNLOAD_CONNECTIONS`.
+    :param checksum: Expected checksum of the file in the "<algorithm>:<hex digest>" format. \
+                     The data is hashed while it streams; parallel downloads hash the ranges \
+                     in file order as they arrive, see :class:`_OrderedChecksum`.
+    :raise ChecksumMismatchError: If the downloaded data does not match `checksum`. \
+                                  The part file is deleted in that case.
     """
     log.info("Fetching %s...", source)
     if chunk_size < 0:
         chunk_size = DEFAULT_DOWNLOAD_CHUNK_SIZE
-    r = requests.get(source, stream=True)
-    if r.status_code != 200:
+    if connections < 0:
+        connections = int(config.DOWNLOAD_CONNECTIONS)
+    hasher = StreamingChecksum(checksum) if checksum else None
+    if not isinstance(file, str):
+        r = requests.get(source, stream=True)
+        _check_status(r, log)
+        _write_stream(r, file, log, chunk_size, hasher)
+        if hasher is not None:
+            hasher.verify()
+        return
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    part = file + PART_SUFFIX
+    pending = _read_pending_ranges(part)
+    if pending is not None:
+        if pending:
+            log.info("Resuming %d unfinished parts of %s", len(pending), part)
+        else:
+            log.info("All the parts of %s were fetched, finishing", part)
+        try:
+            _download_ranges(source, part, pending, log, chunk_size, hasher)
+        except RangesNotSupportedError:
+            log.warning("The server does not support ranges anymore, starting from scratch")
+            _remove_part(part)
+            hasher = StreamingChecksum(checksum) if checksum else None
+        else:
+            _publish(part, file, hasher)
+            return
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    if offset > 0:
+        log.info("Resuming %s from byte %d", part, offset)
+        r = requests.get(source, stream=True, headers={"Range": "bytes=%d-" % offset})
+        if r.status_code != 206:
+            # either the server ignored the range or the part is broken - start from scratch
+            log.warning("Failed to resume %s (code %s), starting from scratch",
+                        part, r.status_code)
+            r.close()
+            offset = 0
+            r = requests.get(source, stream=True)
+    else:
+        r = requests.get(source, stream=True)
+    _check_status(r, log, 206 if offset > 0 else 200)
+    if offset == 0 and r.headers.get("accept-ranges") == "bytes":
+        ranges = split_ranges(int(r.headers.get("content-length")), connections)
+        if len(ranges) > 1:
+            r.close()
+            _preallocate(part, ranges[-1][1])
+            try:
+                _download_ranges(source, part, ranges, log, chunk_size, hasher)
+            except RangesNotSupportedError:
+                log.warning("The server ignored the byte ranges, fetching in a single stream")
+                _remove_part(part)
+                hasher = StreamingChecksum(checksum) if checksum else None
+                r = requests.get(source, stream=True)
+                _check_status(r, log)
+            else:
+                _publish(part, file, hasher)
+                return
+    if hasher is not None and offset > 0:
+        hasher.update_from_file(part, offset)
+    with open(part, "ab" if offset > 0 else "wb") as f:
+        _write_stream(r, f, log, chunk_size, hasher)
+    _publish(part, file, hasher)
+
+
+def download_prefix(source: str, terminator: bytes, log: logging.Logger,
+                    chunk_size: int = -1) -> Tuple[bytes, Optional[int]]:
+    """
+    Fetch the beginning of a remote file up to the first occurrence of `terminator`. \
+    The requested byte range doubles until the terminator is found, so only a few kilobytes \
+    are transferred for a file which is gigabytes large. If the server does not support \
+    byte ranges, the response is streamed and the connection is closed as soon as \
+    the terminator arrives.
+
+    :param source: URL to fetch.
+    :param terminator: Byte sequence which ends the prefix.
+    :param log: Logger.
+    :param chunk_size: Size of the first requested range and of the read buffer.
+    :return: The prefix including `terminator` (the whole file if there is no terminator) \
+             and the total size of the file if the server reported it.
+    """
+    log.info("Fetching the beginning of %s...", source)
+    if chunk_size < 0:
+        chunk_size = DEFAULT_DOWNLOAD_CHUNK_SIZE
+    data = bytearray()
+    end = chunk_size
+    while True:
+        r = requests.get(source, stream=True,
+                         headers={"Range": "bytes=%d-%d" % (len(data), end - 1)})
+        if r.status_code == 416:
+            # we have read the whole file which does not contain the terminator
+            r.close()
+            return bytes(data), len(data)
+        if r.status_code == 200:
+            log.debug("The server ignored the byte range, streaming %s", source)
+            try:
+                total_size = int(r.headers.get("content-length"))
+            except (TypeError, ValueError):
+                total_size = None
+            data = bytearray()
+            try:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    pos = _append_find(data, chunk, terminator)
+                    if pos >= 0:
+                        return bytes(data[:pos + len(terminator)]), total_size
+            finally:
+                r.close()
+            return bytes(data), total_size
+        _check_status(r, log, 206)
+        total_size = _parse_content_range_total(r.headers.get("content-range"))
+        chunk = r.content
+        pos = _append_find(data, chunk, terminator)
+        if pos >= 0:
+            return bytes(data[:pos + len(terminator)]), total_size
+        if len(data) < end or (total_size is not None and len(data) >= total_size):
+            return bytes(data), total_size if total_size is not None else len(data)
+        log.debug("%s was not found in the first %d bytes", terminator, len(data))
+        end *= 2
+
+
+def split_ranges(total_length: int, connections: int) -> List[Tuple[int, int]]:
+    """
+    Divide the file into contiguous byte ranges to fetch in parallel.
+
+    :param total_length: Size of the file.
+    :param connections: Maximum number of ranges.
+    :return: List of [start, end) pairs. There is at most one range per `MIN_RANGE_SIZE`.
+    """
+    count = max(1, min(connections, total_length // MIN_RANGE_SIZE))
+    step = math.ceil(total_length / count)
+    return [(start, min(start + step, total_length)) for start in range(0, total_length, step)]
+
+
+def _check_status(r: requests.Response, log: logging.Logger, expected: int = 200) -> None:
+    if r.status_code != expected:
         log.error(
             "An error occurred while fetching the model, with code %s" % r.status_code)
         raise ValueError
-    if isinstance(file, str):
-        os.makedirs(os.path.dirname(file), exist_ok=True)
-        f = open(file, "wb")
+
+
+def _append_find(data: bytearray, chunk: bytes, terminator: bytes) -> int:
+    """Append `chunk` to `data` and return the position of `terminator` in it or -1."""
+    search_start = max(0, len(data) - len(terminator) + 1)
+    data += chunk
+    return data.find(terminator, search_start)
+
+
+def _parse_content_range_total(content_range: Optional[str]) -> Optional[int]:
+    """Extract the total size from "bytes <start>-<end>/<total>"."""
+    if not content_range:
+        return None
+    try:
+        return int(content_range.rsplit("/", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _write_stream(r: requests.Response, f: BinaryIO, log: logging.Logger,
+                  chunk_size: int, hasher: Optional[StreamingChecksum] = None) -> None:
+    total_length = int(r.headers.get("content-length"))
+    num_chunks = math.ceil(total_length / chunk_size)
+    if num_chunks == 1:
+        f.write(r.content)
+        if hasher is not None:
+            hasher.update(r.content)
     else:
-        f = file
+        for chunk in progress_bar(
+                r.iter_content(chunk_size=chunk_size),
+                log,
+                expected_size=num_chunks):
+            if chunk:
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+
+
+def _publish(part: str, file: str, hasher: Optional[StreamingChecksum]) -> None:
+    """Verify the checksum of the finished part file and atomically rename it to `file`."""
+    if hasher is not None:
+        try:
+            hasher.verify()
+        except ValueError:
+            _remove_part(part)
+            raise
+    os.replace(part, file)
+
+
+def _preallocate(file: str, size: int) -> None:
+    with open(file, "wb") as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except (AttributeError, OSError):
+            # not available on this platform or not supported by the file system
+            f.truncate(size)
+
+
+def _read_pending_ranges(part: str) -> Optional[List[Tuple[int, int]]]:
+    if not os.path.isfile(part):
+        return None
     try:
-        total_length = int(r.headers.get("content-length"))
-        num_chunks = math.ceil(total_length / chunk_size)
-        if num_chunks == 1:
-            f.write(r.content)
-        else:
-            for chunk in progress_bar(
-                    r.iter_content(chunk_size=chunk_size),
-                    log,
-                    expected_size=num_chunks):
-                if chunk:
-                    f.write(chunk)
-    finally:
-        if isinstance(file, str):
-            f.close()
+        with open(part + RANGES_SUFFIX) as fin:
+            return [tuple(r) for r in json.load(fin)]
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_pending_ranges(part: str, ranges: List[Tuple[int, int]]) -> None:
+    state = part + RANGES_SUFFIX
+    with open(state + ".tmp", "w") as fout:
+        json.dump(sorted(ranges), fout)
+    os.replace(state + ".tmp", state)
+
+
+def _remove_part(part: str) -> None:
+    for path in (part, part + RANGES_SUFFIX):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _OrderedChecksum:
+    """
+    Feed :class:`StreamingChecksum` with the byte ranges of a parallel download in file order \
+    while they are being fetched. The chunks which continue the hashed prefix are hashed \
+    in memory. The data which was fetched ahead of the prefix is read back from the part file \
+    as soon as all the previous bytes are written, while the other ranges are still being \
+    fetched and the data is hot in the page cache.
+    """
+
+    def __init__(self, hasher: StreamingChecksum, part: str, ranges: List[Tuple[int, int]],
+                 size: int):
+        """
+        Initialize a new instance of :class:`_OrderedChecksum`.
+
+        :param hasher: Checksum which has not been fed yet.
+        :param part: Path to the part file.
+        :param ranges: Pending [start, end) ranges, the rest of the file is already written.
+        :param size: Size of the part file.
+        """
+        self._hasher = hasher
+        self._part = part
+        self._size = size
+        self._starts = sorted(start for start, _ in ranges)
+        self._ends = dict(ranges)
+        self._written = {start: start for start in self._starts}
+        self._pos = 0
+        self._lock = threading.Lock()
+
+    def update(self, start: int, offset: int, chunk: bytes) -> None:
+        """
+        Record the chunk which was written to the part file.
+
+        :param start: Beginning of the range which the chunk belongs to.
+        :param offset: Position of the chunk in the file.
+        :param chunk: The written data.
+        """
+        with self._lock:
+            self._written[start] = offset + len(chunk)
+            if offset == self._pos:
+                self._hasher.update(chunk)
+                self._pos += len(chunk)
+            self._catch_up()
+
+    def finish(self) -> None:
+        """Hash the rest of the file after all the ranges are written."""
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self) -> None:
+        while self._pos < self._size:
+            i = bisect.bisect_right(self._starts, self._pos) - 1
+            if i >= 0 and self._pos < self._ends[self._starts[i]]:
+                limit = self._written[self._starts[i]]
+            elif i + 1 < len(self._starts):
+                limit = self._starts[i + 1]
+            else:
+                limit = self._size
+            if limit <= self._pos:
+                return
+            with open(self._part, "rb") as fin:
+                fin.seek(self._pos)
+                self._hasher.update_from_file(fin, limit - self._pos)
+            self._pos = limit
+
+
+def _download_ranges(source: str, part: str, ranges: List[Tuple[int, int]],
+                     log: logging.Logger, chunk_size: int,
+                     hasher: Optional[StreamingChecksum] = None) -> None:
+    """
+    Fetch the byte ranges in parallel and write them to the preallocated part file. The \
+    unfinished ranges are persisted next to the part file so that the download can be resumed. \
+    If `hasher` is not None, it is fed with the whole file in order. Empty `ranges` mean that \
+    all the bytes are already written and only the state is finalized.
+    """
+    progress = {start: [start, end] for start, end in ranges}
+    lock = threading.Lock()
+    ordered = None
+    if hasher is not None:
+        ordered = _OrderedChecksum(hasher, part, ranges, os.path.getsize(part))
+
+    def save_progress():
+        with lock:
+            pending = [tuple(p) for p in progress.values() if p[0] < p[1]]
+            _write_pending_ranges(part, pending)
+
+    def fetch(start: int, end: int) -> None:
+        r = requests.get(source, stream=True, headers={"Range": "bytes=%d-%d" % (start, end - 1)})
+        if r.status_code == 200:
+            r.close()
+            raise RangesNotSupportedError
+        if r.status_code != 206:
+            log.error("Failed to fetch bytes %d-%d, code %s", start, end - 1, r.status_code)
+            raise ValueError
+        pos = start
+        try:
+            with open(part, "r+b") as f:
+                f.seek(start)
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        if ordered is not None:
+                            # the checksum may read the chunk back from the file
+                            f.flush()
+                            ordered.update(start, pos, chunk)
+                        pos += len(chunk)
+        finally:
+            progress[start][0] = min(pos, end)
+        if pos != end:
+            log.error("Bytes %d-%d were fetched incompletely: %d", start, end - 1, pos - start)
+            raise ValueError
+        log.debug("Fetched bytes %d-%d", start, end - 1)
+        save_progress()
+
+    if ranges:
+        log.info("Fetching in %d parallel parts", len(ranges))
+        save_progress()
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                for future in [pool.submit(fetch, start, end) for start, end in ranges]:
+                    future.result()
+        except BaseException:
+            save_progress()
+            raise
+    if ordered is not None:
+        ordered.finish()
+    os.remove(part + RANGES_SUFFIX)
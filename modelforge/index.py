@@ -1,7 +1,10 @@
+from contextlib import contextmanager
 import json
 import logging
 import os
 import shutil
+import threading
+import time
 from typing import Optional
 from urllib.parse import urlparse
 
@@ -12,6 +15,7 @@ from dulwich.repo import Repo
 from jinja2 import Template
 
 import modelforge.configuration as config
+from modelforge.locks import FileLock
 from modelforge.meta import LICENSES
 
 
@@ -26,9 +30,13 @@ class GitIndex:
     DCO_MESSAGE = "\n\nSigned-off-by: {name} <{email}>"
     INDEX_FILE = "index.json"  #: Models repository index file name.
     REMOTE_URL = "%s://%s%s/%s"  #: Remote repo url
+    SYNC_STAMP_SUFFIX = ".last-sync"  #: The mtime of this file is the time of the last sync.
+    SNAPSHOT_SUFFIX = ".index.json"  #: Copy of the index which was read after the last sync.
+    LOCK_SUFFIX = ".lock"  #: Lock file which serializes cloning, pulling and pushing.
 
     def __init__(self, remote: str=None, username: str=None, password: str=None,
                  cache: str=None, signoff: Optional[bool]=None, exists: bool=True,
+                 ttl: Optional[float]=None, offline: Optional[bool]=None,
                  log_level: int=logging.INFO):
         """
         Initialize a new instance of :class:`GitIndex`.
@@ -40,6 +48,11 @@ class GitIndex:
         :param signoff: Whether to add a DCO to the commit message.
         :param exists: Whether the Git remote exists or not. If it doesn't, we are initializing \
                        (allows to catch some errors).
+        :param ttl: Number of seconds after the last sync during which the cached index is \
+                    considered fresh and the remote is not checked. Defaults to \
+                    `configuration.INDEX_TTL`.
+        :param offline: Never access the network and read the cached index. Defaults to \
+                        `configuration.OFFLINE`.
         :param log_level: The logging level of this instance.
         :raise ValueError: If missing credential, incorrect url, incorrect credentials or index \
                JSON file is not found/unreadable.
@@ -53,6 +66,8 @@ class GitIndex:
         if not signoff:
             signoff = config.ALWAYS_SIGNOFF
         self.signoff = signoff
+        self.ttl = config.INDEX_TTL if ttl is None else ttl
+        self.offline = config.OFFLINE if offline is None else offline
         parsed_url = urlparse(remote)
         errmsg = "Invalid index URL: \"%s\"" % remote
         if not parsed_url.scheme or \
@@ -82,6 +97,8 @@ class GitIndex:
         else:
             self.remote_url = remote
         self.contents = {}
+        self._in_transaction = False
+        self._changed = False
         try:
             self.fetch()
         except NotGitRepository as e:
@@ -99,31 +116,80 @@ class GitIndex:
                     "%s does not exist or is unreadable, please run `init` command",
                     self.INDEX_FILE)
                 raise ValueError from e
-        self.models = self.contents.get("models", {})
-        self.meta = self.contents.get("meta", {})
+        self._set_contents(self.contents)
+
+    @property
+    def last_sync(self) -> Optional[float]:
+        """Return the UNIX timestamp of the last successful sync with the remote."""
+        try:
+            return os.stat(self.cached_repo + self.SYNC_STAMP_SUFFIX).st_mtime
+        except FileNotFoundError:
+            return None
 
     def fetch(self):
-        """Load from the associated Git repository."""
+        """
+        Load from the associated Git repository. Cloning and pulling are serialized between \
+        processes with a file lock. If syncing fails, the last good snapshot of the index \
+        is used.
+        """
         os.makedirs(os.path.dirname(self.cached_repo), exist_ok=True)
-        if not os.path.exists(self.cached_repo):
-            self._log.warning("Index not found, caching %s in %s", self.repo, self.cached_repo)
-            git.clone(self.remote_url, self.cached_repo, checkout=True)
+        if self.offline:
+            if not os.path.exists(self.cached_repo):
+                self._log.critical("Index is not cached in %s and the offline mode is on",
+                                   self.cached_repo)
+                raise FileNotFoundError(self.cached_repo)
+            self._log.debug("Index is cached in %s, offline mode", self.cached_repo)
+        elif self._is_fresh():
+            self._log.debug("Index is cached in %s and was synced %.1fs ago",
+                            self.cached_repo, time.time() - self.last_sync)
         else:
-            self._log.debug("Index is cached in %s", self.cached_repo)
             try:
-                diff = self._are_local_and_remote_heads_different()
+                self._sync()
             except Exception as e:
-                self._log.warning(
-                    "There was a problem with reading the cached index so cloning from "
-                    "scratch: %s: %s", type(e).__name__, e)
-                shutil.rmtree(self.cached_repo)
-                self.fetch()
+                try:
+                    self.contents = self._read_contents()
+                except FileNotFoundError:
+                    raise e from None
+                self._log.warning("Failed to sync the index, using the cached snapshot: %s: %s",
+                                  type(e).__name__, e)
                 return
-            if diff:
-                self._log.info("Cached index is not up to date, pulling %s", self. repo)
-                git.pull(self.cached_repo, self.remote_url)
-        with open(os.path.join(self.cached_repo, self.INDEX_FILE), encoding="utf-8") as _in:
-            self.contents = json.load(_in)
+        self.contents = self._read_contents()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Serialize the changes of the registry between processes. The index lock is held \
+        while the clone is synced with the remote regardless of the TTL, the registry is \
+        changed with :meth:`add_model()`, :meth:`remove_model()`, :meth:`reset()` and \
+        :meth:`update_readme()`, and :meth:`upload()` commits and pushes, so that the syncs \
+        of the other processes cannot interleave with the commit. If anything fails after \
+        the registry was changed, the clone is discarded and the next sync clones it again.
+
+        :raise ValueError: In the offline mode or if the sync fails.
+        """
+        if self.offline:
+            self._log.error("Cannot change the index in the offline mode")
+            raise ValueError("Cannot change the index in the offline mode")
+        with self._lock():
+            self._in_transaction = True
+            self._changed = False
+            try:
+                try:
+                    self._sync_locked()
+                except Exception as e:
+                    self._log.critical("Failed to sync the index: %s: %s", type(e).__name__, e)
+                    raise ValueError("Failed to sync the index") from e
+                try:
+                    self._set_contents(self._read_contents())
+                except FileNotFoundError:
+                    self._set_contents({})
+                yield self
+            except BaseException:
+                if self._changed:
+                    self._discard_clone()
+                raise
+            finally:
+                self._in_transaction = False
 
     def remove_model(self, model_uuid: str) -> dict:
         """Delete the model from the registry. Call `upload()` to update the remote side."""
@@ -136,6 +202,7 @@ class GitIndex:
         if model_type is None:
             self._log.error("Model not found, aborted")
             raise ValueError
+        self._changed = True
         model_directory = os.path.join(self.cached_repo, model_type)
         model_node = self.models[model_type]
         meta_node = self.meta[model_type]
@@ -155,6 +222,7 @@ class GitIndex:
     def add_model(self, model_type: str, model_uuid: str, meta: dict,
                   template_model: Template, update_default: bool=False):
         """Add a new model to the registry. Call `upload()` to update the remote side."""
+        self._changed = True
         if update_default or model_type not in self.meta:
             self.meta[model_type] = meta["default"]
         model_meta = meta["model"]
@@ -178,6 +246,7 @@ class GitIndex:
     def update_readme(self, template_readme: Template):
         """Generate the new README file locally."""
         readme = os.path.join(self.cached_repo, "README.md")
+        self._changed = True
         if os.path.exists(readme):
             os.remove(readme)
         links = {model_type: {} for model_type in self.models.keys()}
@@ -201,11 +270,26 @@ class GitIndex:
             elif os.path.isdir(path):
                 for model in os.listdir(path):
                     paths.append(os.path.join(path, model))
+        self._changed = True
         git.remove(self.cached_repo, paths)
-        self.contents = {"models": {}, "meta": {}}
+        self._set_contents({"models": {}, "meta": {}})
 
     def upload(self, cmd: str, meta: dict):
-        """Push the current state of the registry to Git."""
+        """
+        Push the current state of the registry to Git. Call it inside :meth:`transaction()`, \
+        otherwise only writing the index, committing and pushing are serialized.
+        """
+        if self.offline:
+            self._log.error("Cannot push the index in the offline mode")
+            raise ValueError("Cannot push the index in the offline mode")
+        if self._in_transaction:
+            self._upload(cmd, meta)
+        else:
+            with self._lock():
+                self._upload(cmd, meta)
+
+    def _upload(self, cmd: str, meta: dict):
+        self._changed = True
         index = os.path.join(self.cached_repo, self.INDEX_FILE)
         if os.path.exists(index):
             os.remove(index)
@@ -239,6 +323,8 @@ class GitIndex:
         if self._are_local_and_remote_heads_different():
             self._log.error("Push has failed")
             raise ValueError("Push has failed")
+        self._save_snapshot()
+        self._mark_synced()
 
     def load_template(self, template: str) -> Template:
         """Load a Jinja2 template from the source directory."""
@@ -258,6 +344,111 @@ class GitIndex:
         self._log.info("Loaded %s", template)
         return template_obj
 
+    def _is_fresh(self) -> bool:
+        last_sync = self.last_sync
+        return last_sync is not None and 0 <= time.time() - last_sync < self.ttl and \
+            os.path.exists(self.cached_repo)
+
+    def _lock(self) -> FileLock:
+        return FileLock(self.cached_repo + self.LOCK_SUFFIX, log=self._log)
+
+    def _sync(self):
+        last_sync = self.last_sync
+        with self._lock():
+            if os.path.exists(self.cached_repo) and self.last_sync != last_sync:
+                self._log.debug("Index in %s was synced by another process", self.cached_repo)
+                return
+            self._sync_locked()
+
+    def _sync_locked(self):
+        """Bring the clone up to date with the remote, the caller must hold the lock."""
+        if not os.path.exists(self.cached_repo):
+            self._log.warning("Index not found, caching %s in %s",
+                              self.repo, self.cached_repo)
+            self._clone()
+        else:
+            self._log.debug("Index is cached in %s", self.cached_repo)
+            try:
+                diff = self._are_local_and_remote_heads_different()
+            except Exception as e:
+                self._log.warning(
+                    "There was a problem with reading the cached index so cloning from "
+                    "scratch: %s: %s", type(e).__name__, e)
+                self._clone()
+                diff = False
+            if diff:
+                self._log.info("Cached index is not up to date, pulling %s", self.repo)
+                git.pull(self.cached_repo, self.remote_url)
+        self._save_snapshot()
+        self._mark_synced()
+
+    def _clone(self):
+        """
+        Clone the remote repository to a temporary directory and swap it with the cached one. \
+        The existing clone is kept if cloning fails.
+        """
+        suffix = ".%d-%d" % (os.getpid(), threading.get_ident())
+        tmp = self.cached_repo + ".tmp" + suffix
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            git.clone(self.remote_url, tmp, checkout=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if os.path.exists(self.cached_repo):
+            old = self.cached_repo + ".old" + suffix
+            os.rename(self.cached_repo, old)
+            os.rename(tmp, self.cached_repo)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.rename(tmp, self.cached_repo)
+
+    def _discard_clone(self):
+        """Remove the clone with the uncommitted or unpushed changes and the sync stamp."""
+        self._log.warning("Discarding the cached index in %s", self.cached_repo)
+        if os.path.exists(self.cached_repo):
+            old = "%s.old.%d-%d" % (self.cached_repo, os.getpid(), threading.get_ident())
+            os.rename(self.cached_repo, old)
+            shutil.rmtree(old, ignore_errors=True)
+        try:
+            os.remove(self.cached_repo + self.SYNC_STAMP_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def _set_contents(self, contents: dict):
+        self.contents = contents
+        self.models = contents.setdefault("models", {})
+        self.meta = contents.setdefault("meta", {})
+
+    def _read_contents(self) -> dict:
+        """Read the snapshot of the index, or the index from the clone if there is none."""
+        for path in (self.cached_repo + self.SNAPSHOT_SUFFIX,
+                     os.path.join(self.cached_repo, self.INDEX_FILE)):
+            try:
+                with open(path, encoding="utf-8") as _in:
+                    return json.load(_in)
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(os.path.join(self.cached_repo, self.INDEX_FILE))
+
+    def _save_snapshot(self):
+        """Atomically replace the snapshot with the index from the clone."""
+        snapshot = self.cached_repo + self.SNAPSHOT_SUFFIX
+        index = os.path.join(self.cached_repo, self.INDEX_FILE)
+        if not os.path.exists(index):
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            return
+        tmp = "%s.%d-%d" % (snapshot, os.getpid(), threading.get_ident())
+        shutil.copyfile(index, tmp)
+        os.replace(tmp, snapshot)
+
+    def _mark_synced(self):
+        stamp = self.cached_repo + self.SYNC_STAMP_SUFFIX
+        with open(stamp, "a"):
+            pass
+        os.utime(stamp)
+
     def _are_local_and_remote_heads_different(self):
         local_head = Repo(self.cached_repo).head()
         remote_head = git.ls_remote(self.remote_url)[b"HEAD"]
@@ -0,0 +1,102 @@
+import mmap
+import os
+import tempfile
+import types
+
+import asdf
+import asdf.block
+import asdf.constants
+import numpy
+
+from modelforge.chunked import is_chunked, unchunk_arrays
+from modelforge.compression import parallel_compression
+
+
+#: Alignment of the array data in the files written with :func:`align_blocks()`. \
+#: Page alignment is required to map the arrays without copying and implies the 64-byte \
+#: alignment of the first element which SIMD loads and cache lines prefer.
+PAGE_SIZE = max(mmap.PAGESIZE, 64)
+_BLOCK_HEADER_SIZE = asdf.block.Block._header.size + asdf.constants.BLOCK_HEADER_BOILERPLATE_SIZE
+
+
+def align_blocks(file: asdf.AsdfFile, alignment: int = PAGE_SIZE) -> asdf.AsdfFile:
+    """
+    Make the ASDF file write the data of each uncompressed block at an offset which \
+    is a multiple of `alignment`. The gaps are the padding between the tree and the first \
+    block and the allocated but unused space of the previous blocks, so any ASDF reader \
+    opens the file. Compressed blocks cannot be memory mapped, so they are written as usual.
+
+    :param file: The ASDF file which is about to be written.
+    :param alignment: Required alignment of the block data in bytes.
+    :return: `file`.
+    """
+    blocks = file.blocks
+    write_serial = blocks.write_internal_blocks_serial
+
+    def write_internal_blocks_serial(self, fd, pad_blocks=False):
+        internal = list(self.internal_blocks)
+        if not internal or any(block.output_compression for block in internal):
+            return write_serial(fd, pad_blocks)
+        fd.clear(-(fd.tell() + _BLOCK_HEADER_SIZE) % alignment)
+        for i, block in enumerate(internal):
+            if block.input_compression:
+                block.update_size()
+            padding = 0
+            if i < len(internal) - 1:
+                padding = -(block._size + _BLOCK_HEADER_SIZE) % alignment
+            block.allocated = block._size + padding
+            block.offset = fd.tell()
+            block.write(fd)
+            fd.clear(padding)
+
+    blocks.write_internal_blocks_serial = types.MethodType(write_internal_blocks_serial, blocks)
+    return file
+
+
+def is_aligned(arr: numpy.ndarray, alignment: int = PAGE_SIZE) -> bool:
+    """Check whether the array data starts at an address which is a multiple of `alignment`."""
+    return arr.__array_interface__["data"][0] % alignment == 0
+
+
+def is_compressed(file: asdf.AsdfFile) -> bool:
+    """Check whether the opened ASDF file contains compressed blocks or chunked arrays."""
+    if any(block.input_compression for block in file.blocks.internal_blocks):
+        return True
+    queue = [file.tree]
+    while queue:
+        node = queue.pop()
+        if is_chunked(node):
+            return True
+        if isinstance(node, dict):
+            queue.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            queue.extend(node)
+    return False
+
+
+def write_decompressed(source: str, output: str) -> bool:
+    """
+    Write the copy of the model file with all the arrays decompressed and page-aligned, \
+    see :func:`align_blocks()`. The output file appears atomically.
+
+    :param source: Path to the model file.
+    :param output: Path to the decompressed copy.
+    :return: False if the model is not compressed and the copy was not written, otherwise True.
+    """
+    with parallel_compression():
+        with asdf.open(source, lazy_load=True, copy_arrays=False) as file:
+            if not is_compressed(file):
+                return False
+            tree = unchunk_arrays({k: v for k, v in file.tree.items()
+                                   if k not in ("asdf_library", "history")})
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(output) + ".",
+                                       dir=os.path.dirname(output) or ".")
+            try:
+                with os.fdopen(fd, "wb") as fout, asdf.AsdfFile(tree) as copy:
+                    align_blocks(copy)
+                    copy.write_to(fout, all_array_compression=None)
+                os.replace(tmp, output)
+            except BaseException:
+                os.remove(tmp)
+                raise
+    return True
@@ -0,0 +1,111 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+
+class LockTimeoutError(TimeoutError):
+    """
+    The lock was not acquired in time.
+    """
+
+    pass
+
+
+class FileLock:
+    """
+    Inter-process exclusive lock backed by a POSIX record lock on a file. \
+    Unlike flock(), fcntl()/lockf() locks are supported by NFS, so the lock works for \
+    a cache directory which is shared between hosts. Record locks belong to the process, \
+    so the threads of the same process are additionally serialized with an in-process lock.
+    """
+
+    _thread_locks = {}
+    _thread_locks_guard = threading.Lock()
+    POLL_INTERVAL = 0.1  #: How often to retry acquiring the lock if there is a timeout.
+
+    def __init__(self, path: str, timeout: Optional[float] = None,
+                 log: Optional[logging.Logger] = None):
+        """
+        Initialize a new instance of :class:`FileLock`.
+
+        :param path: Path to the lock file. It is created if it does not exist and it is never \
+                     deleted, because deleting a lock file races with the other waiters.
+        :param timeout: Maximum number of seconds to wait, None means forever.
+        :param log: Logger to report the waiting.
+        """
+        self.path = os.path.abspath(path)
+        self.timeout = timeout
+        self._log = log if log is not None else logging.getLogger(type(self).__name__)
+        self._fd = None
+        with self._thread_locks_guard:
+            self._thread_lock = self._thread_locks.setdefault(self.path, threading.Lock())
+
+    @property
+    def locked(self) -> bool:
+        """Return True if this instance holds the lock."""
+        return self._fd is not None
+
+    def acquire(self) -> "FileLock":
+        """
+        Wait until the lock is free and take it.
+
+        :return: self
+        :raise LockTimeoutError: If the lock was not acquired in `timeout` seconds.
+        """
+        start = time.time()
+        if not self._thread_lock.acquire(timeout=-1 if self.timeout is None else self.timeout):
+            raise LockTimeoutError(self.path)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                self._lock(fd, start)
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        return self
+
+    def release(self) -> None:
+        """Free the lock."""
+        if self._fd is None:
+            return
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        """Acquire the lock."""
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Release the lock."""
+        self.release()
+
+    def _lock(self, fd: int, start: float) -> None:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except (BlockingIOError, PermissionError):
+            pass
+        self._log.info("Waiting for %s to be released by another process", self.path)
+        if self.timeout is None:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            return
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except (BlockingIOError, PermissionError):
+                if time.time() - start > self.timeout:
+                    raise LockTimeoutError(self.path) from None
@@ -1,4 +1,7 @@
+from copy import deepcopy
 from datetime import datetime, timezone
+from pprint import pformat
+from typing import Optional
 import uuid
 
 import humanize
@@ -71,7 +74,28 @@ def format_datetime(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d %H:%M:%S%z")
 
 
-def extract_model_meta(base_meta: dict, extra_meta: dict, model_url: str) -> dict:
+def format_meta(meta: dict, size: Optional[int]) -> str:
+    """
+    Format the metadata of a model as a string.
+
+    :param meta: Metadata dictionary.
+    :param size: Size of the model file. None means unknown.
+    :return: Pretty printed metadata.
+    """
+    meta = deepcopy(meta)
+    meta["created_at"] = format_datetime(meta["created_at"])
+    if size is not None:
+        meta["size"] = humanize.naturalsize(size)
+    try:
+        meta["environment"]["packages"] = \
+            " ".join("%s==%s" % tuple(p) for p in meta["environment"]["packages"])
+    except KeyError:
+        pass
+    return pformat(meta, width=1024)
+
+
+def extract_model_meta(base_meta: dict, extra_meta: dict, model_url: str,
+                       checksum: str = None) -> dict:
     """
     Merge the metadata from the backend and the extra metadata into a dict which is suitable for \
     `index.json`.
@@ -79,6 +103,7 @@ def extract_model_meta(base_meta: dict, extra_meta: dict, model_url: str) -> dic
     :param base_meta: tree["meta"] :class:`dict` containing data from the backend.
     :param extra_meta: dict containing data from the user, similar to `meta.json`.
     :param model_url: public URL of the model.
+    :param checksum: checksum of the model file, see :mod:`modelforge.checksum`.
     :return: converted dict.
     """
     meta = {"default": {"default": base_meta["uuid"],
@@ -92,5 +117,7 @@ def extract_model_meta(base_meta: dict, extra_meta: dict, model_url: str) -> dic
     response = requests.get(model_url, stream=True)
     meta["model"]["size"] = humanize.naturalsize(int(response.headers["content-length"]))
     meta["model"]["url"] = model_url
+    if checksum is not None:
+        meta["model"]["checksum"] = checksum
     meta["model"]["created_at"] = format_datetime(meta["model"]["created_at"])
     return meta
@@ -1,26 +1,36 @@
-from copy import deepcopy
 import inspect
+from io import BytesIO
 import logging
 import os
 from pathlib import Path
-from pprint import pformat
 import re
 import shutil
 import tempfile
-from typing import BinaryIO, Iterable, List, Optional, Tuple, Union
+from typing import Any, BinaryIO, Iterable, List, Mapping, Optional, Tuple, Union
 import uuid
 
 import asdf
+from asdf.tags.core.ndarray import NDArrayType
 import humanize
 import numpy
 import pygtrie
 import scipy.sparse
 
-from modelforge.backends import create_backend, download_file
+from modelforge.backends import download_file, download_file_prefix, get_default_backend
+from modelforge.buffer import BufferFile, read_buffer
+from modelforge.cache import get_model_cache
+from modelforge.chunked import chunk_arrays, DEFAULT_CHUNK_SIZE, is_chunked, unchunk_arrays
+from modelforge.codecs import ASDF_CODECS, AUTO_CODEC, Codec, get_codec
+from modelforge.compression import estimate_ratio, parallel_compression
+import modelforge.configuration as configuration
 from modelforge.configuration import vendor_cache_dir
 from modelforge.environment import collect_environment
-from modelforge.meta import check_license, format_datetime, generate_new_meta, get_datetime_now
+from modelforge.layout import align_blocks, write_decompressed
+from modelforge.meta import check_license, format_meta, generate_new_meta, get_datetime_now
+from modelforge.ragged import RaggedArray
+from modelforge.sparse import CompactSparseMatrix
 from modelforge.storage_backend import StorageBackend
+from modelforge.strings import StringArray
 
 
 class Model:
@@ -37,13 +47,34 @@ class Model:
     # The following fields *can* be defined in inherited classes
     LICENSE = "Proprietary"  #: License identifier (according to SPDX)
     NO_COMPRESSION = tuple()  #: Tree path prefixes which should not be compressed.
+    #: Pairs of tree path prefixes and codec specifications, e.g. \
+    #: `(("/ids/", "lz4"), ("/embeddings/", "zstd:19"))`, see :mod:`modelforge.codecs`.
+    #: The longest matching prefix wins, None disables the compression and "auto" chooses
+    #: between the default codec and no compression by sampling each array.
+    #: The rest of the arrays are compressed with `ARRAY_COMPRESSION`.
+    COMPRESSION_POLICY = tuple()
+    #: "auto" compression stores raw the arrays which shrink less than this.
+    AUTO_COMPRESSION_MIN_RATIO = 1.1
+    AUTO_COMPRESSION_SAMPLE_SIZE = 1 << 20  #: Bytes of each array which "auto" compresses.
+    #: Tree path prefixes of the arrays which are compressed in independent chunks.
+    #: Such arrays support random access with lazy loading, see :mod:`modelforge.chunked`.
+    CHUNKED_COMPRESSION = tuple()
+    #: Tree path prefixes of the numeric arrays whose bytes are shuffled by item before
+    #: the compression, this improves the ratio for floats and wide integers.
+    #: Such arrays are compressed in chunks, the same as `CHUNKED_COMPRESSION`.
+    SHUFFLE = tuple()
     # Note: "/" is automatically appended to all the compared paths.
     # Paths always start with a "/".
+    CHUNK_SIZE = DEFAULT_CHUNK_SIZE  #: Uncompressed size of the chunks in bytes.
+    #: Tree path prefixes which `load()` may skip with `include` and `exclude`.
+    #: `_load_tree()` must tolerate the absence of the corresponding keys.
+    OPTIONAL_PATHS = tuple()
 
     # The following fields *should not* be normally touched
     DEFAULT_NAME = "default"  #: When no uuid is specified, this is used.
     DEFAULT_FILE_EXT = ".asdf"  #: File extension of the model.
-    ARRAY_COMPRESSION = "lz4"  #: ASDF default compression, options: zlib, bzp2, lz4.
+    #: ASDF default compression, options: zlib, bzp2, lz4, auto and None.
+    ARRAY_COMPRESSION = "lz4"
     GENERIC_NAME = "generic"  #: Special name which allows to load any model.
 
     def __init__(self, **kwargs):
@@ -63,10 +94,16 @@ class Model:
         self._size = 0
         self._initial_version = None
         assert isinstance(self.NO_COMPRESSION, tuple), "NO_COMPRESSION must be a tuple"
-        self._compression_prefixes = pygtrie.PrefixSet(self.NO_COMPRESSION)
+        assert isinstance(self.COMPRESSION_POLICY, tuple), "COMPRESSION_POLICY must be a tuple"
+        assert isinstance(self.CHUNKED_COMPRESSION, tuple), "CHUNKED_COMPRESSION must be a tuple"
+        assert isinstance(self.SHUFFLE, tuple), "SHUFFLE must be a tuple"
+        assert isinstance(self.OPTIONAL_PATHS, tuple), "OPTIONAL_PATHS must be a tuple"
+        self._init_compression()
 
     def load(self, source: Union[str, BinaryIO, "Model"] = None, cache_dir: str = None,
-             backend: StorageBackend = None, lazy=False) -> "Model":
+             backend: StorageBackend = None, lazy=False,
+             cache_decompressed: Optional[bool] = None, zero_copy: bool = False,
+             include: Iterable[str] = None, exclude: Iterable[str] = None) -> "Model":
         """
         Build a new Model instance.
 
@@ -75,6 +112,18 @@ class Model:
         :param backend: Remote storage backend to use if ``source`` is a UUID or a URL.
         :param lazy: Do not really load numpy arrays into memory. Instead, mmap() them. \
                      User is expected to call Model.close() when the tree is no longer needed.
+        :param cache_decompressed: If the model is compressed and stored in the cache, \
+                                   write its decompressed and page-aligned copy next to it \
+                                   and read the copy instead on this and the following loads. \
+                                   None means `configuration.CACHE_DECOMPRESSED`.
+        :param zero_copy: Map the file privately or read the file object into one buffer \
+                          and make the uncompressed arrays read-only views of it instead of \
+                          copies; the compressed arrays are decompressed straight from \
+                          the buffer into their final allocations. Incompatible with ``lazy``.
+        :param include: Tree path prefixes to load, e.g. `["/vocabulary/"]`; None means all. \
+                        The other subtrees are neither read nor decompressed, they must be \
+                        in `OPTIONAL_PATHS`.
+        :param exclude: Tree path prefixes to skip, they must be in `OPTIONAL_PATHS`.
         """
         if isinstance(source, Model):
             if not isinstance(source, type(self)):
@@ -83,6 +132,9 @@ class Model:
             self.__dict__ = source.__dict__
             return self
 
+        if lazy and zero_copy:
+            raise ValueError("lazy and zero_copy are mutually exclusive")
+        partial = include is not None or exclude is not None
         if backend is not None and not isinstance(backend, StorageBackend):
             raise TypeError("backend must be an instance of "
                             "modelforge.storage_backend.StorageBackend")
@@ -101,14 +153,16 @@ class Model:
                 except (TypeError, ValueError):
                     is_uuid = False
                 model_id = self.DEFAULT_NAME if not is_uuid else source
+                checksum = None
                 file_name = model_id + self.DEFAULT_FILE_EXT
                 file_name = os.path.join(cache_dir, file_name)
-                if os.path.exists(file_name) and (not source or not os.path.exists(source)):
+                if (not source or not os.path.exists(source)) and \
+                        get_model_cache().lookup(file_name):
                     source = file_name
                 elif source is None or is_uuid:
                     if backend is None:
                         try:
-                            backend = create_backend()
+                            backend = get_default_backend()
                         except ValueError as e:
                             raise ValueError(
                                 "A backend must be set to load a UUID or the default model. The "
@@ -123,17 +177,21 @@ class Model:
                     else:
                         if not is_uuid:
                             raise ValueError("File path, URL or UUID is needed.")
-                        for models in config.values():
-                            if source in models:
-                                source = models[source]
-                                break
-                        else:
-                            raise FileNotFoundError("Model %s not found." % source)
+                        source = find_model_in_index(index, source)
+                    checksum = source.get("checksum")
                     source = source["url"]
                 if re.match(r"\w+://", source):
-                    download_file(source, file_name, self._log)
+                    with get_model_cache().lock(file_name):
+                        if os.path.exists(file_name):
+                            self._log.info("%s was fetched by another process", file_name)
+                        else:
+                            download_file(source, file_name, self._log, checksum=checksum)
                     self._source = source
                     source = file_name
+            if cache_decompressed is None:
+                cache_decompressed = configuration.CACHE_DECOMPRESSED
+            if isinstance(source, str) and cache_decompressed:
+                source = self._get_decompressed(source)
             if isinstance(source, str):
                 size = os.stat(source).st_size
             else:
@@ -142,35 +200,78 @@ class Model:
                 size = source.seek(0, os.SEEK_END) - pos
                 source.seek(pos, os.SEEK_SET)
             self._log.info("Reading %s (%s)...", source, humanize.naturalsize(size))
-            model = asdf.open(source, copy_arrays=not lazy, lazy_load=lazy)
-            try:
-                tree = model.tree
-                self._meta = tree["meta"]
-                self._initial_version = list(self.version)
-                if not generic:
-                    meta_name = self._meta["model"]
-                    matched = self.NAME == meta_name
-                    if not matched:
-                        needed = {self.NAME}
-                        for child in type(self).__subclasses__():
-                            needed.add(child.NAME)
-                            matched |= child.NAME == meta_name
-                        if not matched:
-                            raise ValueError(
-                                "The supplied model is of the wrong type: needed "
-                                "%s, got %s." % (needed, meta_name))
-                self._load_tree(tree)
-            finally:
-                if not lazy:
-                    model.close()
+            with parallel_compression():
+                # the blocks of the skipped subtrees are never read with lazy_load
+                if zero_copy:
+                    model = asdf.open(BufferFile(read_buffer(source)), lazy_load=partial)
                 else:
-                    self._asdf = model
+                    model = asdf.open(source, copy_arrays=not lazy, lazy_load=lazy or partial)
+                try:
+                    tree = model.tree
+                    self._meta = tree["meta"]
+                    self._initial_version = list(self.version)
+                    if not generic:
+                        meta_name = self._meta["model"]
+                        matched = self.NAME == meta_name
+                        if not matched:
+                            needed = {self.NAME}
+                            for child in type(self).__subclasses__():
+                                needed.add(child.NAME)
+                                matched |= child.NAME == meta_name
+                            if not matched:
+                                raise ValueError(
+                                    "The supplied model is of the wrong type: needed "
+                                    "%s, got %s." % (needed, meta_name))
+                    if partial:
+                        tree = self._select_tree(tree, include, exclude)
+                        if not lazy:
+                            tree = _read_arrays(tree)
+                    self._load_tree(unchunk_arrays(tree, lazy=lazy))
+                finally:
+                    if not lazy:
+                        model.close()
+                    else:
+                        self._asdf = model
         finally:
             if generic and cache_dir is not None:
                 shutil.rmtree(cache_dir)
         self._size = size
         return self
 
+    def _get_decompressed(self, path: str) -> str:
+        """
+        Find or create the decompressed copy of the cached model file.
+
+        :param path: Path to the model file.
+        :return: Path to the decompressed copy or `path` if the model is not cached or \
+                 not compressed.
+        """
+        cache = get_model_cache()
+        if not cache.manages(path) or path.endswith(cache.DECOMPRESSED_SUFFIX):
+            return path
+        copy = cache.decompressed_path(path)
+        marker = cache.uncompressed_marker_path(path)
+        # the copy is not a separate model, so neither a hit nor a miss is counted
+        if os.path.exists(marker):
+            return path
+        try:
+            cache.touch(copy)
+            return copy
+        except FileNotFoundError:
+            pass
+        with cache.lock(copy):
+            if os.path.exists(marker):
+                return path
+            if not os.path.exists(copy):
+                cache.remove_stale_decompressed(path)
+                self._log.info("Decompressing %s to %s", path, copy)
+                if not write_decompressed(path, copy):
+                    self._log.debug("%s is not compressed", path)
+                    open(marker, "wb").close()
+                    return path
+                cache.add(copy, keep=(path,))
+        return copy
+
     @property
     def meta(self):
         """
@@ -178,6 +279,60 @@ class Model:
         """
         return self._meta
 
+    @staticmethod
+    def peek_meta(source: Union[str, BinaryIO], backend: StorageBackend = None) -> dict:
+        """
+        Read the metadata of the model without loading it. Only the YAML header of the ASDF \
+        file is read and parsed, the array blocks are skipped.
+
+        :param source: UUID, file system path, file object or an URL. The position of the \
+                       file object is restored.
+        :param backend: Remote storage backend to use if ``source`` is a UUID.
+        :return: Metadata dictionary.
+        """
+        return Model.peek(source, backend)[0]
+
+    @staticmethod
+    def peek(source: Union[str, BinaryIO], backend: StorageBackend = None,
+             log: logging.Logger = None) -> Tuple[dict, Optional[int]]:
+        """
+        Read the metadata and the size of the model without loading it. If ``source`` is \
+        a UUID or an URL, only the leading bytes of the remote file are fetched with HTTP \
+        Range requests until the YAML header ends.
+
+        :param source: UUID, file system path, file object or an URL. The position of the \
+                       file object is restored.
+        :param backend: Remote storage backend to use if ``source`` is a UUID.
+        :param log: Logger to report the downloads.
+        :return: Metadata dictionary and the size of the model file (None if the server \
+                 did not report it).
+        """
+        if log is None:
+            log = logging.getLogger(Model.GENERIC_NAME)
+        if isinstance(source, (str, Path)) and os.path.isfile(source):
+            with open(source, "rb") as fin:
+                header = read_asdf_header(fin)
+            size = os.stat(source).st_size
+        elif isinstance(source, str):
+            try:
+                uuid.UUID(source)
+            except ValueError:
+                if not re.match(r"\w+://", source):
+                    raise FileNotFoundError("%s is neither a file, a UUID nor an URL." % source)
+            else:
+                if backend is None:
+                    backend = get_default_backend()
+                source = find_model_in_index(backend.index.contents, source)["url"]
+            header, size = download_file_prefix(source, ASDF_HEADER_END, log)
+        else:
+            pos = source.tell()
+            try:
+                header = read_asdf_header(source)
+                size = source.seek(0, os.SEEK_END) - pos
+            finally:
+                source.seek(pos, os.SEEK_SET)
+        return parse_asdf_header(header)["meta"], size
+
     @property
     def source(self):
         """
@@ -271,15 +426,7 @@ class Model:
             return repr(self)
         if dump:
             dump = "\n" + dump
-        meta = deepcopy(self.meta)
-        meta["created_at"] = format_datetime(meta["created_at"])
-        meta["size"] = humanize.naturalsize(self.size)
-        try:
-            meta["environment"]["packages"] = \
-                " ".join("%s==%s" % tuple(p) for p in self.environment["packages"])
-        except KeyError:
-            pass
-        return "%s%s" % (pformat(meta, width=1024), dump)
+        return "%s%s" % (format_meta(self.meta, self.size), dump)
 
     def __repr__(self):
         """Format model object as a string."""
@@ -333,7 +480,7 @@ class Model:
         self._asdf = None
         for key in ("_meta", "_source", "_size", "_initial_version"):
             setattr(self, key, state[key])
-        self._compression_prefixes = pygtrie.PrefixSet(self.NO_COMPRESSION)
+        self._init_compression()
         self._load_tree(state["tree"])
 
     def get_dep(self, name: str) -> str:
@@ -368,7 +515,8 @@ class Model:
         raise NotImplementedError()
 
     def save(self, output: Union[str, BinaryIO], series: Optional[str] = None,
-             deps: Iterable=tuple(), create_missing_dirs: bool=True) -> "Model":
+             deps: Iterable=tuple(), create_missing_dirs: bool=True,
+             aligned: bool = False) -> "Model":
         """
         Serialize the model to a file.
 
@@ -378,6 +526,9 @@ class Model:
         :param deps: List of the dependencies.
         :param create_missing_dirs: create missing directories in output path if the output is a \
                                     path.
+        :param aligned: Write all the arrays uncompressed and page-aligned, so that \
+                        `load(lazy=True)` maps them into memory without copying and \
+                        the processes which load the same file share the physical pages.
         :return: self
         """
         check_license(self.license)
@@ -392,22 +543,29 @@ class Model:
                 os.makedirs(dirs, exist_ok=True)
         self.set_dep(*deps)
         tree = self._generate_tree()
-        self._write_tree(tree, output)
+        self._write_tree(tree, output, aligned=aligned)
         self._initial_version = self.version
         return self
 
-    def _write_tree(self, tree: dict, output: Union[str, BinaryIO], file_mode: int=0o666) -> None:
+    def _write_tree(self, tree: dict, output: Union[str, BinaryIO], file_mode: int=0o666,
+                    aligned: bool = False) -> None:
         """
         Write the model to disk.
 
         :param tree: The data dict - will be the ASDF tree.
         :param output: The output file path or a file object.
         :param file_mode: The output file's permissions.
+        :param aligned: Write the arrays uncompressed and page-aligned, see \
+                        :func:`modelforge.layout.align_blocks()`.
         :return: None
         """
         self.meta["created_at"] = get_datetime_now()
         meta = self.meta.copy()
         meta["environment"] = collect_environment()
+        if not aligned and (self.CHUNKED_COMPRESSION or self.COMPRESSION_POLICY or self.SHUFFLE):
+            tree = chunk_arrays(tree, self._get_chunk_codec, self.CHUNK_SIZE,
+                                shuffle=lambda path: path in self._shuffle_prefixes)
+        codecs = []
         final_tree = {}
         final_tree.update(tree)
         final_tree["meta"] = meta
@@ -422,10 +580,15 @@ class Model:
             pos = output.tell()
         try:
             with asdf.AsdfFile(final_tree) as file:
-                queue = [("", tree)]
+                if aligned:
+                    self._log.debug("writing uncompressed page-aligned arrays")
+                    align_blocks(file)
+                queue = [("", tree)] if not aligned else []
                 while queue:
                     path, element = queue.pop()
-                    if isinstance(element, dict):
+                    if is_chunked(element):
+                        self._log.debug("%s/ -> chunked compression", path)
+                    elif isinstance(element, dict):
                         for key, val in element.items():
                             queue.append((path + "/" + key, val))
                     elif isinstance(element, (list, tuple)):
@@ -433,17 +596,130 @@ class Model:
                             queue.append((path, child))
                     elif isinstance(element, numpy.ndarray):
                         path += "/"
-                        if path not in self._compression_prefixes:
-                            self._log.debug("%s -> %s compression", path, self.ARRAY_COMPRESSION)
-                            file.set_array_compression(element, self.ARRAY_COMPRESSION)
-                        else:
+                        codec = self._get_codec(path, element)
+                        if codec is not None and codec.ASDF_COMPRESSION is None:
+                            self._log.warning("%s -> %s is not supported for %s, falling back "
+                                              "to %s", path, codec, element.dtype,
+                                              self._default_codec)
+                            codec = self._default_codec
+                        if codec is None:
                             self._log.debug("%s -> compression disabled", path)
-                file.write_to(output)
+                        elif codec is self._default_codec:
+                            self._log.debug("%s -> %s compression", path, codec.ASDF_COMPRESSION)
+                            file.set_array_compression(element, codec.ASDF_COMPRESSION)
+                        else:
+                            self._log.debug("%s -> %s compression", path, codec)
+                            file.set_array_compression(element, codec.ASDF_COMPRESSION)
+                            codecs.append((element, codec))
+                with parallel_compression(codecs=codecs):
+                    file.write_to(output)
             self._size = output.seek(0, os.SEEK_END) - pos
         finally:
             if not isfileobj:
                 output.close()
 
+    def _init_compression(self) -> None:
+        self._compression_prefixes = pygtrie.PrefixSet(self.NO_COMPRESSION)
+        self._chunked_prefixes = pygtrie.PrefixSet(self.CHUNKED_COMPRESSION)
+        self._shuffle_prefixes = pygtrie.PrefixSet(self.SHUFFLE)
+        self._compression_policy = pygtrie.CharTrie(
+            (prefix, spec if spec == AUTO_CODEC else get_codec(spec))
+            for prefix, spec in self.COMPRESSION_POLICY)
+        if self.ARRAY_COMPRESSION == AUTO_CODEC:
+            self._default_rule = AUTO_CODEC
+            self._default_codec = get_codec(ASDF_CODECS["lz4"])
+        elif self.ARRAY_COMPRESSION is None or self.ARRAY_COMPRESSION in ASDF_CODECS:
+            self._default_codec = self._default_rule = get_codec(
+                ASDF_CODECS.get(self.ARRAY_COMPRESSION))
+        else:
+            raise ValueError(
+                "Unsupported ARRAY_COMPRESSION: %s. Supported compression types are: %s, %s, "
+                "None. Use COMPRESSION_POLICY for the other codecs." % (
+                    self.ARRAY_COMPRESSION, ", ".join(sorted(ASDF_CODECS)), AUTO_CODEC))
+
+    def _get_rule(self, path: str) -> Union[Codec, str, None]:
+        """Return the codec, `AUTO_CODEC` or None which the policy assigns to the tree path."""
+        if path in self._compression_prefixes:
+            return None
+        rules = list(self._compression_policy.prefixes(path))
+        if rules:
+            _, rule = rules[-1]
+            return rule
+        return self._default_rule
+
+    def _get_codec(self, path: str, arr: numpy.ndarray) -> Optional[Codec]:
+        """
+        Pick the codec for the array.
+
+        :param path: Tree path of the array, e.g. "/key/subkey/".
+        :param arr: The array to compress.
+        :return: :class:`modelforge.codecs.Codec` or None if the array must not be compressed.
+        """
+        codec = self._get_rule(path)
+        if codec != AUTO_CODEC:
+            return codec
+        codec = self._default_codec
+        ratio = estimate_ratio(arr, codec, self.AUTO_COMPRESSION_SAMPLE_SIZE)
+        if ratio < self.AUTO_COMPRESSION_MIN_RATIO:
+            codec = None
+        self._log.debug("%s -> auto: %s, sampled ratio %.2f", path, codec or "no compression",
+                        ratio)
+        return codec
+
+    def _get_chunk_codec(self, path: str, arr: numpy.ndarray) -> Optional[Codec]:
+        """Return the codec to compress the chunks of the array or None to keep it whole."""
+        if path in self._chunked_prefixes or path in self._shuffle_prefixes:
+            return self._get_codec(path, arr)
+        codec = self._get_rule(path)
+        if isinstance(codec, Codec) and codec.ASDF_COMPRESSION is None:
+            return codec
+        return None
+
+    def _select_tree(self, tree: dict, include: Optional[Iterable[str]],
+                     exclude: Optional[Iterable[str]]) -> dict:
+        """
+        Remove the subtrees which are not included or are excluded.
+
+        :param tree: asdf file tree.
+        :param include: Tree path prefixes to keep, None means all.
+        :param exclude: Tree path prefixes to remove.
+        :return: The new tree, the unchanged subtrees are not copied.
+        :raise ValueError: If a removed subtree is not in `OPTIONAL_PATHS`.
+        """
+        if include is not None:
+            include = list(include)
+            included = pygtrie.PrefixSet(include)
+            include_trie = pygtrie.CharTrie.fromkeys(include)
+        exclude = list(exclude or tuple())
+        excluded = pygtrie.PrefixSet(exclude)
+        exclude_trie = pygtrie.CharTrie.fromkeys(exclude)
+        optional = pygtrie.PrefixSet(self.OPTIONAL_PATHS)
+
+        def select(node: dict, path: str) -> dict:
+            result = {}
+            for key, val in node.items():
+                subpath = path + key + "/"
+                if path == "/" and key in ("meta", "asdf_library", "history"):
+                    result[key] = val
+                    continue
+                if subpath not in excluded:
+                    whole = include is None or subpath in included
+                    if whole and not exclude_trie.has_subtrie(subpath):
+                        result[key] = val
+                        continue
+                    # descend if something below is included or excluded
+                    if isinstance(val, dict) and (
+                            whole or include_trie.has_subtrie(subpath)):
+                        result[key] = select(val, subpath)
+                        continue
+                if subpath not in optional:
+                    raise ValueError("%s cannot be skipped: it is not in OPTIONAL_PATHS of %s" %
+                                     (subpath, type(self).__name__))
+                self._log.debug("skipped %s", subpath)
+            return result
+
+        return select(tree, "/")
+
     def _generate_tree(self) -> dict:
         """
         Return the tree to store in ASDF file.
@@ -462,6 +738,69 @@ class Model:
         raise NotImplementedError()
 
 
+ASDF_HEADER_END = b"\n...\n"  #: YAML document end marker which precedes the binary blocks.
+
+
+def _read_arrays(tree):
+    """
+    Replace the lazily loaded arrays in the tree with numpy arrays so that they outlive \
+    the ASDF file.
+    """
+    if isinstance(tree, dict):
+        return {key: _read_arrays(val) for key, val in tree.items()}
+    if isinstance(tree, (list, tuple)):
+        return type(tree)(_read_arrays(val) for val in tree)
+    if isinstance(tree, NDArrayType):
+        return numpy.asarray(tree)
+    return tree
+
+
+def read_asdf_header(stream: BinaryIO, chunk_size: int = 65536) -> bytes:
+    """
+    Read the YAML header of an ASDF file and stop before the binary blocks.
+
+    :param stream: Binary file object positioned at the beginning of the ASDF file.
+    :param chunk_size: Size of the read buffer.
+    :return: The header bytes including the YAML document end marker.
+    """
+    header = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return bytes(header)
+        search_start = max(0, len(header) - len(ASDF_HEADER_END) + 1)
+        header += chunk
+        pos = header.find(ASDF_HEADER_END, search_start)
+        if pos >= 0:
+            return bytes(header[:pos + len(ASDF_HEADER_END)])
+
+
+def find_model_in_index(index: dict, model_id: str) -> dict:
+    """
+    Find the model with the given UUID among all the model types in the index.
+
+    :param index: Contents of the index, see :attr:`modelforge.index.GitIndex.contents`.
+    :param model_id: UUID of the model.
+    :return: Index entry of the model with "url" and other metadata.
+    :raise FileNotFoundError: If there is no such model.
+    """
+    for models in index["models"].values():
+        if model_id in models:
+            return models[model_id]
+    raise FileNotFoundError("Model %s not found." % model_id)
+
+
+def parse_asdf_header(header: bytes) -> dict:
+    """
+    Parse the YAML header of an ASDF file without the binary blocks.
+
+    :param header: The bytes returned by :func:`read_asdf_header()`.
+    :return: ASDF tree. The arrays in it cannot be accessed.
+    """
+    with asdf.open(BytesIO(header), lazy_load=True, copy_arrays=False) as file:
+        return file.tree
+
+
 def merge_strings(list_of_strings: Union[List[str], Tuple[str]]) -> dict:
     """
     Pack the list of strings into two arrays: the concatenated chars and the \
@@ -482,29 +821,31 @@ def merge_strings(list_of_strings: Union[List[str], Tuple[str]]) -> dict:
     if with_str:
         if not isinstance(list_of_strings[0], str):
             raise TypeError("list_of_strings must contain either bytes or strings")
-        strings = numpy.array(["".join(list_of_strings).encode("utf-8")])
+        merged = "".join(list_of_strings).encode("utf-8")
     else:
-        merged = bytearray(sum(len(s) for s in list_of_strings))
-        offset = 0
-        for s in list_of_strings:
-            merged[offset:offset + len(s)] = s
-            offset += len(s)
+        merged = b"".join(list_of_strings)
+    if merged:
+        # frombuffer() does not copy the merged bytes unlike array()
         strings = numpy.frombuffer(merged, dtype="S%d" % len(merged))
-    lengths = [0] * len(list_of_strings)
-    for i, s in enumerate(list_of_strings):
-        lengths[i] = len(s)
-    lengths = squeeze_bits(numpy.array(lengths, dtype=int))
+    else:
+        strings = numpy.array([merged])
+    lengths = squeeze_bits(numpy.fromiter(map(len, list_of_strings), dtype=int,
+                                          count=len(list_of_strings)))
     return {"strings": strings, "lengths": lengths, "str": with_str}
 
 
-def split_strings(subtree: dict) -> List[str]:
+def split_strings(subtree: dict, lazy: bool = False) -> Union[List[str], StringArray]:
     """
     Produce the list of strings from the dictionary with concatenated chars \
     and lengths. Opposite to :func:`merge_strings()`.
 
     :param subtree: The dict with "strings" and "lengths".
+    :param lazy: Return the :class:`modelforge.strings.StringArray` which decodes \
+                 the strings on access instead of the list.
     :return: :class:`list` of :class:`str`-s or :class:`bytes`.
     """
+    if lazy:
+        return StringArray(subtree)
     strings = subtree["strings"]
     lengths = subtree["lengths"]
     if lengths.shape[0] == 0 and strings.shape[0] == 0:
@@ -520,6 +861,60 @@ def split_strings(subtree: dict) -> List[str]:
     return result
 
 
+def merge_mapping(mapping: Mapping[Union[str, bytes], Any], dtype=None) -> dict:
+    """
+    Pack the dict from strings to numbers into the arrays which \
+    :class:`modelforge.strings.StringMap` looks up without unpacking. The keys are sorted \
+    and merged with :func:`merge_strings()` together with their byte offsets; the values \
+    are stored in the same order.
+
+    :param mapping: The mapping to pack. The keys are either all :class:`str`-s \
+                    or all :class:`bytes`.
+    :param dtype: The dtype of the values array; None means auto.
+    :return: :class:`dict` with "keys" and "values".
+    """
+    keys = sorted(mapping)
+    values = numpy.array([mapping[key] for key in keys], dtype=dtype)
+    if values.dtype.kind not in "biufc" or values.ndim != 1:
+        raise TypeError("mapping values must be numbers")
+    merged = merge_strings(keys)
+    merged["offsets"] = squeeze_bits(StringArray(merged).offsets)
+    return {"keys": merged, "values": values}
+
+
+def merge_ragged(arrays: Union[List[numpy.ndarray], Tuple[numpy.ndarray]]) -> dict:
+    """
+    Pack the list of 1-D arrays of different lengths into two arrays: the concatenated \
+    values and the cumulative offsets. :func:`split_ragged()` does the inverse.
+
+    :param arrays: The :class:`tuple` or :class:`list` of 1-D arrays to pack.
+    :return: :class:`dict` with "values" and "offsets" :class:`numpy.ndarray`-s.
+    """
+    if not isinstance(arrays, (tuple, list)):
+        raise TypeError("arrays must be either a tuple or a list")
+    arrays = [numpy.asarray(arr) for arr in arrays]
+    if any(arr.ndim != 1 for arr in arrays):
+        raise ValueError("arrays must be one-dimensional")
+    offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.fromiter(map(len, arrays), dtype=numpy.int64, count=len(arrays)),
+                 out=offsets[1:])
+    values = numpy.concatenate(arrays) if arrays else numpy.array([])
+    return {"values": values, "offsets": squeeze_bits(offsets)}
+
+
+def split_ragged(subtree: dict, lazy: bool = False) -> Union[List[numpy.ndarray], RaggedArray]:
+    """
+    Produce the list of arrays from the dictionary with concatenated values and offsets. \
+    Opposite to :func:`merge_ragged()`.
+
+    :param subtree: The dict with "values" and "offsets".
+    :param lazy: Return the :class:`modelforge.ragged.RaggedArray` instead of the list.
+    :return: :class:`list` of :class:`numpy.ndarray`-s which are the views of the values.
+    """
+    arr = RaggedArray(subtree)
+    return arr if lazy else arr.tolist()
+
+
 def disassemble_sparse_matrix(matrix: scipy.sparse.spmatrix) -> dict:
     """
     Transform a scipy.sparse matrix into the serializable collection of \
@@ -545,7 +940,8 @@ def disassemble_sparse_matrix(matrix: scipy.sparse.spmatrix) -> dict:
     return result
 
 
-def assemble_sparse_matrix(subtree: dict) -> scipy.sparse.spmatrix:
+def assemble_sparse_matrix(subtree: dict, compact: bool = False) \
+        -> Union[scipy.sparse.spmatrix, CompactSparseMatrix]:
     """
     Transform a dictionary with "shape", "format" and "data" into the \
     :mod:`scipy.sparse` matrix. \
@@ -553,8 +949,12 @@ def assemble_sparse_matrix(subtree: dict) -> scipy.sparse.spmatrix:
 
     :param subtree: :class:`dict` which describes the :mod:`scipy.sparse` \
                     matrix.
+    :param compact: Return the :class:`modelforge.sparse.CompactSparseMatrix` which keeps \
+                    the squeezed indices instead of the up-cast copy; csr and csc only.
     :return: :mod:`scipy.sparse` matrix of the specified format.
     """
+    if compact:
+        return CompactSparseMatrix(subtree)
     matrix_class = getattr(scipy.sparse, "%s_matrix" % subtree["format"])
     if subtree["format"] in ("csr", "csc"):
         indptr = subtree["data"][2]
@@ -0,0 +1,73 @@
+from collections.abc import Sequence
+import operator
+from typing import List, Union
+
+import numpy
+
+from modelforge.chunked import ChunkedArray
+
+
+class RaggedArray(Sequence):
+    """
+    Read-only sequence of the 1-D arrays packed with :func:`modelforge.model.merge_ragged()`. \
+    The elements are the views of the concatenated values, so nothing is copied if the model \
+    is loaded with `lazy=True` and the values are memory mapped. Chunked values are \
+    decompressed only for the accessed elements.
+    """
+
+    def __init__(self, subtree: dict):
+        """
+        Initialize a new instance of :class:`RaggedArray`.
+
+        :param subtree: The dict with "values" and "offsets" produced by \
+                        :func:`modelforge.model.merge_ragged()`.
+        """
+        values = subtree["values"]
+        self._values = values if isinstance(values, ChunkedArray) else numpy.asarray(values)
+        self._offsets = numpy.asarray(subtree["offsets"])
+
+    @property
+    def values(self) -> Union[numpy.ndarray, ChunkedArray]:
+        """Return the concatenated elements."""
+        return self._values
+
+    @property
+    def offsets(self) -> numpy.ndarray:
+        """Return the cumulative offsets of the elements, including the total size."""
+        return self._offsets
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        """Return the dtype of the elements."""
+        return self._values.dtype
+
+    @property
+    def lengths(self) -> numpy.ndarray:
+        """Return the length of each element."""
+        return numpy.diff(self._offsets.astype(numpy.int64))
+
+    def __len__(self) -> int:
+        """Return the number of elements."""
+        return len(self._offsets) - 1
+
+    def __repr__(self) -> str:
+        """Describe the array without reading the values."""
+        return "RaggedArray(size=%d, dtype=%s)" % (len(self), self.dtype)
+
+    def __getitem__(self, item) -> Union[numpy.ndarray, List[numpy.ndarray]]:
+        """Return the element at the given index or the list of elements in the given slice."""
+        if isinstance(item, slice):
+            return [self._get(i) for i in range(*item.indices(len(self)))]
+        index = operator.index(item)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("index %d is out of range [0, %d)" % (item, len(self)))
+        return self._get(index)
+
+    def tolist(self) -> List[numpy.ndarray]:
+        """Return all the elements, the same as :func:`modelforge.model.split_ragged()`."""
+        return self[:]
+
+    def _get(self, index: int) -> numpy.ndarray:
+        return self._values[int(self._offsets[index]):int(self._offsets[index + 1])]
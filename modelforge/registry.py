@@ -6,9 +6,10 @@ import os
 from dateutil.parser import parse as parse_datetime
 
 from modelforge.backends import supply_backend
+from modelforge.checksum import calculate_checksum
 from modelforge.index import GitIndex
 from modelforge.meta import extract_model_meta
-from modelforge.models import GenericModel
+from modelforge.model import Model
 from modelforge.storage_backend import ExistingBackendError, ModelAlreadyExistsError, \
     StorageBackend
 
@@ -29,9 +30,10 @@ def initialize_registry(args: argparse.Namespace, backend: StorageBackend, log:
         return 1
 
     log.info("Resetting the index ...")
-    backend.index.reset()
     try:
-        backend.index.upload("reset", {})
+        with backend.index.transaction():
+            backend.index.reset()
+            backend.index.upload("reset", {})
     except ValueError:
         return 1
     log.info("Successfully initialized")
@@ -51,14 +53,15 @@ def publish_model(args: argparse.Namespace, backend: StorageBackend, log: loggin
     """
     path = os.path.abspath(args.model)
     try:
-        model = GenericModel(source=path, dummy=True)
-    except ValueError as e:
+        base_meta = Model.peek_meta(path)
+    except (FileNotFoundError, IsADirectoryError, ValueError) as e:
         log.critical('"model" must be a path: %s', e)
         return 1
     except Exception as e:
         log.critical("Failed to load the model: %s: %s" % (type(e).__name__, e))
         return 1
-    base_meta = model.meta
+    checksum = calculate_checksum(path)
+    log.info("Checksum: %s", checksum)
     try:
         model_url = backend.upload_model(path, base_meta, args.force)
     except ModelAlreadyExistsError:
@@ -68,17 +71,19 @@ def publish_model(args: argparse.Namespace, backend: StorageBackend, log: loggin
     with open(os.path.join(args.meta), encoding="utf-8") as _in:
         extra_meta = json.load(_in)
     model_type, model_uuid = base_meta["model"], base_meta["uuid"]
-    meta = extract_model_meta(base_meta, extra_meta, model_url)
+    meta = extract_model_meta(base_meta, extra_meta, model_url, checksum)
     log.info("Updating the models index...")
     try:
         template_model = backend.index.load_template(args.template_model)
         template_readme = backend.index.load_template(args.template_readme)
     except ValueError:
         return 1
-    backend.index.add_model(model_type, model_uuid, meta, template_model, args.update_default)
-    backend.index.update_readme(template_readme)
     try:
-        backend.index.upload("add", {"model": model_type, "uuid": model_uuid})
+        with backend.index.transaction():
+            backend.index.add_model(model_type, model_uuid, meta, template_model,
+                                    args.update_default)
+            backend.index.update_readme(template_readme)
+            backend.index.upload("add", {"model": model_type, "uuid": model_uuid})
     except ValueError:  # TODO: replace with PorcelainError, see related TODO in index.py:181
         return 1
     log.info("Successfully published")
@@ -94,7 +99,8 @@ def list_models(args: argparse.Namespace):
     """
     try:
         git_index = GitIndex(remote=args.index_repo, username=args.username,
-                             password=args.password, cache=args.cache, log_level=args.log_level)
+                             password=args.password, cache=args.cache,
+                             offline=getattr(args, "offline", None), log_level=args.log_level)
     except ValueError:
         return 1
     for model_type, models in git_index.models.items():
@@ -120,15 +126,13 @@ def delete_model(args: argparse.Namespace, backend: StorageBackend, log: logging
     :return: None
     """
     try:
-        meta = backend.index.remove_model(args.input)
         template_readme = backend.index.load_template(args.template_readme)
-        backend.index.update_readme(template_readme)
-    except ValueError:
-        return 1
-    backend.delete_model(meta)
-    log.info("Updating the models index...")
-    try:
-        backend.index.upload("delete", meta)
+        with backend.index.transaction():
+            meta = backend.index.remove_model(args.input)
+            backend.index.update_readme(template_readme)
+            backend.delete_model(meta)
+            log.info("Updating the models index...")
+            backend.index.upload("delete", meta)
     except ValueError:  # TODO: replace with PorcelainError
         return 1
     log.info("Successfully deleted")
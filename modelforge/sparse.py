@@ -0,0 +1,172 @@
+import operator
+from typing import Iterator, Tuple, Union
+
+import numpy
+import scipy.sparse
+
+from modelforge.chunked import ChunkedArray
+
+
+#: Maximum number of nonzeros converted to scipy at once by :meth:`CompactSparseMatrix.dot()`.
+DOT_BLOCK_NNZ = 1 << 20
+
+
+class CompactSparseMatrix:
+    """
+    Read-only CSR or CSC matrix produced by \
+    :func:`modelforge.model.disassemble_sparse_matrix()` which keeps the squeezed dtypes \
+    of the indices. :mod:`scipy.sparse` up-casts the indices to int32 or int64, so \
+    :func:`modelforge.model.assemble_sparse_matrix()` copies them; this class uses the loaded \
+    arrays as they are, including the memory mapped arrays of `load(lazy=True)`, and converts \
+    to scipy only on demand. Only the index pointers are allocated if they were stored \
+    as the squeezed row lengths.
+    """
+
+    def __init__(self, subtree: dict):
+        """
+        Initialize a new instance of :class:`CompactSparseMatrix`.
+
+        :param subtree: The dict with "shape", "format" and "data" produced by \
+                        :func:`modelforge.model.disassemble_sparse_matrix()`.
+        """
+        if subtree["format"] not in ("csr", "csc"):
+            raise ValueError("Unsupported sparse matrix format: %s" % subtree["format"])
+        self._format = subtree["format"]
+        self._shape = tuple(int(d) for d in subtree["shape"])
+        data, indices, indptr = subtree["data"]
+        self._data = data if isinstance(data, ChunkedArray) else numpy.asarray(data)
+        self._indices = indices if isinstance(indices, ChunkedArray) else numpy.asarray(indices)
+        indptr = numpy.asarray(indptr)
+        nnz = len(self._data)
+        if len(indptr) > 0 and indptr[-1] != nnz:
+            # indptr is diff-ed
+            indptr = numpy.cumsum(indptr, dtype=numpy.uint32 if nnz < 1 << 32 else numpy.uint64)
+        self._indptr = indptr
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """Return the shape of the matrix."""
+        return self._shape
+
+    @property
+    def format(self) -> str:
+        """Return "csr" or "csc"."""
+        return self._format
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        """Return the dtype of the values."""
+        return self._data.dtype
+
+    @property
+    def nnz(self) -> int:
+        """Return the number of stored values."""
+        return len(self._data)
+
+    @property
+    def data(self) -> Union[numpy.ndarray, ChunkedArray]:
+        """Return the stored values."""
+        return self._data
+
+    @property
+    def indices(self) -> Union[numpy.ndarray, ChunkedArray]:
+        """Return the column indices for CSR or the row indices for CSC."""
+        return self._indices
+
+    @property
+    def indptr(self) -> numpy.ndarray:
+        """Return the offsets of the rows for CSR or of the columns for CSC."""
+        return self._indptr
+
+    def __repr__(self) -> str:
+        """Describe the matrix without reading the values."""
+        return "CompactSparseMatrix(shape=%s, format=%s, dtype=%s, nnz=%d, indices=%s)" % (
+            self._shape, self._format, self.dtype, self.nnz, self._indices.dtype)
+
+    def __getitem__(self, item) -> "CompactSparseMatrix":
+        """
+        Slice the rows. The rows of CSR matrices share the values and the indices with \
+        the original matrix; CSC matrices copy the nonzeros in the selected rows.
+
+        :param item: Row index or slice with the step 1.
+        :return: :class:`CompactSparseMatrix` of the same format.
+        """
+        rows = self._shape[0]
+        if isinstance(item, slice):
+            start, stop, step = item.indices(rows)
+            if step != 1:
+                raise IndexError("Only contiguous row slices are supported")
+            stop = max(start, stop)
+        else:
+            start = operator.index(item)
+            if start < 0:
+                start += rows
+            if not 0 <= start < rows:
+                raise IndexError("row index %d is out of range [0, %d)" % (item, rows))
+            stop = start + 1
+        if self._format == "csr":
+            return self._major_slice(start, stop)
+        indices = numpy.asarray(self._indices)
+        mask = (indices >= start) & (indices < stop)
+        nonzeros = numpy.zeros(len(mask) + 1, dtype=self._indptr.dtype)
+        numpy.cumsum(mask, out=nonzeros[1:])
+        return type(self)({
+            "shape": (stop - start, self._shape[1]),
+            "format": "csc",
+            "data": [numpy.asarray(self._data)[mask],
+                     (indices[mask] - start).astype(indices.dtype, copy=False),
+                     nonzeros[self._indptr]],
+        })
+
+    def dot(self, other: numpy.ndarray) -> numpy.ndarray:
+        """
+        Multiply the matrix by a dense vector or matrix. The indices are up-cast in blocks \
+        of :data:`DOT_BLOCK_NNZ` nonzeros, so the temporary memory does not depend on the size \
+        of the matrix.
+
+        :param other: Dense 1-D or 2-D array with the matching first dimension.
+        :return: Dense array with the product.
+        """
+        other = numpy.asarray(other)
+        if other.shape[0] != self._shape[1]:
+            raise ValueError("Dimension mismatch: %s and %s" % (self._shape, other.shape))
+        dtype = numpy.result_type(self.dtype, other.dtype)
+        if self._format == "csr":
+            result = numpy.empty((self._shape[0],) + other.shape[1:], dtype=dtype)
+            for start, stop in self._blocks():
+                result[start:stop] = self._major_slice(start, stop).toscipy().dot(other)
+        else:
+            result = numpy.zeros((self._shape[0],) + other.shape[1:], dtype=dtype)
+            for start, stop in self._blocks():
+                result += self._major_slice(start, stop).toscipy().dot(other[start:stop])
+        return result
+
+    def toscipy(self) -> scipy.sparse.spmatrix:
+        """Convert to :class:`scipy.sparse.csr_matrix` or :class:`scipy.sparse.csc_matrix`."""
+        matrix_class = getattr(scipy.sparse, "%s_matrix" % self._format)
+        return matrix_class((numpy.asarray(self._data), numpy.asarray(self._indices),
+                             self._indptr), shape=self._shape)
+
+    def _major_slice(self, start: int, stop: int) -> "CompactSparseMatrix":
+        """Select the rows of a CSR matrix or the columns of a CSC matrix without copying."""
+        first, last = int(self._indptr[start]), int(self._indptr[stop])
+        shape = list(self._shape)
+        shape[self._format == "csc"] = stop - start
+        return type(self)({
+            "shape": shape,
+            "format": self._format,
+            "data": [self._data[first:last], self._indices[first:last],
+                     self._indptr[start:stop + 1] - self._indptr.dtype.type(first)],
+        })
+
+    def _blocks(self) -> Iterator[Tuple[int, int]]:
+        """Split the rows of a CSR matrix or the columns of a CSC matrix into the ranges \
+        with at most :data:`DOT_BLOCK_NNZ` nonzeros, unless a single one has more."""
+        size = len(self._indptr) - 1
+        start = 0
+        while start < size:
+            stop = int(numpy.searchsorted(self._indptr, self._indptr[start] + DOT_BLOCK_NNZ,
+                                          side="right")) - 1
+            stop = min(max(stop, start + 1), size)
+            yield start, stop
+            start = stop
@@ -0,0 +1,206 @@
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+import operator
+from typing import Iterator, List, Union
+
+import numpy
+
+from modelforge.chunked import ChunkedArray
+
+
+#: Size of the pieces of the UTF-8 buffer which are scanned at once to find the offsets.
+SCAN_BLOCK_SIZE = 1 << 20
+ITER_BLOCK_SIZE = 4096  #: Number of strings decoded at once during the iteration.
+
+
+def char_to_byte_offsets(buffer: numpy.ndarray, char_offsets: numpy.ndarray,
+                         block_size: int = SCAN_BLOCK_SIZE) -> numpy.ndarray:
+    """
+    Convert the character offsets in the UTF-8 encoded buffer to the byte offsets. \
+    The buffer is scanned in blocks so that the temporary memory does not depend on its size.
+
+    :param buffer: Flat uint8 array with the UTF-8 encoded text.
+    :param char_offsets: Sorted character offsets.
+    :param block_size: Number of bytes scanned at once.
+    :return: int64 array with the byte offsets of the same shape as `char_offsets`. \
+             The offsets past the last character are the size of the buffer.
+    """
+    result = numpy.empty(len(char_offsets), dtype=numpy.int64)
+    pos = chars = 0
+    for start in range(0, len(buffer), block_size):
+        # every byte except the continuation bytes 10xxxxxx starts a character
+        starts = numpy.flatnonzero((buffer[start:start + block_size] & 0xC0) != 0x80)
+        end = numpy.searchsorted(char_offsets, chars + len(starts))
+        result[pos:end] = starts[char_offsets[pos:end] - chars] + start
+        pos = end
+        chars += len(starts)
+    result[pos:] = len(buffer)
+    return result
+
+
+class StringArray(Sequence):
+    """
+    Read-only sequence of the strings packed with :func:`modelforge.model.merge_strings()` \
+    which decodes the elements on access. Unlike :func:`modelforge.model.split_strings()`, \
+    it does not create any Python objects in advance and keeps only the cumulative byte \
+    offsets besides the packed buffer, which stays memory mapped if the model is loaded \
+    with `lazy=True`. If the subtree contains the precomputed "offsets", the initialization \
+    takes constant time.
+    """
+
+    def __init__(self, subtree: dict):
+        """
+        Initialize a new instance of :class:`StringArray`.
+
+        :param subtree: The dict with "strings" and "lengths" produced by \
+                        :func:`modelforge.model.merge_strings()`, optionally with \
+                        the cumulative byte "offsets".
+        """
+        lengths = numpy.asarray(subtree["lengths"])
+        strings = numpy.asarray(subtree["strings"])
+        self._str = subtree.get("str", True) is not False
+        if strings.shape[0] == 0:
+            self._buffer = numpy.empty(0, dtype=numpy.uint8)
+        else:
+            # the single element of the S-dtype array is the whole buffer
+            self._buffer = strings.view(numpy.uint8)
+        self._lengths = lengths
+        if "offsets" in subtree:
+            self._offsets = numpy.asarray(subtree["offsets"])
+            return
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        # the lengths of str-s are in characters: they match the bytes if the text is ASCII
+        if self._str and offsets[-1] != len(self._buffer):
+            offsets = char_to_byte_offsets(self._buffer, offsets)
+        self._offsets = offsets.astype(numpy.uint32 if offsets[-1] < 1 << 32 else numpy.int64)
+
+    @property
+    def offsets(self) -> numpy.ndarray:
+        """Return the cumulative byte offsets of the strings, including the total size."""
+        return self._offsets
+
+    @property
+    def is_str(self) -> bool:
+        """Return True if the elements are :class:`str`-s and False if :class:`bytes`."""
+        return self._str
+
+    @property
+    def nbytes(self) -> int:
+        """Return the size of the packed strings in bytes."""
+        return int(self._offsets[-1])
+
+    def __len__(self) -> int:
+        """Return the number of strings."""
+        return len(self._lengths)
+
+    def __repr__(self) -> str:
+        """Describe the array without decoding it."""
+        return "StringArray(size=%d, %s)" % (len(self), "str" if self._str else "bytes")
+
+    def __getitem__(self, item) -> Union[str, bytes, List[Union[str, bytes]]]:
+        """Decode the string at the given index or the list of strings in the given slice."""
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                return self._decode(start, max(start, stop))
+            return [self._get(i) for i in range(start, stop, step)]
+        index = operator.index(item)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("index %d is out of range [0, %d)" % (item, len(self)))
+        return self._get(index)
+
+    def __iter__(self) -> Iterator[Union[str, bytes]]:
+        """Decode the strings in blocks."""
+        for start in range(0, len(self), ITER_BLOCK_SIZE):
+            yield from self._decode(start, min(start + ITER_BLOCK_SIZE, len(self)))
+
+    def tolist(self) -> List[Union[str, bytes]]:
+        """Decode all the strings, the same as :func:`modelforge.model.split_strings()`."""
+        return self._decode(0, len(self))
+
+    def _get(self, index: int) -> Union[str, bytes]:
+        data = self._buffer[int(self._offsets[index]):int(self._offsets[index + 1])].tobytes()
+        return data.decode("utf-8") if self._str else data
+
+    def _decode(self, start: int, stop: int) -> List[Union[str, bytes]]:
+        """Decode the consecutive strings at once and split them by the lengths."""
+        data = self._buffer[int(self._offsets[start]):int(self._offsets[stop])].tobytes()
+        if self._str:
+            data = data.decode("utf-8")
+        result = [None] * (stop - start)
+        offset = 0
+        for i, length in enumerate(self._lengths[start:stop].tolist()):
+            result[i] = data[offset:offset + length]
+            offset += length
+        return result
+
+
+class StringMap(Mapping):
+    """
+    Read-only mapping from strings to numbers packed with \
+    :func:`modelforge.model.merge_mapping()`. The keys are sorted, so the lookup is \
+    a binary search in the packed buffer which decodes only the probed keys. Neither \
+    the keys nor the values are unpacked into Python objects, so the initialization takes \
+    constant time and the arrays stay memory mapped if the model is loaded with `lazy=True`.
+    """
+
+    def __init__(self, subtree: dict):
+        """
+        Initialize a new instance of :class:`StringMap`.
+
+        :param subtree: The dict with "keys" and "values" produced by \
+                        :func:`modelforge.model.merge_mapping()`.
+        """
+        self._keys = StringArray(subtree["keys"])
+        values = subtree["values"]
+        self._values = values if isinstance(values, ChunkedArray) else numpy.asarray(values)
+
+    @property
+    def keys_array(self) -> StringArray:
+        """Return the sorted keys."""
+        return self._keys
+
+    @property
+    def values_array(self) -> Union[numpy.ndarray, ChunkedArray]:
+        """Return the values in the order of the sorted keys."""
+        return self._values
+
+    def index(self, key: Union[str, bytes]) -> int:
+        """
+        Find the position of the key in the sorted keys.
+
+        :param key: The key to look up.
+        :return: The index of the key or -1 if it is absent.
+        """
+        if not isinstance(key, str if self._keys.is_str else bytes):
+            return -1
+        index = bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return -1
+
+    def __getitem__(self, key: Union[str, bytes]):
+        """Return the value which corresponds to the key."""
+        index = self.index(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._values[index]
+
+    def __contains__(self, key) -> bool:
+        """Check whether the key exists without reading the value."""
+        return self.index(key) >= 0
+
+    def __len__(self) -> int:
+        """Return the number of keys."""
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[Union[str, bytes]]:
+        """Iterate over the keys in sorted order."""
+        return iter(self._keys)
+
+    def __repr__(self) -> str:
+        """Describe the mapping without decoding it."""
+        return "StringMap(size=%d)" % len(self)
@@ -1,27 +1,53 @@
 class FakeRequest:
     """Mock `requests.Request`."""
-    def __init__(self, content):
+    def __init__(self, content, accept_ranges=False, status_code=200, content_range=None):
         self.content = content
+        self.accept_ranges = accept_ranges
+        self._status_code = status_code
+        self.content_range = content_range
+        self.closed = False
 
     @property
     def headers(self):
-        return {"content-length": len(self.content)}
+        headers = {"content-length": len(self.content)}
+        if self.accept_ranges:
+            headers["accept-ranges"] = "bytes"
+        if self.content_range is not None:
+            headers["content-range"] = self.content_range
+        return headers
 
     @property
     def status_code(self):
         if self.content == 404:
             return 404
-        return 200
+        return self._status_code
 
     def iter_content(self, chunk_size):
         return [self.content[i:i+chunk_size]
                 for i in range(0, len(self.content), chunk_size)]
 
+    def close(self):
+        self.closed = True
+
 
 class FakeRequests:
     """Mock `requests`."""
-    def __init__(self, router):
+    def __init__(self, router, accept_ranges=False):
         self.router = router
+        self.accept_ranges = accept_ranges
+        self.requested_ranges = []
 
-    def get(self, url, params=None, **kwargs):
-        return FakeRequest(self.router(url))
+    def get(self, url, params=None, headers=None, **kwargs):
+        content = self.router(url)
+        range_header = (headers or {}).get("Range")
+        if range_header is None or not self.accept_ranges or content == 404:
+            return FakeRequest(content, self.accept_ranges)
+        start, end = range_header[len("bytes="):].split("-")
+        start = int(start)
+        end = int(end) + 1 if end else len(content)
+        self.requested_ranges.append((start, end))
+        if start >= len(content):
+            return FakeRequest(b"", self.accept_ranges, 416)
+        end = min(end, len(content))
+        return FakeRequest(content[start:end], self.accept_ranges, 206,
+                           "bytes %d-%d/%d" % (start, end - 1, len(content)))
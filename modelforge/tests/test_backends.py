@@ -1,10 +1,15 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 import logging
 import os
 import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
 
 from modelforge import backends as back
+from modelforge.checksum import calculate_checksum, ChecksumMismatchError
 import modelforge.index as ind
 from modelforge.tests import fake_dulwich as fake_git
 
@@ -92,6 +97,60 @@ class BackendTests(unittest.TestCase):
 
         self.assertIsNone(back.create_backend_noexc(logger, name="Bar!!!", git_index=git_index))
 
+    def test_default_backend(self):
+        calls = []
+
+        def fake_create_backend():
+            calls.append(None)
+            if len(calls) == 1:
+                raise ValueError("first attempt fails")
+            return object()
+
+        back.invalidate_default_backend()
+        with patch.object(back, "create_backend", fake_create_backend):
+            try:
+                with self.assertRaises(ValueError):
+                    back.get_default_backend()
+                with ThreadPoolExecutor(8) as pool:
+                    backends = list(pool.map(lambda _: back.get_default_backend(), range(32)))
+                self.assertEqual(len(calls), 2)
+                self.assertEqual(len({id(b) for b in backends}), 1)
+                back.invalidate_default_backend()
+                self.assertIsNot(back.get_default_backend(), backends[0])
+                self.assertEqual(len(calls), 3)
+            finally:
+                back.invalidate_default_backend()
+
+    def test_download_file_legacy(self):
+        data = b"model data"
+        calls = []
+
+        def legacy(source, output, log, chunk_size):
+            calls.append((source, output, chunk_size))
+            with open(output, "wb") as fout:
+                fout.write(data)
+
+        def modern(source, output, log, chunk_size, checksum=None):
+            calls.append(checksum)
+
+        log = logging.getLogger("test")
+        with tempfile.TemporaryDirectory(prefix="modelforge-test-") as tmpdir, \
+                patch.dict(back.__downloaders__, {"legacy": legacy, "modern": modern}):
+            path = os.path.join(tmpdir, "model.asdf")
+            back.download_file("legacy://xxx", path, log)
+            self.assertEqual(calls, [("legacy://xxx", path, -1)])
+            back.download_file("legacy://xxx", path, log,
+                               checksum=calculate_checksum(BytesIO(data)))
+            self.assertTrue(os.path.exists(path))
+            with self.assertRaises(ChecksumMismatchError):
+                back.download_file("legacy://xxx", path, log,
+                                   checksum=calculate_checksum(BytesIO(b"other")))
+            self.assertFalse(os.path.exists(path))
+            with self.assertRaises(ValueError):
+                back.download_file("legacy://xxx", BytesIO(), log, checksum="xxh64:1234")
+            back.download_file("modern://xxx", path, log, checksum="xxh64:1234")
+            self.assertEqual(calls[-1], "xxh64:1234")
+
     def test_supply_backend(self):
 
         @back.supply_backend(optional=True)
@@ -104,6 +163,22 @@ class BackendTests(unittest.TestCase):
         self.assertEqual(test_optional(self._get_args(index_repo=self.default_url)), 1)
         self.assertEqual(1, test_optional(self._get_args(index_repo="any_error_really")))
 
+    def test_supply_backend_ttl(self):
+
+        @back.supply_backend
+        def test_write(args, backend, log):
+            return backend
+
+        @back.supply_backend(read_only=True)
+        def test_read(args, backend, log):
+            return backend
+
+        with patch("modelforge.backends.GitIndex", side_effect=ValueError) as git_index:
+            self.assertEqual(test_write(self._get_args(index_repo=self.default_url)), 1)
+            self.assertEqual(git_index.call_args[1]["ttl"], 0)
+            self.assertEqual(test_read(self._get_args(index_repo=self.default_url)), 1)
+            self.assertIsNone(git_index.call_args[1]["ttl"])
+
     def _get_args(self, index_repo):
         return argparse.Namespace(
             backend="none", args="", index_repo=index_repo, username="",
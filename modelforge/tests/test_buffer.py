@@ -0,0 +1,59 @@
+from io import BytesIO
+import tempfile
+import unittest
+
+import asdf
+import numpy
+from numpy.testing import assert_array_equal
+
+from modelforge.buffer import BufferFile, read_buffer
+from modelforge.compression import parallel_compression
+
+
+class NonSeekable:
+    def __init__(self, data):
+        self.data = BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(size)
+
+
+class BufferTests(unittest.TestCase):
+    def setUp(self):
+        self.tree = {"plain": numpy.arange(1000, dtype=numpy.int32),
+                     "lz4": numpy.arange(5000) % 10,
+                     "zlib": numpy.arange(100, dtype=numpy.float32)}
+        buffer = BytesIO()
+        with asdf.AsdfFile(self.tree) as file:
+            file.set_array_compression(self.tree["lz4"], "lz4")
+            file.set_array_compression(self.tree["zlib"], "zlib")
+            file.write_to(buffer)
+        self.data = buffer.getvalue()
+
+    def test_read_buffer(self):
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            f.write(self.data)
+            f.flush()
+            buffer = read_buffer(f.name)
+            self.assertEqual(buffer.tobytes(), self.data)
+            self.assertFalse(buffer.flags.writeable)
+            with open(f.name, "rb") as fin:
+                fin.seek(10)
+                self.assertEqual(read_buffer(fin).tobytes(), self.data[10:])
+        self.assertEqual(read_buffer(BytesIO(self.data)).tobytes(), self.data)
+        self.assertEqual(read_buffer(NonSeekable(self.data)).tobytes(), self.data)
+
+    def test_buffer_file(self):
+        buffer = read_buffer(BytesIO(self.data))
+        with parallel_compression(), asdf.open(BufferFile(buffer), lazy_load=False) as file:
+            tree = {key: numpy.asarray(file.tree[key]) for key in self.tree}
+        for key, val in self.tree.items():
+            assert_array_equal(tree[key], val)
+        self.assertTrue(numpy.shares_memory(tree["plain"], buffer))
+        self.assertFalse(tree["plain"].flags.writeable)
+        self.assertFalse(numpy.shares_memory(tree["lz4"], buffer))
+        self.assertFalse(numpy.shares_memory(tree["zlib"], buffer))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from modelforge.cache import ModelCache
+
+
+class ModelCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="modelforge-test-cache-")
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, size, atime):
+        path = os.path.join(self.root, "docfreq", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fout:
+            fout.write(b"\0" * size)
+        os.utime(path, (atime, atime))
+        return path
+
+    def test_lookup(self):
+        cache = ModelCache(self.root)
+        path = self._write("a.asdf", 10, 1000)
+        self.assertTrue(cache.lookup(path))
+        self.assertGreater(os.stat(path).st_atime, 1000)
+        self.assertFalse(cache.lookup(os.path.join(self.root, "docfreq", "b.asdf")))
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 10)
+        cache.reset_stats()
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 0)
+
+    def test_manages(self):
+        cache = ModelCache(self.root)
+        self.assertTrue(cache.manages(os.path.join(self.root, "docfreq", "a.asdf")))
+        self.assertFalse(cache.manages(os.path.join(self.root, "index.json")))
+        self.assertFalse(cache.manages("/tmp/a.asdf"))
+
+    def test_evict_lru(self):
+        cache = ModelCache(self.root, max_size=25)
+        old = self._write("old.asdf", 10, 1000)
+        mid = self._write("mid.asdf", 10, 2000)
+        new = self._write("new.asdf", 10, 3000)
+        self._write("ignored.json", 100, 0)
+        cache.add(old)
+        self.assertTrue(os.path.exists(old))
+        self.assertFalse(os.path.exists(mid))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size, 20)
+
+    def test_unlimited(self):
+        cache = ModelCache(self.root, max_size=0)
+        paths = [self._write("%d.asdf" % i, 10, 1000 + i) for i in range(3)]
+        self.assertEqual(cache.evict(), 0)
+        for path in paths:
+            self.assertTrue(os.path.exists(path))
+
+    def test_touch_foreign(self):
+        cache = ModelCache(self.root, max_size=100)
+        path = self._write("a.asdf", 10, 1000)
+        with patch("os.utime", side_effect=PermissionError(1, "Operation not permitted")):
+            self.assertTrue(cache.lookup(path))
+            cache.add(path)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(os.stat(path).st_atime, 1000)
+        self.assertFalse(cache.lookup(path + ".missing"))
+
+    def test_decompressed(self):
+        cache = ModelCache(self.root, max_size=25)
+        path = self._write("a.asdf", 10, 1000)
+        copy = cache.decompressed_path(path)
+        self.assertTrue(copy.startswith(path[:-len(".asdf")] + "."))
+        self.assertTrue(copy.endswith(".decompressed.asdf"))
+        self.assertTrue(cache.manages(copy))
+        self.assertEqual(cache.decompressed_path(path), copy)
+        with open(copy, "wb") as fout:
+            fout.write(b"\0" * 10)
+        cache.add(copy, keep=(path,))
+        self.assertEqual(cache.size, 20)
+        marker = cache.uncompressed_marker_path(path)
+        self.assertEqual(marker, copy[:-len(".decompressed.asdf")] + ".uncompressed")
+        self.assertFalse(cache.manages(marker))
+        for file in (copy + ModelCache.LOCK_SUFFIX, marker):
+            open(file, "wb").close()
+        self.assertEqual(cache.remove_stale_decompressed(path), 0)
+        os.utime(path, ns=(10 ** 9, 2 * 10 ** 9))
+        self.assertNotEqual(cache.decompressed_path(path), copy)
+        self.assertEqual(cache.remove_stale_decompressed(path), 3)
+        for file in (copy, copy + ModelCache.LOCK_SUFFIX, marker):
+            self.assertFalse(os.path.exists(file))
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+from unittest.mock import patch
+
+import lz4.block
+import numpy
+from numpy.testing import assert_array_equal
+
+from modelforge.chunked import chunk_array, chunk_arrays, ChunkedArray, is_chunked, \
+    unchunk_arrays
+
+
+class ChunkedArrayTests(unittest.TestCase):
+    def setUp(self):
+        self.arr = numpy.arange(1000 * 3, dtype=numpy.int32).reshape(1000, 3)
+        # 12 bytes per row -> 10 rows per chunk
+        self.subtree = chunk_array(self.arr, chunk_size=120)
+
+    def test_chunk_array(self):
+        self.assertTrue(is_chunked(self.subtree))
+        self.assertEqual(self.subtree["chunk_rows"], 10)
+        self.assertEqual(len(self.subtree["offsets"]), 101)
+        self.assertEqual(self.subtree["shape"], [1000, 3])
+        self.assertEqual(self.subtree["dtype"], "<i4")
+        self.assertEqual(self.subtree["data"].dtype, numpy.uint8)
+        self.assertEqual(int(self.subtree["offsets"][-1]), len(self.subtree["data"]))
+        with self.assertRaises(TypeError):
+            chunk_array(numpy.array(1))
+        with self.assertRaises(TypeError):
+            chunk_array(numpy.array([{}, []], dtype=object))
+
+    def test_properties(self):
+        arr = ChunkedArray(self.subtree)
+        self.assertEqual(arr.shape, (1000, 3))
+        self.assertEqual(arr.dtype, numpy.int32)
+        self.assertEqual(arr.ndim, 2)
+        self.assertEqual(arr.size, 3000)
+        self.assertEqual(arr.nbytes, 12000)
+        self.assertEqual(arr.chunks, 100)
+        self.assertEqual(len(arr), 1000)
+        self.assertEqual(repr(arr), "ChunkedArray(shape=(1000, 3), dtype=int32, chunks=100)")
+        self.assertTrue((numpy.asarray(arr) == self.arr).all())
+
+    def test_getitem(self):
+        arr = ChunkedArray(self.subtree, threads=3)
+        for item in (0, 9, 10, 999, -1, -1000, numpy.int64(55), slice(None), slice(5, 25),
+                     slice(995, 2000), slice(None, None, -7), slice(990, 5, -3), slice(7, 7),
+                     (17, 2), (slice(3, 30), 1), (slice(3, 30), slice(1, None)), Ellipsis,
+                     (Ellipsis, 0), [5, 3, 998, 3, -2], numpy.array([], dtype=int),
+                     self.arr[:, 0] % 7 == 0, ([1, 2], 0)):
+            expected = self.arr[item]
+            actual = arr[item]
+            self.assertEqual(actual.shape, expected.shape, item)
+            self.assertTrue((actual == expected).all(), item)
+        for item in (1000, -1001, [0, 1000], self.arr[:5, 0] > 1, [0.5]):
+            with self.assertRaises(IndexError, msg=item):
+                arr[item]
+
+    def test_random_access(self):
+        arr = ChunkedArray(self.subtree, threads=1)
+        with patch("lz4.block.decompress", wraps=lz4.block.decompress) as decompress:
+            self.assertEqual(arr[555, 1], self.arr[555, 1])
+            self.assertEqual(decompress.call_count, 1)
+            arr[15:35]
+            self.assertEqual(decompress.call_count, 4)
+            arr[[3, 997, 5]]
+            self.assertEqual(decompress.call_count, 6)
+
+    def test_odd_shapes(self):
+        for arr in (numpy.arange(7, dtype=numpy.float64), numpy.zeros((0, 4)),
+                    numpy.zeros((5, 0)), numpy.arange(24, dtype=numpy.uint8).reshape(2, 3, 4),
+                    numpy.array([b"abc", b"de"]), numpy.array(["xyz", "w"])):
+            chunked = ChunkedArray(chunk_array(arr, chunk_size=8))
+            self.assertEqual(chunked.shape, arr.shape)
+            self.assertEqual(chunked.dtype, arr.dtype)
+            self.assertTrue((numpy.asarray(chunked) == arr).all())
+            self.assertTrue((chunked[1:] == arr[1:]).all())
+
+    def test_shuffle(self):
+        arr = numpy.linspace(0, 1, 3000, dtype=numpy.float64).reshape(1000, 3)
+        plain = chunk_array(arr, chunk_size=1000)
+        shuffled = chunk_array(arr, chunk_size=1000, shuffle=True)
+        self.assertNotIn("filters", plain)
+        self.assertEqual(shuffled["filters"], ["shuffle"])
+        self.assertLess(len(shuffled["data"]), len(plain["data"]))
+        chunked = ChunkedArray(shuffled, threads=2)
+        self.assertEqual(repr(chunked),
+                         "ChunkedArray(shape=(1000, 3), dtype=float64, chunks=25, shuffled)")
+        assert_array_equal(numpy.asarray(chunked), arr)
+        assert_array_equal(chunked[[999, 3, 500]], arr[[999, 3, 500]])
+        assert_array_equal(chunked[41:43, 1], arr[41:43, 1])
+        self.assertNotIn("filters", chunk_array(numpy.arange(10, dtype=numpy.uint8),
+                                                shuffle=True))
+        shuffled["filters"] = ["shuffle", "delta"]
+        with self.assertRaises(ValueError):
+            ChunkedArray(shuffled)
+
+    def test_trees(self):
+        tree = {"a": self.arr, "b": {"c": [self.arr[:, 0], 5]}, "d": numpy.array(7)}
+        chunked = chunk_arrays(
+            tree, lambda path, arr: "zlib:1" if path.startswith("/b/") else None, chunk_size=100)
+        self.assertIs(chunked["a"], self.arr)
+        self.assertTrue(is_chunked(chunked["b"]["c"][0]))
+        self.assertEqual(chunked["b"]["c"][0]["chunked"], "zlib")
+        self.assertEqual(chunked["b"]["c"][1], 5)
+        self.assertIsNot(tree["b"]["c"][0], chunked["b"]["c"][0])
+        self.assertIs(chunk_arrays(tree, lambda path, arr: None), tree)
+        lazy = unchunk_arrays(chunked, lazy=True)
+        self.assertIsInstance(lazy["b"]["c"][0], ChunkedArray)
+        eager = unchunk_arrays(chunked)
+        self.assertIsInstance(eager["b"]["c"][0], numpy.ndarray)
+        self.assertTrue((eager["b"]["c"][0] == self.arr[:, 0]).all())
+        self.assertIs(unchunk_arrays(tree), tree)
+
+
+if __name__ == "__main__":
+    unittest.main()
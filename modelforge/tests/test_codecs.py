@@ -0,0 +1,72 @@
+import unittest
+
+import numpy
+
+from modelforge.codecs import __codecs__, Codec, get_codec, Lz4HCCodec, register_codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CodecsTests(unittest.TestCase):
+    def setUp(self):
+        self.data = (numpy.arange(100000) % 1000).astype(numpy.int32).tobytes()
+
+    def test_get_codec(self):
+        self.assertIsNone(get_codec(None))
+        codec = get_codec("lz4hc")
+        self.assertIsInstance(codec, Lz4HCCodec)
+        self.assertEqual(codec.level, 9)
+        self.assertIs(get_codec(codec), codec)
+        self.assertEqual(get_codec("zlib:9").level, 9)
+        self.assertEqual(str(get_codec("zlib:9")), "zlib:9")
+        self.assertEqual(str(get_codec("zlib:6")), "zlib")
+        self.assertEqual(get_codec("zlib:6"), get_codec("zlib"))
+        self.assertNotEqual(get_codec("zlib:1"), get_codec("zlib"))
+        for spec in ("xxx", "zlib:x", "zlib:10", "lz4hc:0"):
+            with self.assertRaises(ValueError, msg=spec):
+                get_codec(spec)
+
+    def test_asdf_default(self):
+        self.assertTrue(get_codec("lz4hc").is_asdf_default)
+        self.assertFalse(get_codec("lz4hc:12").is_asdf_default)
+        self.assertFalse(get_codec("lz4").is_asdf_default)
+        self.assertTrue(get_codec("zlib").is_asdf_default)
+        self.assertFalse(get_codec("zstd").is_asdf_default)
+
+    def test_roundtrip(self):
+        for name in sorted(__codecs__):
+            if name == "zstd" and zstandard is None:
+                continue
+            codec = get_codec(name)
+            compressed = codec.compress(self.data)
+            self.assertLess(len(compressed), len(self.data), name)
+            self.assertEqual(codec.decompress(compressed, len(self.data)), self.data, name)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_levels(self):
+        self.assertLess(len(get_codec("zstd:19").compress(self.data)),
+                        len(get_codec("zstd:1").compress(self.data)))
+        self.assertLess(len(get_codec("zlib:9").compress(self.data)),
+                        len(get_codec("zlib:1").compress(self.data)))
+
+    def test_register(self):
+        with self.assertRaises(TypeError):
+            register_codec(int)
+        with self.assertRaises(TypeError):
+            register_codec(Lz4HCCodec)
+
+        @register_codec
+        class FakeCodec(Codec):
+            NAME = "fake"
+
+        try:
+            self.assertIsInstance(get_codec("fake"), FakeCodec)
+        finally:
+            del __codecs__["fake"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+from io import BytesIO
+import unittest
+
+import asdf
+import asdf.compression
+import numpy
+
+from modelforge.codecs import get_codec
+from modelforge.compression import compress, decompress, estimate_ratio, \
+    parallel_compression, shuffle_bytes, split_lz4_blocks, unshuffle_bytes
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+
+    def read_into_array(self, size):
+        return numpy.frombuffer(self.data, numpy.uint8, size)
+
+    def read_blocks(self, size):
+        yield self.data[:size]
+
+
+class ParallelCompressionTests(unittest.TestCase):
+    def setUp(self):
+        self.data = numpy.random.RandomState(7).randint(0, 50, size=(100, 100)).astype(numpy.int32)
+
+    def test_byte_identical(self):
+        expected = BytesIO()
+        asdf.compression.compress(expected, self.data, "lz4", block_size=1000)
+        for threads in (1, 2, 3):
+            with parallel_compression(threads):
+                actual = BytesIO()
+                compress(actual, self.data, "lz4", block_size=1000)
+            self.assertEqual(actual.getvalue(), expected.getvalue(), threads)
+
+    def test_fallback(self):
+        expected = BytesIO()
+        asdf.compression.compress(expected, self.data, "zlib", block_size=1000)
+        with parallel_compression(4):
+            actual = BytesIO()
+            compress(actual, self.data, "zlib", block_size=1000)
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_decompress(self):
+        compressed = BytesIO()
+        asdf.compression.compress(compressed, self.data, "lz4", block_size=1000)
+        compressed = compressed.getvalue()
+        self.assertEqual(len(split_lz4_blocks(numpy.frombuffer(compressed, numpy.uint8),
+                                              self.data.nbytes)), 40)
+        for threads in (1, 2, 3):
+            with parallel_compression(threads):
+                actual = decompress(FakeFile(compressed), len(compressed), self.data.nbytes,
+                                    "lz4")
+            self.assertEqual(actual.dtype, numpy.uint8)
+            self.assertEqual(actual.tobytes(), self.data.tobytes(), threads)
+
+    def test_decompress_stream(self):
+        for compression in ("zlib", "bzp2"):
+            compressed = BytesIO()
+            asdf.compression.compress(compressed, self.data, compression, block_size=1000)
+            compressed = compressed.getvalue()
+            with parallel_compression(2):
+                actual = decompress(FakeFile(compressed), len(compressed), self.data.nbytes,
+                                    compression)
+                self.assertEqual(actual.tobytes(), self.data.tobytes(), compression)
+                with self.assertRaises(ValueError):
+                    decompress(FakeFile(compressed), len(compressed), self.data.nbytes - 1,
+                               compression)
+
+    def test_decompress_corrupted(self):
+        compressed = BytesIO()
+        asdf.compression.compress(compressed, self.data, "lz4", block_size=1000)
+        compressed = compressed.getvalue()
+        with parallel_compression(2):
+            with self.assertRaises(ValueError):
+                decompress(FakeFile(compressed), len(compressed) - 10, self.data.nbytes, "lz4")
+            with self.assertRaises(ValueError):
+                decompress(FakeFile(compressed), len(compressed), self.data.nbytes + 1, "lz4")
+            with self.assertRaises(ValueError):
+                decompress(FakeFile(compressed), len(compressed), self.data.nbytes - 1, "lz4")
+
+    def test_estimate_ratio(self):
+        codec = get_codec("lz4hc")
+        noise = numpy.random.RandomState(7).rand(1 << 18)
+        self.assertLess(estimate_ratio(noise, codec, sample_size=1 << 16), 1.1)
+        ratio = estimate_ratio(self.data, codec)
+        self.assertAlmostEqual(ratio, self.data.nbytes / len(codec.compress(self.data)))
+        self.assertGreater(ratio, 2)
+        self.assertGreater(estimate_ratio(numpy.zeros((1000, 1000)), codec, 1 << 16, 4), 50)
+        self.assertEqual(estimate_ratio(numpy.array([]), codec), 1)
+
+    def test_shuffle_bytes(self):
+        data = numpy.array([0x01020304, 0x05060708], dtype=">u4").view(numpy.uint8)
+        shuffled = shuffle_bytes(data, 4)
+        self.assertEqual(shuffled.tolist(), [1, 5, 2, 6, 3, 7, 4, 8])
+        self.assertEqual(unshuffle_bytes(shuffled, 4).tolist(), data.tolist())
+        out = numpy.zeros(8, numpy.uint8)
+        self.assertIs(unshuffle_bytes(shuffled, 4, out), out)
+        self.assertEqual(out.tolist(), data.tolist())
+
+    def test_install(self):
+        original = asdf.compression.compress, asdf.compression.decompress
+        with parallel_compression(2):
+            self.assertIs(asdf.compression.compress, compress)
+            with parallel_compression(3):
+                self.assertIs(asdf.compression.decompress, decompress)
+            self.assertIs(asdf.compression.compress, compress)
+        self.assertEqual((asdf.compression.compress, asdf.compression.decompress), original)
+
+    def test_asdf_roundtrip(self):
+        data = (numpy.arange(9 << 20) % 251).astype(numpy.uint8)
+        buffers = []
+        for threads in (1, 4):
+            buffer = BytesIO()
+            with asdf.AsdfFile({"data": data}) as file:
+                file.set_array_compression(data, "lz4")
+                with parallel_compression(threads):
+                    file.write_to(buffer)
+            buffers.append(buffer.getvalue())
+        self.assertEqual(buffers[0], buffers[1])
+        for threads in (1, 4):
+            with parallel_compression(threads):
+                with asdf.open(BytesIO(buffers[1]), copy_arrays=True) as file:
+                    self.assertTrue((file.tree["data"] == data).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
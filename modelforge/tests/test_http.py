@@ -0,0 +1,191 @@
+from io import BytesIO
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from modelforge import http_
+from modelforge.checksum import calculate_checksum, ChecksumMismatchError, StreamingChecksum
+from modelforge.tests.fake_requests import FakeRequest, FakeRequests
+
+
+class DownloadTests(unittest.TestCase):
+    DATA = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="modelforge-test-http-")
+        self.path = os.path.join(self.tmpdir.name, "model.asdf")
+        self.log = logging.getLogger("test")
+        self.requests_backup = http_.requests
+
+    def tearDown(self):
+        http_.requests = self.requests_backup
+        self.tmpdir.cleanup()
+
+    def _read(self):
+        with open(self.path, "rb") as fin:
+            return fin.read()
+
+    def test_split_ranges(self):
+        with patch.object(http_, "MIN_RANGE_SIZE", 100):
+            self.assertEqual(http_.split_ranges(1000, 4),
+                             [(0, 250), (250, 500), (500, 750), (750, 1000)])
+            self.assertEqual(http_.split_ranges(250, 4), [(0, 125), (125, 250)])
+            self.assertEqual(http_.split_ranges(50, 4), [(0, 50)])
+            self.assertEqual(http_.split_ranges(1000, 1), [(0, 1000)])
+
+    def test_parallel(self):
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+            http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=4)
+        self.assertEqual(self._read(), self.DATA)
+        self.assertEqual(sorted(http_.requests.requested_ranges),
+                         [(0, 2560), (2560, 5120), (5120, 7680), (7680, 10240)])
+
+    def test_no_accept_ranges(self):
+        http_.requests = FakeRequests(lambda url: self.DATA)
+        with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+            http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=4)
+        self.assertEqual(self._read(), self.DATA)
+        self.assertEqual(http_.requests.requested_ranges, [])
+        self.assertFalse(os.path.exists(self.path + http_.PART_SUFFIX))
+
+    def test_ignored_ranges(self):
+        class IgnoringRequests(FakeRequests):
+            def get(self, url, params=None, headers=None, **kwargs):
+                return FakeRequest(self.router(url), accept_ranges=True)
+
+        http_.requests = IgnoringRequests(lambda url: self.DATA)
+        with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+            http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=4,
+                           checksum=calculate_checksum(BytesIO(self.DATA)))
+        self.assertEqual(self._read(), self.DATA)
+        self.assertFalse(os.path.exists(self.path + http_.PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + http_.PART_SUFFIX + http_.RANGES_SUFFIX))
+
+    def test_resume(self):
+        with open(self.path + http_.PART_SUFFIX, "wb") as fout:
+            fout.write(self.DATA[:1000])
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=1)
+        self.assertEqual(self._read(), self.DATA)
+        self.assertEqual(http_.requests.requested_ranges, [(1000, len(self.DATA))])
+        self.assertFalse(os.path.exists(self.path + http_.PART_SUFFIX))
+
+    def test_resume_no_ranges(self):
+        with open(self.path + http_.PART_SUFFIX, "wb") as fout:
+            fout.write(b"garbage")
+        http_.requests = FakeRequests(lambda url: self.DATA)
+        http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=1)
+        self.assertEqual(self._read(), self.DATA)
+
+    def test_resume_parallel(self):
+        part = self.path + http_.PART_SUFFIX
+        with open(part, "wb") as fout:
+            fout.write(self.DATA[:5000] + b"\0" * (len(self.DATA) - 5000))
+        with open(part + http_.RANGES_SUFFIX, "w") as fout:
+            fout.write("[[5000, 10240]]")
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        http_.download("https://xxx", self.path, self.log, chunk_size=100)
+        self.assertEqual(self._read(), self.DATA)
+        self.assertEqual(http_.requests.requested_ranges, [(5000, 10240)])
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(part + http_.RANGES_SUFFIX))
+
+    def test_resume_finished(self):
+        part = self.path + http_.PART_SUFFIX
+        with open(part, "wb") as fout:
+            fout.write(self.DATA)
+        with open(part + http_.RANGES_SUFFIX, "w") as fout:
+            fout.write("[]")
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        http_.download("https://xxx", self.path, self.log, chunk_size=100,
+                       checksum=calculate_checksum(BytesIO(self.DATA)))
+        self.assertEqual(self._read(), self.DATA)
+        self.assertEqual(http_.requests.requested_ranges, [])
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(part + http_.RANGES_SUFFIX))
+
+    def test_interrupted(self):
+        class FailingRequests(FakeRequests):
+            def get(self, url, params=None, headers=None, **kwargs):
+                if headers is not None and headers["Range"].startswith("bytes=5120-"):
+                    raise ConnectionError()
+                return super().get(url, params, headers, **kwargs)
+
+        http_.requests = FailingRequests(lambda url: self.DATA, accept_ranges=True)
+        part = self.path + http_.PART_SUFFIX
+        with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+            with self.assertRaises(ConnectionError):
+                http_.download("https://xxx", self.path, self.log, connections=4)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(part))
+        with open(part + http_.RANGES_SUFFIX) as fin:
+            self.assertEqual(fin.read(), "[[5120, 7680]]")
+
+    def test_checksum(self):
+        checksum = calculate_checksum(BytesIO(self.DATA))
+        self.assertTrue(checksum.startswith("xxh64:"))
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        for connections in (1, 4):
+            with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+                http_.download("https://xxx", self.path, self.log, chunk_size=100,
+                               connections=connections, checksum=checksum)
+            self.assertEqual(self._read(), self.DATA)
+        with open(self.path + http_.PART_SUFFIX, "wb") as fout:
+            fout.write(self.DATA[:1000])
+        http_.download("https://xxx", self.path, self.log, chunk_size=100, connections=1,
+                       checksum=calculate_checksum(BytesIO(self.DATA), "sha256"))
+        self.assertEqual(self._read(), self.DATA)
+        buffer = BytesIO()
+        http_.download("https://xxx", buffer, self.log, chunk_size=100, checksum=checksum)
+        self.assertEqual(buffer.getvalue(), self.DATA)
+
+    def test_checksum_resume_parallel(self):
+        part = self.path + http_.PART_SUFFIX
+        with open(part, "wb") as fout:
+            fout.write(self.DATA[:5000] + b"\0" * (len(self.DATA) - 5000))
+        with open(part + http_.RANGES_SUFFIX, "w") as fout:
+            fout.write("[[5000, 10240]]")
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        http_.download("https://xxx", self.path, self.log, chunk_size=100,
+                       checksum=calculate_checksum(BytesIO(self.DATA)))
+        self.assertEqual(self._read(), self.DATA)
+
+    def test_ordered_checksum(self):
+        part = self.path + http_.PART_SUFFIX
+        http_._preallocate(part, len(self.DATA))
+        hasher = StreamingChecksum(calculate_checksum(BytesIO(self.DATA)))
+        ordered = http_._OrderedChecksum(
+            hasher, part, [(0, 4000), (4000, 8000), (8000, 10240)], len(self.DATA))
+        chunks = [(4000, 4000, 5000)] + [(0, i, i + 1000) for i in range(0, 4000, 1000)] + \
+            [(4000, i, i + 1000) for i in range(5000, 8000, 1000)] + [(8000, 8000, 10240)]
+        with patch.object(StreamingChecksum, "update_from_file", autospec=True,
+                          side_effect=StreamingChecksum.update_from_file) as update_from_file:
+            with open(part, "r+b") as fout:
+                for start, begin, end in chunks:
+                    fout.seek(begin)
+                    fout.write(self.DATA[begin:end])
+                    fout.flush()
+                    ordered.update(start, begin, self.DATA[begin:end])
+            ordered.finish()
+        hasher.verify()
+        self.assertEqual([c[0][2] for c in update_from_file.call_args_list], [1000])
+
+    def test_checksum_mismatch(self):
+        checksum = calculate_checksum(BytesIO(b"other"))
+        http_.requests = FakeRequests(lambda url: self.DATA, accept_ranges=True)
+        for connections in (1, 4):
+            with patch.object(http_, "MIN_RANGE_SIZE", 1000):
+                with self.assertRaises(ChecksumMismatchError):
+                    http_.download("https://xxx", self.path, self.log, chunk_size=100,
+                                   connections=connections, checksum=checksum)
+            self.assertFalse(os.path.exists(self.path))
+            self.assertFalse(os.path.exists(self.path + http_.PART_SUFFIX))
+        with self.assertRaises(ValueError):
+            http_.download("https://xxx", self.path, self.log, checksum="md5:1234")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,14 @@
 import os
 import shutil
 from tempfile import gettempdir
+import threading
 import unittest
+from unittest.mock import patch
+
+from jinja2 import Template
 
 import modelforge.index as index
+from modelforge.locks import FileLock, LockTimeoutError
 from modelforge.tests import fake_dulwich as fake_git
 
 
@@ -81,6 +86,64 @@ class GitIndexTests(unittest.TestCase):
         self.assertFalse(fake_git.FakeRepo.cloned)
         self.assertTrue(fake_git.FakeRepo.pulled)
 
+    def test_init_ttl(self):
+        git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path, ttl=3600)
+        self.assertIsNotNone(git_index.last_sync)
+        fake_git.FakeRepo.reset(self.default_index, head="1")
+        index.GitIndex(remote=self.default_url, cache=self.cached_path, ttl=3600)
+        self.assertFalse(fake_git.FakeRepo.pulled)
+        os.utime(self.repo_path + index.GitIndex.SYNC_STAMP_SUFFIX, (0, 0))
+        index.GitIndex(remote=self.default_url, cache=self.cached_path, ttl=3600)
+        self.assertTrue(fake_git.FakeRepo.pulled)
+        self.assertGreater(git_index.last_sync, 0)
+
+    def test_init_offline(self):
+        with self.assertRaises(ValueError):
+            index.GitIndex(remote=self.default_url, cache=self.cached_path, offline=True)
+        self.assertFalse(fake_git.FakeRepo.cloned)
+        index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        fake_git.FakeRepo.reset(self.default_index, head="1")
+        git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path,
+                                   offline=True)
+        self.assertFalse(fake_git.FakeRepo.pulled)
+        self.assertEqual(git_index.contents, self.default_index)
+        with self.assertRaises(ValueError):
+            git_index.upload("add", {"model": "a", "uuid": "b"})
+        self.assertFalse(fake_git.FakeRepo.pushed)
+
+    def test_init_snapshot(self):
+        index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        self.assertTrue(os.path.exists(self.repo_path + index.GitIndex.SNAPSHOT_SUFFIX))
+
+        def broken(*args, **kwargs):
+            raise ConnectionError()
+
+        fake_git.FakeRepo.reset(self.default_index, head="1")
+        with patch.object(fake_git, "ls_remote", broken), patch.object(fake_git, "clone", broken):
+            git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        self.assertEqual(git_index.contents, self.default_index)
+        self.assertTrue(os.path.exists(os.path.join(self.repo_path, "index.json")))
+        self.assertFalse(fake_git.FakeRepo.pulled)
+
+    def test_init_reclone(self):
+        index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        stale = os.path.join(self.repo_path, "stale")
+        with open(stale, "w") as fout:
+            fout.write("stale")
+        fake_git.FakeRepo.reset(self.default_index)
+
+        def broken_head(self):
+            raise KeyError("HEAD")
+
+        with patch.object(fake_git.FakeRepo, "head", broken_head):
+            git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        self.assertTrue(fake_git.FakeRepo.cloned)
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(git_index.contents, self.default_index)
+        self.assertEqual(sorted(os.listdir(self.cached_path)), ["src-d"])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.repo_path))),
+                         ["models", "models.index.json", "models.last-sync", "models.lock"])
+
     def test_init_errors(self):
         with self.assertRaises(ValueError):
             index.GitIndex(remote="no_protocol", cache=self.cached_path)
@@ -306,6 +369,49 @@ class GitIndexTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             git_index.upload("reset", {})
 
+    def test_transaction(self):
+        git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path, ttl=3600)
+        fake_git.FakeRepo.reset(self.default_index, head="1")
+        errors = []
+
+        def lock():
+            try:
+                with FileLock(self.repo_path + ".lock", timeout=0):
+                    pass
+            except LockTimeoutError as e:
+                errors.append(e)
+
+        with git_index.transaction():
+            self.assertTrue(fake_git.FakeRepo.pulled)
+            thread = threading.Thread(target=lock)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        lock()
+        self.assertEqual(len(errors), 1)
+
+    def test_transaction_failure(self):
+        git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        stamp = self.repo_path + index.GitIndex.SYNC_STAMP_SUFFIX
+        with self.assertRaises(ValueError):
+            with git_index.transaction():
+                git_index.remove_model("missing")
+        self.assertTrue(os.path.exists(self.repo_path))
+        self.assertTrue(os.path.exists(stamp))
+        with self.assertRaises(RuntimeError):
+            with git_index.transaction():
+                git_index.add_model("docfreq", "a", {"default": "a", "model": {
+                    "dependencies": []}}, Template("model"))
+                raise RuntimeError
+        self.assertFalse(os.path.exists(self.repo_path))
+        self.assertFalse(os.path.exists(stamp))
+        index.GitIndex(remote=self.default_url, cache=self.cached_path)
+        git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path,
+                                   offline=True)
+        with self.assertRaises(ValueError):
+            with git_index.transaction():
+                pass
+
     def test_template(self):
         git_index = index.GitIndex(remote=self.default_url, cache=self.cached_path)
         with self.assertRaises(ValueError):
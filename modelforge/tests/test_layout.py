@@ -0,0 +1,80 @@
+from io import BytesIO
+import os
+import tempfile
+import unittest
+
+import asdf
+import numpy
+
+from modelforge.chunked import chunk_array
+from modelforge.layout import align_blocks, is_aligned, PAGE_SIZE, write_decompressed
+
+
+class LayoutTests(unittest.TestCase):
+    def setUp(self):
+        self.tree = {"a": numpy.arange(3, dtype=numpy.uint8),
+                     "b": numpy.arange(1001, dtype=numpy.float32),
+                     "c": numpy.arange(PAGE_SIZE, dtype=numpy.int64).reshape(-1, 8)}
+
+    def test_align_blocks(self):
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            with asdf.AsdfFile(self.tree) as file:
+                align_blocks(file, 512)
+                file.write_to(f.name)
+            for lazy in (True, False):
+                with asdf.open(f.name, lazy_load=lazy, copy_arrays=not lazy) as file:
+                    for key, val in self.tree.items():
+                        numpy.testing.assert_array_equal(file.tree[key], val)
+                    offsets = [block.data_offset for block in file.blocks.internal_blocks]
+            self.assertEqual(len(offsets), 3)
+            for offset in offsets:
+                self.assertEqual(offset % 512, 0)
+            with asdf.open(f.name, copy_arrays=False) as file:
+                for key in self.tree:
+                    arr = file.tree[key]
+                    self.assertTrue(is_aligned(numpy.asarray(arr), 512), key)
+
+    def test_compressed(self):
+        expected = BytesIO()
+        with asdf.AsdfFile(self.tree) as file:
+            file.set_array_compression(self.tree["b"], "zlib")
+            file.write_to(expected)
+        actual = BytesIO()
+        with asdf.AsdfFile(self.tree) as file:
+            file.set_array_compression(self.tree["b"], "zlib")
+            align_blocks(file)
+            file.write_to(actual)
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_write_decompressed(self):
+        tree = dict(self.tree, d=chunk_array(numpy.arange(1000), chunk_size=100))
+        with tempfile.TemporaryDirectory(prefix="modelforge-test-") as tmpdir:
+            source, output = os.path.join(tmpdir, "a.asdf"), os.path.join(tmpdir, "b.asdf")
+            with asdf.AsdfFile(tree) as file:
+                file.set_array_compression(self.tree["b"], "lz4")
+                file.write_to(source)
+            self.assertTrue(write_decompressed(source, output))
+            with asdf.open(output, copy_arrays=False) as file:
+                for key, val in self.tree.items():
+                    self.assertTrue(is_aligned(numpy.asarray(file.tree[key])), key)
+                    numpy.testing.assert_array_equal(file.tree[key], val)
+                numpy.testing.assert_array_equal(file.tree["d"], numpy.arange(1000))
+                for block in file.blocks.internal_blocks:
+                    self.assertIsNone(block.input_compression)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["a.asdf", "b.asdf"])
+            os.remove(output)
+            with asdf.AsdfFile(self.tree) as file:
+                file.write_to(source)
+            self.assertFalse(write_decompressed(source, output))
+            self.assertFalse(os.path.exists(output))
+
+    def test_is_aligned(self):
+        arr = numpy.zeros(PAGE_SIZE * 3, dtype=numpy.uint8)
+        offset = -arr.__array_interface__["data"][0] % PAGE_SIZE
+        self.assertTrue(is_aligned(arr[offset:]))
+        self.assertFalse(is_aligned(arr[offset + 1:]))
+        self.assertTrue(is_aligned(arr[offset + 64:], 64))
+
+
+if __name__ == "__main__":
+    unittest.main()
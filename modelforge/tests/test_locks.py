@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from modelforge.locks import FileLock, LockTimeoutError
+
+
+def _critical_section(lock_path, log_path):
+    with FileLock(lock_path):
+        with open(log_path, "a") as fout:
+            fout.write("enter\n")
+            fout.flush()
+            time.sleep(0.05)
+            fout.write("exit\n")
+
+
+class FileLockTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="modelforge-test-locks-")
+        self.lock_path = os.path.join(self.tmpdir.name, "sub", "model.asdf.lock")
+        self.log_path = os.path.join(self.tmpdir.name, "log")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _check_log(self, count):
+        with open(self.log_path) as fin:
+            self.assertEqual(fin.read(), "enter\nexit\n" * count)
+
+    def test_processes(self):
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=_critical_section, args=(self.lock_path, self.log_path))
+                 for _ in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            self.assertEqual(proc.exitcode, 0)
+        self._check_log(4)
+
+    def test_threads(self):
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: _critical_section(self.lock_path, self.log_path), range(4)))
+        self._check_log(4)
+
+    def test_timeout(self):
+        # "spawn" so that the child does not inherit the locked in-process lock
+        ctx = multiprocessing.get_context("spawn")
+        with FileLock(self.lock_path) as lock:
+            self.assertTrue(lock.locked)
+            proc = ctx.Process(target=_try_lock, args=(self.lock_path,))
+            proc.start()
+            proc.join()
+            self.assertEqual(proc.exitcode, 1)
+        self.assertFalse(lock.locked)
+        with FileLock(self.lock_path, timeout=0.2):
+            with self.assertRaises(LockTimeoutError):
+                FileLock(self.lock_path, timeout=0.2).acquire()
+
+
+def _try_lock(lock_path):
+    try:
+        FileLock(lock_path, timeout=0.2).acquire()
+    except LockTimeoutError:
+        os._exit(1)
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
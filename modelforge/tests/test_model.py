@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 import datetime
 import inspect
 from io import BytesIO
@@ -5,20 +6,29 @@ import os
 import pickle
 import shutil
 import tempfile
+import tracemalloc
 import unittest
 from unittest.mock import patch
+import uuid
 
 import asdf
+import lz4.block
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 import numpy
 from numpy.testing import assert_array_equal
 from scipy.sparse import csr_matrix
 
 from modelforge import configuration, http_
 from modelforge.backends import create_backend
+from modelforge.cache import get_model_cache
 import modelforge.index as ind
+from modelforge.layout import is_aligned, PAGE_SIZE, write_decompressed
 from modelforge.meta import generate_new_meta
 from modelforge.model import assemble_sparse_matrix, disassemble_sparse_matrix, \
-    merge_strings, Model, split_strings
+    merge_strings, Model, parse_asdf_header, read_asdf_header, split_strings
 from modelforge.models import GenericModel, register_model
 import modelforge.tests.fake_dulwich as fake_git
 from modelforge.tests.fake_requests import FakeRequests
@@ -142,6 +152,105 @@ class NumpyArray(Model):
         self.array = tree["array"]
 
 
+class ChunkedArrays(Model):
+    NAME = "chunked_arrays"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test chunked compression"
+    CHUNKED_COMPRESSION = ("/chunked/",)
+    CHUNK_SIZE = 400
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.chunked = numpy.arange(1000, dtype=numpy.int32)
+        self.plain = numpy.arange(1000, dtype=numpy.int32)
+
+    def _generate_tree(self):
+        return {"chunked": self.chunked, "plain": self.plain}
+
+    def _load_tree(self, tree):
+        self.chunked = tree["chunked"]
+        self.plain = tree["plain"]
+
+
+class ShuffledArrays(Model):
+    NAME = "shuffled_arrays"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test shuffled compression"
+    SHUFFLE = ("/shuffled/",)
+    NO_COMPRESSION = ("/shuffled/raw/",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tree = {"shuffled": {"x": numpy.linspace(0, 1, 5000, dtype=numpy.float32),
+                                  "raw": numpy.arange(10)},
+                     "plain": numpy.linspace(0, 1, 5000, dtype=numpy.float32)}
+
+    def _generate_tree(self):
+        return self.tree
+
+    def _load_tree(self, tree):
+        self.tree = tree
+
+
+class CompressionPolicy(Model):
+    NAME = "compression_policy"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test compression policy"
+    NO_COMPRESSION = ("/plain/",)
+    CHUNKED_COMPRESSION = ("/chunked/",)
+    COMPRESSION_POLICY = (("/ids/", "lz4"), ("/emb/", "zlib:9"), ("/emb/raw/", None),
+                          ("/plain/", "zlib"))
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        arr = (numpy.arange(10000) % 100).astype(numpy.int32)
+        self.tree = {"ids": arr, "emb": {"x": arr + 5, "raw": arr + 1}, "plain": arr + 2,
+                     "chunked": arr + 3, "default": arr + 4}
+
+    def _generate_tree(self):
+        return self.tree
+
+    def _load_tree(self, tree):
+        self.tree = tree
+
+
+class AutoCompression(Model):
+    NAME = "auto_compression"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test auto compression"
+    ARRAY_COMPRESSION = "auto"
+    COMPRESSION_POLICY = (("/zlib/", "zlib"),)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tree = {"noise": numpy.random.RandomState(1).rand(10000),
+                     "ids": numpy.arange(10000) % 100, "zlib": numpy.random.rand(100)}
+
+    def _generate_tree(self):
+        return self.tree
+
+    def _load_tree(self, tree):
+        self.tree = tree
+
+
+class PartialModel(Model):
+    NAME = "partial_model"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test partial loading"
+    OPTIONAL_PATHS = ("/emb/", "/extra/")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tree = {"vocab": numpy.arange(1000) % 10, "extra": numpy.arange(1000) % 20,
+                     "emb": {"x": numpy.arange(1000) % 30, "y": numpy.arange(1000) % 40}}
+
+    def _generate_tree(self):
+        return self.tree
+
+    def _load_tree(self, tree):
+        self.tree = tree
+
+
 class FakeIndex:
     def __init__(self, index):
         self.index = index
@@ -250,6 +359,25 @@ class ModelTests(unittest.TestCase):
         self.assertEqual(model.source, "https://xxx")
         self._validate_meta(model)
 
+    def test_peek_remote(self):
+        with open(get_path(self.MODEL_PATH), "rb") as fin:
+            data = fin.read()
+        http_.requests = FakeRequests(lambda url: data, accept_ranges=True)
+        with patch.object(http_, "DEFAULT_DOWNLOAD_CHUNK_SIZE", 512):
+            meta, size = Model.peek(UUID, backend=self.backend)
+        self.assertEqual(meta["uuid"], UUID)
+        self.assertEqual(size, len(data))
+        ranges = http_.requests.requested_ranges
+        self.assertEqual(ranges[0], (0, 512))
+        self.assertLess(ranges[-1][1], len(data))
+        self.assertEqual(ranges[-1][1] - ranges[-1][0], ranges[-1][0])
+        http_.requests = FakeRequests(lambda url: data)
+        meta, size = Model.peek("https://xxx")
+        self.assertEqual(meta["uuid"], UUID)
+        self.assertEqual(size, len(data))
+        with self.assertRaises(FileNotFoundError):
+            Model.peek("/does/not/exist")
+
     def test_auto(self):
         class FakeModel(GenericModel):
             NAME = "docfreq"
@@ -264,6 +392,38 @@ class ModelTests(unittest.TestCase):
         self.assertEqual(model.source, "https://xxx")
         self._validate_meta(model)
 
+    def test_fetched_while_locked(self):
+        class FakeModel(GenericModel):
+            NAME = "docfreq"
+
+        cache = get_model_cache()
+        file_name = os.path.join(configuration.vendor_cache_dir(), FakeModel.NAME,
+                                 UUID + FakeModel.DEFAULT_FILE_EXT)
+        lock = cache.lock
+
+        @contextmanager
+        def fetching_lock(path, timeout=None):
+            with lock(path, timeout):
+                # another process has finished the download while we were waiting
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.copy(get_path(self.MODEL_PATH), path)
+                yield
+
+        for path in (file_name, file_name + cache.LOCK_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            with patch.object(cache, "lock", fetching_lock), \
+                    patch("modelforge.model.download_file") as download:
+                model = FakeModel(source=UUID, backend=self.backend)
+            download.assert_not_called()
+            self.assertEqual(model.source, "https://xxx")
+            self._validate_meta(model)
+        finally:
+            for path in (file_name, file_name + cache.LOCK_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
     def test_bad_code(self):
         def route(url):
             self.assertEqual("https://bad_code", url)
@@ -441,6 +601,19 @@ class ModelTests(unittest.TestCase):
             Model8().save(savepath, "series")
             self.assertEqual(Model8().load(savepath).tree["abc"], 777)
 
+    def test_peek_meta(self):
+        path = get_path(self.MODEL_PATH)
+        meta = Model.peek_meta(path)
+        self.assertEqual(meta, FakeDocfreqModel().load(source=path).meta)
+        with open(path, "rb") as fin:
+            self.assertEqual(Model.peek_meta(fin)["uuid"], UUID)
+            self.assertEqual(fin.tell(), 0)
+        with open(path, "rb") as fin:
+            header = read_asdf_header(fin, chunk_size=7)
+        self.assertTrue(header.endswith(b"\n...\n"))
+        self.assertLess(len(header), 4096)
+        self.assertEqual(parse_asdf_header(header)["docs"], 1000)
+
     def test_load_no_args(self):
         shutil.rmtree(configuration.vendor_cache_dir(), ignore_errors=True)
         self.assertRaises(ValueError, FakeDocfreqModel().load)
@@ -490,6 +663,15 @@ class SerializationTests(unittest.TestCase):
             merge_strings("abcd")
         with self.assertRaises(TypeError):
             merge_strings([0, 1, 2, 3])
+        with self.assertRaises(TypeError):
+            merge_strings([b"a", "b"])
+
+    def test_merge_split_roundtrip(self):
+        for strings in (["", "ab", "\u0444\u044b\u0432", "", "x" * 300], [""],
+                        [b"", b"\x00ab", b"cd"], [b""]):
+            merged = merge_strings(strings)
+            self.assertEqual(merged["strings"].shape, (1,))
+            self.assertEqual(split_strings(merged), strings)
 
     def test_merge_bytes(self):
         strings = [b"a", b"bc", b"def"]
@@ -613,6 +795,263 @@ class SerializationTests(unittest.TestCase):
             arr = NumpyArray().load(f.name)
             pickle.dumps(arr)
 
+    def test_chunked_compression(self):
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            ChunkedArrays().save(f.name, series="test")
+            with asdf.open(f.name) as file:
+                self.assertEqual(file.tree["chunked"]["chunk_rows"], 100)
+                self.assertEqual(len(file.tree["chunked"]["offsets"]), 11)
+                self.assertNotIsInstance(file.tree["plain"], dict)
+            model = ChunkedArrays().load(f.name)
+            self.assertIsInstance(model.chunked, numpy.ndarray)
+            assert_array_equal(model.chunked, numpy.arange(1000))
+            assert_array_equal(model.plain, numpy.arange(1000))
+            model = ChunkedArrays().load(f.name, lazy=True)
+            try:
+                self.assertEqual(model.chunked.chunks, 10)
+                assert_array_equal(model.chunked[250:420], numpy.arange(250, 420))
+                assert_array_equal(model.chunked[[7, 999]], [7, 999])
+                assert_array_equal(numpy.asarray(model.chunked), numpy.arange(1000))
+            finally:
+                model.close()
+
+    def test_shuffle(self):
+        model = ShuffledArrays()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            with asdf.open(f.name) as file:
+                tree = file.tree
+                self.assertEqual(tree["shuffled"]["x"]["filters"], ["shuffle"])
+                self.assertLess(tree["shuffled"]["x"]["data"].block._size,
+                                tree["plain"].block._size / 2)
+                self.assertIsNone(tree["shuffled"]["raw"].block.input_compression)
+            loaded = ShuffledArrays().load(f.name)
+        assert_array_equal(loaded.tree["shuffled"]["x"], model.tree["shuffled"]["x"])
+        assert_array_equal(loaded.tree["shuffled"]["raw"], model.tree["shuffled"]["raw"])
+        assert_array_equal(loaded.tree["plain"], model.tree["plain"])
+
+    def test_aligned(self):
+        model = CompressionPolicy()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test", aligned=True)
+            with asdf.open(f.name) as file:
+                self.assertNotIsInstance(file.tree["chunked"], dict)
+                for block in file.blocks.internal_blocks:
+                    self.assertIsNone(block.input_compression)
+                    self.assertEqual(block.data_offset % PAGE_SIZE, 0)
+            loaded = CompressionPolicy().load(f.name, lazy=True)
+            try:
+                for key in ("ids", "plain", "chunked", "default"):
+                    arr = numpy.asarray(loaded.tree[key])
+                    assert_array_equal(arr, model.tree[key])
+                    self.assertTrue(is_aligned(arr), key)
+                    while arr is not None and not isinstance(arr, numpy.memmap):
+                        arr = arr.base
+                    self.assertIsNotNone(arr, key)
+            finally:
+                loaded.close()
+            loaded = CompressionPolicy().load(f.name)
+            assert_array_equal(loaded.tree["emb"]["raw"], model.tree["emb"]["raw"])
+
+    def test_cache_decompressed(self):
+        path = os.path.join(configuration.vendor_cache_dir(), ChunkedArrays.NAME,
+                            "%s.asdf" % uuid.uuid4())
+        try:
+            ChunkedArrays().save(path, series="test")
+            cache = get_model_cache()
+            copy = cache.decompressed_path(path)
+            model = ChunkedArrays().load(path, cache_decompressed=False)
+            self.assertFalse(os.path.exists(copy))
+            self.assertEqual(model.size, os.stat(path).st_size)
+            with patch("modelforge.model.write_decompressed",
+                       wraps=write_decompressed) as write:
+                for lazy in (False, True):
+                    model = ChunkedArrays().load(path, lazy=lazy, cache_decompressed=True)
+                    assert_array_equal(model.chunked, numpy.arange(1000))
+                    assert_array_equal(model.plain, numpy.arange(1000))
+                    self.assertEqual(model.size, os.stat(copy).st_size)
+                    if lazy:
+                        self.assertTrue(is_aligned(numpy.asarray(model.chunked)))
+                        model.close()
+                self.assertEqual(write.call_count, 1)
+                # the copy was written by another user
+                with patch("os.utime", side_effect=PermissionError(1, "Not permitted")):
+                    model = ChunkedArrays().load(path, cache_decompressed=True)
+                    self.assertEqual(model.size, os.stat(copy).st_size)
+                self.assertEqual(write.call_count, 1)
+            self.assertGreater(os.stat(copy).st_size, os.stat(path).st_size)
+        finally:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def test_cache_decompressed_uncompressed(self):
+        class Uncompressed(ChunkedArrays):
+            NO_COMPRESSION = ("/",)
+
+        path = os.path.join(configuration.vendor_cache_dir(), Uncompressed.NAME,
+                            "%s.asdf" % uuid.uuid4())
+        try:
+            Uncompressed().save(path, series="test")
+            cache = get_model_cache()
+            cache.reset_stats()
+            with patch("modelforge.model.write_decompressed",
+                       wraps=write_decompressed) as write, \
+                    patch.object(cache, "lock", wraps=cache.lock) as lock:
+                for _ in range(3):
+                    model = Uncompressed().load(path, cache_decompressed=True)
+                    assert_array_equal(model.chunked, numpy.arange(1000))
+                    self.assertEqual(model.size, os.stat(path).st_size)
+                self.assertEqual(write.call_count, 1)
+                self.assertEqual(lock.call_count, 1)
+            self.assertTrue(os.path.exists(cache.uncompressed_marker_path(path)))
+            self.assertFalse(os.path.exists(cache.decompressed_path(path)))
+            self.assertEqual(cache.hits, 0)
+            self.assertEqual(cache.misses, 0)
+        finally:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def test_zero_copy(self):
+        model = CompressionPolicy()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            loaded = CompressionPolicy().load(f.name, zero_copy=True)
+            with open(f.name, "rb") as fin:
+                loaded_fobj = CompressionPolicy().load(fin, zero_copy=True)
+            with self.assertRaises(ValueError):
+                CompressionPolicy().load(f.name, lazy=True, zero_copy=True)
+        for tree in (loaded.tree, loaded_fobj.tree):
+            for key in ("ids", "plain", "chunked", "default"):
+                assert_array_equal(tree[key], model.tree[key])
+            assert_array_equal(tree["emb"]["x"], model.tree["emb"]["x"])
+            plain = numpy.asarray(tree["plain"])
+            self.assertFalse(plain.flags.writeable)
+            raw = numpy.asarray(tree["emb"]["raw"])
+            # asdf wraps the views in NDArrayType-s which expose the original base
+            while getattr(plain, "base", None) is not None:
+                plain = plain.base
+            while getattr(raw, "base", None) is not None:
+                raw = raw.base
+            self.assertIs(plain, raw)
+
+    def test_zero_copy_memory(self):
+        class Uncompressed(CompressionPolicy):
+            NO_COMPRESSION = ("/",)
+
+        model = Uncompressed()
+        model.tree = {"data": numpy.arange(1 << 21, dtype=numpy.int32)}
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            size = os.stat(f.name).st_size
+            for source in (f.name, f):
+                f.seek(0)
+                tracemalloc.start()
+                try:
+                    loaded = Uncompressed().load(source, zero_copy=True)
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                assert_array_equal(loaded.tree["data"], model.tree["data"])
+                self.assertLess(peak, size * 1.2)
+
+    def test_partial_load(self):
+        model = PartialModel()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            with patch("lz4.block.decompress", wraps=lz4.block.decompress) as decompress:
+                loaded = PartialModel().load(f.name, include=["/vocab/", "/emb/x/"])
+                self.assertEqual(decompress.call_count, 2)
+            self.assertNotIn("extra", loaded.tree)
+            self.assertEqual(set(loaded.tree["emb"]), {"x"})
+            self.assertIsInstance(loaded.tree["vocab"], numpy.ndarray)
+            assert_array_equal(loaded.tree["vocab"], model.tree["vocab"])
+            assert_array_equal(loaded.tree["emb"]["x"], model.tree["emb"]["x"])
+            self.assertEqual(loaded.meta["model"], "partial_model")
+            loaded = PartialModel().load(f.name, exclude=["/emb/"])
+            self.assertNotIn("emb", loaded.tree)
+            assert_array_equal(loaded.tree["extra"], model.tree["extra"])
+            loaded = PartialModel().load(f.name, include=["/vocab/", "/emb/"],
+                                         exclude=["/emb/y/"], lazy=True)
+            self.assertNotIn("extra", loaded.tree)
+            self.assertEqual(set(loaded.tree["emb"]), {"x"})
+            assert_array_equal(loaded.tree["emb"]["x"], model.tree["emb"]["x"])
+            loaded = PartialModel().load(f.name, exclude=["/emb/"], zero_copy=True)
+            assert_array_equal(loaded.tree["extra"], model.tree["extra"])
+            with self.assertRaises(ValueError):
+                PartialModel().load(f.name, include=["/emb/"])
+            with self.assertRaises(ValueError):
+                PartialModel().load(f.name, exclude=["/vocab/"])
+
+    def test_compression_policy(self):
+        model = CompressionPolicy()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            with asdf.open(f.name) as file:
+                tree = file.tree
+                self.assertEqual(tree["ids"].block.input_compression, "lz4")
+                self.assertEqual(tree["emb"]["x"].block.input_compression, "zlib")
+                self.assertIsNone(tree["emb"]["raw"].block.input_compression)
+                self.assertIsNone(tree["plain"].block.input_compression)
+                self.assertEqual(tree["default"].block.input_compression, "lz4")
+                self.assertEqual(tree["chunked"]["chunked"], "lz4hc")
+                # fast lz4 compresses worse than the default lz4hc
+                self.assertGreater(tree["ids"].block._size, tree["default"].block._size)
+            loaded = CompressionPolicy().load(f.name)
+        for key in ("ids", "plain", "chunked", "default"):
+            assert_array_equal(loaded.tree[key], model.tree[key])
+        assert_array_equal(loaded.tree["emb"]["x"], model.tree["emb"]["x"])
+        assert_array_equal(loaded.tree["emb"]["raw"], model.tree["emb"]["raw"])
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_compression_policy_zstd(self):
+        class ZstdPolicy(CompressionPolicy):
+            COMPRESSION_POLICY = (("/zstd/", "zstd:5"),)
+
+        model = ZstdPolicy()
+        model.tree = {"zstd": model.tree["ids"], "default": model.tree["default"]}
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            with asdf.open(f.name) as file:
+                # asdf cannot read zstd blocks, so such arrays are chunked
+                self.assertEqual(file.tree["zstd"]["chunked"], "zstd")
+                self.assertEqual(file.tree["default"].block.input_compression, "lz4")
+            loaded = ZstdPolicy().load(f.name)
+        for key in ("zstd", "default"):
+            assert_array_equal(loaded.tree[key], model.tree[key])
+
+    def test_array_compression(self):
+        for compression in ("lz4hc", "zstd", "lz5"):
+            class Invalid(CompressionPolicy):
+                ARRAY_COMPRESSION = compression
+
+            with self.assertRaises(ValueError, msg=compression):
+                Invalid()
+        for compression in ("lz4", "zlib", "bzp2", "auto", None):
+            class Valid(CompressionPolicy):
+                ARRAY_COMPRESSION = compression
+
+            Valid()
+
+    def test_auto_compression(self):
+        model = AutoCompression()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            with self.assertLogs(model._log, "DEBUG") as logs:
+                model.save(f.name, series="test")
+            with asdf.open(f.name) as file:
+                tree = file.tree
+                self.assertIsNone(tree["noise"].block.input_compression)
+                self.assertEqual(tree["ids"].block.input_compression, "lz4")
+                self.assertEqual(tree["zlib"].block.input_compression, "zlib")
+            loaded = AutoCompression().load(f.name)
+            for key in ("noise", "ids", "zlib"):
+                assert_array_equal(loaded.tree[key], model.tree[key])
+            loaded = AutoCompression().load(f.name, lazy=True)
+            try:
+                self.assertIsInstance(loaded.tree["noise"].base, numpy.memmap)
+            finally:
+                loaded.close()
+        logs = "\n".join(logs.output)
+        self.assertRegex(logs, r"/noise/ -> auto: no compression, sampled ratio 1\.0\d")
+        self.assertRegex(logs, r"/ids/ -> auto: lz4hc, sampled ratio \d+\.\d\d")
+
     def test_write(self):
         model = Model1()
         model._meta = generate_meta("test", (1, 0, 3))
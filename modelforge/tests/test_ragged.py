@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+
+import numpy
+from numpy.testing import assert_array_equal
+
+from modelforge.chunked import ChunkedArray
+from modelforge.model import merge_ragged, Model, split_ragged
+from modelforge.ragged import RaggedArray
+
+
+class Documents(Model):
+    NAME = "documents"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test ragged arrays"
+    NO_COMPRESSION = ("/docs/",)
+    CHUNKED_COMPRESSION = ("/graph/values/",)
+    CHUNK_SIZE = 64
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        rs = numpy.random.RandomState(0)
+        self.docs = [rs.randint(0, 1000, size) for size in rs.randint(0, 20, 100)]
+        self.graph = [numpy.arange(i, dtype=numpy.uint16) for i in range(50)]
+
+    def _generate_tree(self):
+        return {"docs": merge_ragged(self.docs), "graph": merge_ragged(self.graph)}
+
+    def _load_tree(self, tree):
+        self.docs = split_ragged(tree["docs"], lazy=True)
+        self.graph = split_ragged(tree["graph"], lazy=True)
+
+
+class RaggedArrayTests(unittest.TestCase):
+    def setUp(self):
+        self.arrays = [numpy.array([1, 2, 3]), numpy.array([], dtype=int), numpy.array([4]),
+                       numpy.arange(300)]
+
+    def test_merge_ragged(self):
+        merged = merge_ragged(self.arrays)
+        self.assertEqual(merged["offsets"].dtype, numpy.uint16)
+        self.assertEqual(merged["offsets"].tolist(), [0, 3, 3, 4, 304])
+        self.assertEqual(len(merged["values"]), 304)
+        with self.assertRaises(TypeError):
+            merge_ragged(numpy.arange(3))
+        with self.assertRaises(ValueError):
+            merge_ragged([numpy.zeros((2, 2))])
+
+    def test_split_ragged(self):
+        merged = merge_ragged(self.arrays)
+        arrays = split_ragged(merged)
+        self.assertIsInstance(arrays, list)
+        self.assertEqual(len(arrays), len(self.arrays))
+        for arr, expected in zip(arrays, self.arrays):
+            assert_array_equal(arr, expected)
+            self.assertTrue(arr.size == 0 or numpy.shares_memory(arr, merged["values"]))
+
+    def test_access(self):
+        arr = split_ragged(merge_ragged(self.arrays), lazy=True)
+        self.assertIsInstance(arr, RaggedArray)
+        self.assertEqual(len(arr), 4)
+        self.assertEqual(repr(arr), "RaggedArray(size=4, dtype=%s)" % arr.dtype)
+        self.assertEqual(arr.lengths.tolist(), [3, 0, 1, 300])
+        assert_array_equal(arr[-2], [4])
+        assert_array_equal(arr[numpy.int64(0)], [1, 2, 3])
+        self.assertEqual([a.tolist() for a in arr[1:3]], [[], [4]])
+        with self.assertRaises(IndexError):
+            arr[4]
+        self.assertEqual(len(list(arr)), 4)
+
+    def test_empty(self):
+        arr = split_ragged(merge_ragged([]), lazy=True)
+        self.assertEqual(len(arr), 0)
+        self.assertEqual(arr.tolist(), [])
+
+    def test_lazy_load(self):
+        model = Documents()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            loaded = Documents().load(f.name, lazy=True)
+            base = loaded.docs.values
+            while not isinstance(base, numpy.memmap):
+                base = base.base
+            self.assertIsInstance(loaded.graph.values, ChunkedArray)
+            for arr, expected in zip(loaded.docs, model.docs):
+                assert_array_equal(arr, expected)
+            for arr, expected in zip(loaded.graph, model.graph):
+                assert_array_equal(arr, expected)
+            self.assertTrue(numpy.shares_memory(loaded.docs[5], loaded.docs.values))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import scipy.sparse
+
+from modelforge.model import assemble_sparse_matrix, disassemble_sparse_matrix, Model
+from modelforge.sparse import CompactSparseMatrix
+
+
+class SparseModel(Model):
+    NAME = "sparse_model"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test compact sparse matrices"
+    NO_COMPRESSION = ("/matrix/",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.matrix = scipy.sparse.random(50, 200, density=0.05, format="csr",
+                                          random_state=1, dtype=numpy.float32)
+
+    def _generate_tree(self):
+        return {"matrix": disassemble_sparse_matrix(self.matrix)}
+
+    def _load_tree(self, tree):
+        self.matrix = assemble_sparse_matrix(tree["matrix"], compact=True)
+
+
+class CompactSparseMatrixTests(unittest.TestCase):
+    def setUp(self):
+        self.csr = scipy.sparse.random(30, 100, density=0.1, format="csr", random_state=0)
+        self.csc = self.csr.tocsc()
+
+    def test_properties(self):
+        matrix = assemble_sparse_matrix(disassemble_sparse_matrix(self.csr), compact=True)
+        self.assertIsInstance(matrix, CompactSparseMatrix)
+        self.assertEqual(matrix.shape, (30, 100))
+        self.assertEqual(matrix.format, "csr")
+        self.assertEqual(matrix.dtype, numpy.float64)
+        self.assertEqual(matrix.nnz, self.csr.nnz)
+        self.assertEqual(matrix.indices.dtype, numpy.uint8)
+        self.assertEqual(matrix.indptr.dtype, numpy.uint32)
+        assert_array_equal(matrix.indptr, self.csr.indptr)
+        self.assertEqual(repr(matrix),
+                         "CompactSparseMatrix(shape=(30, 100), format=csr, dtype=float64, "
+                         "nnz=300, indices=uint8)")
+        with self.assertRaises(ValueError):
+            CompactSparseMatrix(disassemble_sparse_matrix(self.csr.tocoo()))
+
+    def test_toscipy(self):
+        for matrix in (self.csr, self.csc):
+            compact = CompactSparseMatrix(disassemble_sparse_matrix(matrix))
+            converted = compact.toscipy()
+            self.assertEqual(converted.getformat(), matrix.getformat())
+            assert_array_equal(converted.toarray(), matrix.toarray())
+
+    def test_getitem(self):
+        for matrix in (self.csr, self.csc):
+            compact = CompactSparseMatrix(disassemble_sparse_matrix(matrix))
+            for item in (slice(None), slice(3, 17), slice(-5, None), slice(10, 2),
+                         slice(29, 100)):
+                rows = compact[item]
+                self.assertEqual(rows.format, matrix.getformat())
+                self.assertEqual(rows.indices.dtype, numpy.uint8)
+                assert_array_equal(rows.toscipy().toarray(), matrix[item].toarray())
+            for item in (0, 7, -1):
+                assert_array_equal(compact[item].toscipy().toarray(),
+                                   matrix[item].toarray())
+            for item in (30, -31):
+                with self.assertRaises(IndexError):
+                    compact[item]
+            with self.assertRaises(IndexError):
+                compact[::2]
+        compact = CompactSparseMatrix(disassemble_sparse_matrix(self.csr))
+        self.assertTrue(numpy.shares_memory(compact[5:9].indices, compact.indices))
+
+    def test_dot(self):
+        vector = numpy.random.RandomState(1).rand(100)
+        dense = numpy.random.RandomState(2).rand(100, 3)
+        for matrix in (self.csr, self.csc):
+            compact = CompactSparseMatrix(disassemble_sparse_matrix(matrix))
+            assert_array_almost_equal(compact.dot(vector), matrix.dot(vector))
+            assert_array_almost_equal(compact.dot(dense), matrix.dot(dense))
+            with patch("modelforge.sparse.DOT_BLOCK_NNZ", 7):
+                assert_array_almost_equal(compact.dot(vector), matrix.dot(vector))
+                assert_array_almost_equal(compact.dot(dense), matrix.dot(dense))
+            with self.assertRaises(ValueError):
+                compact.dot(numpy.ones(99))
+
+    def test_empty(self):
+        matrix = scipy.sparse.csr_matrix((10, 10), dtype=numpy.float32)
+        compact = CompactSparseMatrix(disassemble_sparse_matrix(matrix))
+        self.assertEqual(compact.nnz, 0)
+        assert_array_equal(compact.dot(numpy.ones(10)), numpy.zeros(10))
+        self.assertEqual(compact[2:5].shape, (3, 10))
+
+    def test_lazy_load(self):
+        model = SparseModel()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            loaded = SparseModel().load(f.name, lazy=True)
+            self.assertIsInstance(loaded.matrix, CompactSparseMatrix)
+            self.assertEqual(loaded.matrix.indices.dtype, numpy.uint8)
+            base = loaded.matrix.indices
+            while not isinstance(base, numpy.memmap):
+                base = base.base
+            vector = numpy.arange(200, dtype=numpy.float32)
+            assert_array_almost_equal(loaded.matrix.dot(vector), model.matrix.dot(vector),
+                                      decimal=3)
+            assert_array_equal(loaded.matrix[10:20].toscipy().toarray(),
+                               model.matrix[10:20].toarray())
+
+
+if __name__ == "__main__":
+    unittest.main()
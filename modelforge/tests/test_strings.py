@@ -0,0 +1,149 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy
+
+from modelforge.model import merge_mapping, merge_strings, Model, split_strings
+from modelforge.strings import char_to_byte_offsets, StringArray, StringMap
+
+
+class Vocabulary(Model):
+    NAME = "vocabulary"
+    VENDOR = "source{d}"
+    DESCRIPTION = "test lazy strings"
+    NO_COMPRESSION = ("/tokens/", "/freqs/")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = ["token%d" % i for i in range(1000)]
+        self.freqs = {"token%d" % i: i * 2 for i in range(1000)}
+
+    def _generate_tree(self):
+        return {"tokens": merge_strings(self.tokens), "freqs": merge_mapping(self.freqs)}
+
+    def _load_tree(self, tree):
+        self.tokens = split_strings(tree["tokens"], lazy=True)
+        self.freqs = StringMap(tree["freqs"])
+
+
+class StringArrayTests(unittest.TestCase):
+    def setUp(self):
+        self.strings = ["", "abc", "фыва", "x", "", "\U0001f600z",
+                        "long" * 100, "é"]
+
+    def test_char_to_byte_offsets(self):
+        text = "aф\U0001f600bcé"
+        buffer = numpy.frombuffer(text.encode("utf-8"), dtype=numpy.uint8)
+        char_offsets = numpy.array([0, 1, 1, 2, 3, 5, 6])
+        expected = [len(text[:i].encode("utf-8")) for i in char_offsets]
+        for block_size in (1, 2, 3, 100):
+            self.assertEqual(
+                char_to_byte_offsets(buffer, char_offsets, block_size).tolist(), expected)
+
+    def test_access(self):
+        arr = StringArray(merge_strings(self.strings))
+        self.assertEqual(len(arr), len(self.strings))
+        self.assertEqual(repr(arr), "StringArray(size=8, str)")
+        self.assertEqual(arr.nbytes, len("".join(self.strings).encode("utf-8")))
+        for i in range(-len(self.strings), len(self.strings)):
+            self.assertEqual(arr[i], self.strings[i], i)
+        self.assertEqual(arr[numpy.int64(2)], self.strings[2])
+        for item in (slice(None), slice(2, 6), slice(6, 2), slice(None, None, -3),
+                     slice(-3, None)):
+            self.assertEqual(arr[item], self.strings[item], item)
+        for item in (8, -9):
+            with self.assertRaises(IndexError):
+                arr[item]
+        with self.assertRaises(TypeError):
+            arr[0.5]
+        self.assertEqual(list(arr), self.strings)
+        self.assertEqual(arr.tolist(), self.strings)
+        self.assertIn("x", arr)
+        self.assertEqual(arr.index("x"), 3)
+
+    def test_bytes(self):
+        strings = [s.encode("utf-8") for s in self.strings]
+        arr = split_strings(merge_strings(strings), lazy=True)
+        self.assertIsInstance(arr, StringArray)
+        self.assertEqual(repr(arr), "StringArray(size=8, bytes)")
+        self.assertEqual(arr[2], strings[2])
+        self.assertEqual(list(arr), strings)
+
+    def test_empty(self):
+        self.assertEqual(len(StringArray(merge_strings([]))), 0)
+        self.assertEqual(list(StringArray(merge_strings([]))), [])
+        self.assertEqual(list(StringArray(merge_strings([""]))), [""])
+
+    def test_lazy_load(self):
+        model = Vocabulary()
+        with tempfile.NamedTemporaryFile(prefix="modelforge-test-") as f:
+            model.save(f.name, series="test")
+            loaded = Vocabulary().load(f.name, lazy=True)
+            self.assertIsInstance(loaded.tokens, StringArray)
+            base = loaded.tokens._buffer
+            while not isinstance(base, numpy.memmap):
+                base = base.base
+            self.assertEqual(loaded.tokens[777], "token777")
+            self.assertEqual(loaded.freqs["token777"], 1554)
+            self.assertEqual(dict(loaded.freqs), model.freqs)
+            self.assertEqual(list(loaded.tokens), model.tokens)
+            loaded = Vocabulary().load(f.name)
+            self.assertEqual(loaded.tokens[-1], "token999")
+
+
+class StringMapTests(unittest.TestCase):
+    def setUp(self):
+        self.mapping = {"token%d" % i: i for i in range(1000)}
+        self.mapping.update({"": -1, "фыва": 7, "\U0001f600": 8})
+
+    def test_lookup(self):
+        packed = merge_mapping(self.mapping, dtype=numpy.int32)
+        self.assertEqual(packed["values"].dtype, numpy.int32)
+        self.assertEqual(split_strings(packed["keys"]), sorted(self.mapping))
+        smap = StringMap(packed)
+        self.assertEqual(repr(smap), "StringMap(size=1003)")
+        self.assertEqual(len(smap), len(self.mapping))
+        for key, val in self.mapping.items():
+            self.assertEqual(smap[key], val, key)
+        self.assertEqual(list(smap), sorted(self.mapping))
+        self.assertEqual(dict(smap.items()), self.mapping)
+        for key in ("token1000", "token", "zzz", "\U0001f601", b"token1", 1, None):
+            self.assertNotIn(key, smap)
+            self.assertEqual(smap.index(key), -1)
+            with self.assertRaises(KeyError):
+                smap[key]
+        self.assertEqual(smap.get("missing", 5), 5)
+        self.assertEqual(smap.index(""), 0)
+        self.assertIsInstance(smap.keys_array, StringArray)
+        self.assertEqual(len(smap.values_array), len(self.mapping))
+
+    def test_binary_search(self):
+        smap = StringMap(merge_mapping(self.mapping))
+        with patch.object(StringArray, "_get", autospec=True,
+                          side_effect=StringArray._get) as get:
+            self.assertEqual(smap["token555"], 555)
+            self.assertLessEqual(get.call_count, 12)
+
+    def test_bytes(self):
+        mapping = {b"b": 2.5, b"a": 1.5, b"\xff": 3}
+        smap = StringMap(merge_mapping(mapping))
+        self.assertEqual(dict(smap), mapping)
+        self.assertNotIn("a", smap)
+
+    def test_invalid(self):
+        with self.assertRaises(TypeError):
+            merge_mapping({"a": 1, b"b": 2})
+        with self.assertRaises(TypeError):
+            merge_mapping({"a": "x"})
+        with self.assertRaises(TypeError):
+            merge_mapping({"a": None})
+
+    def test_empty(self):
+        smap = StringMap(merge_mapping({}))
+        self.assertEqual(len(smap), 0)
+        self.assertNotIn("a", smap)
+
+
+if __name__ == "__main__":
+    unittest.main()
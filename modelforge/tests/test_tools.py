@@ -0,0 +1,57 @@
+import argparse
+import os
+import unittest
+from unittest.mock import patch
+
+from modelforge import http_
+from modelforge.model import Model
+from modelforge.tests.capture import captured_output
+from modelforge.tests.fake_requests import FakeRequests
+from modelforge.tools import dump_model
+
+
+def get_path(name):
+    return os.path.join(os.path.dirname(__file__), name)
+
+
+class DumpTests(unittest.TestCase):
+    def test_dump_many(self):
+        path = get_path("test.asdf")
+        args = argparse.Namespace(input=[path, path])
+        with patch("modelforge.models.__models__", set()), \
+                patch.object(Model, "load", side_effect=AssertionError("must not load")):
+            with captured_output() as (out, _, _):
+                self.assertIsNone(dump_model(args))
+        dump = out.getvalue()
+        self.assertEqual(dump[:len(dump) // 2], dump[len(dump) // 2:])
+        self.assertEqual(dump.count("'uuid': '625557b5-4f2e-4ebb-bd6d-0a7083b1cf06'"), 2)
+        self.assertEqual(dump.count("'size': '110.7 kB'"), 2)
+
+    def test_dump_error(self):
+        args = argparse.Namespace(input=[get_path("test.asdf"), get_path("model.md")])
+        with captured_output() as (out, _, _):
+            self.assertEqual(dump_model(args), 1)
+        self.assertEqual(out.getvalue().count("'uuid': '625557b5-4f2e-4ebb-bd6d-0a7083b1cf06'"), 1)
+
+    def test_dump_url(self):
+        with open(get_path("test.asdf"), "rb") as fin:
+            data = fin.read()
+        requests = http_.requests
+        http_.requests = FakeRequests(lambda url: data, accept_ranges=True)
+        try:
+            args = argparse.Namespace(input=["https://xxx"])
+            with patch("modelforge.models.__models__", set()), \
+                    patch.object(http_, "DEFAULT_DOWNLOAD_CHUNK_SIZE", 1024), \
+                    patch.object(Model, "load", side_effect=AssertionError("must not load")):
+                with captured_output() as (out, _, _):
+                    self.assertIsNone(dump_model(args))
+            fetched = sum(end - start for start, end in http_.requests.requested_ranges)
+        finally:
+            http_.requests = requests
+        self.assertIn("'uuid': '625557b5-4f2e-4ebb-bd6d-0a7083b1cf06'", out.getvalue())
+        self.assertIn("'size': '110.7 kB'", out.getvalue())
+        self.assertLess(fetched, len(data) // 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
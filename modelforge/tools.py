@@ -1,16 +1,21 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
 import subprocess
 import sys
-from typing import Optional
+from typing import Optional, Tuple
 
 from modelforge.backends import supply_backend
 from modelforge.http_ import download as download_http
+from modelforge.meta import format_meta
+from modelforge.model import Model
+import modelforge.models as models
 from modelforge.models import GenericModel
 from modelforge.storage_backend import StorageBackend
 
 
-@supply_backend(optional=True)
+@supply_backend(optional=True, read_only=True)
 def install_environment(args: argparse.Namespace, backend: StorageBackend, log: logging.Logger):
     """
     Install the packages mentioned in the model's metadata.
@@ -21,15 +26,15 @@ def install_environment(args: argparse.Namespace, backend: StorageBackend, log:
     :param log: Logger supplied by supply_backend
     :return: None
     """
-    model = _load_generic_model(args.input, backend, log)
-    if model is None:
+    meta = _load_generic_meta(args.input, backend, log)
+    if meta is None:
         return 1
-    packages = ["%s==%s" % (pkg, ver) for pkg, ver in model.environment["packages"]]
+    packages = ["%s==%s" % (pkg, ver) for pkg, ver in meta["environment"]["packages"]]
     cmdline = [sys.executable, "-m", "pip", "install"] + args.pip + packages
     log.info(" ".join(cmdline))
     subprocess.check_call(cmdline)
     if args.reproduce:
-        for dataset in model.datasets:
+        for dataset in meta["datasets"]:
             download_http(dataset[0], dataset[1], log)
 
 
@@ -45,18 +50,70 @@ def _load_generic_model(source: str, backend: StorageBackend, log: logging.Logge
         return None
 
 
-@supply_backend(optional=True)
+def _peek_generic_model(source: str, backend: StorageBackend, log: logging.Logger
+                        ) -> Optional[Tuple[dict, Optional[int]]]:
+    """
+    Read only the metadata and the size of the model if it is a local file, a UUID or an URL. \
+    Remote models are not downloaded: only the leading bytes which contain the metadata are \
+    fetched.
+
+    :return: (metadata, size) or None if the model could not be read.
+    """
+    try:
+        return Model.peek(source, backend=backend, log=log)
+    except (FileNotFoundError, IsADirectoryError) as e:
+        log.critical('"input" must be a path, a UUID or an URL: %s', e)
+        return None
+    except Exception as e:
+        log.critical("Failed to load the model: %s: %s" % (type(e).__name__, e))
+        return None
+
+
+def _load_generic_meta(source: str, backend: StorageBackend, log: logging.Logger
+                       ) -> Optional[dict]:
+    """Read only the metadata of the model, see :func:`_peek_generic_model()`."""
+    if source is None:
+        model = _load_generic_model(source, backend, log)
+        return model.meta if model is not None else None
+    peeked = _peek_generic_model(source, backend, log)
+    return peeked[0] if peeked is not None else None
+
+
+def _dump_model(source: str, backend: StorageBackend, log: logging.Logger) -> Optional[str]:
+    if source is not None:
+        registered = {m.NAME for m in models.__models__}
+        peeked = _peek_generic_model(source, backend, log)
+        if peeked is None:
+            return None
+        meta, size = peeked
+        if meta["model"] not in registered:
+            # the model-specific dump is not available anyway
+            return format_meta(meta, size)
+    model = _load_generic_model(source, backend, log)
+    if model is None:
+        return None
+    return str(model)
+
+
+@supply_backend(optional=True, read_only=True)
 def dump_model(args: argparse.Namespace, backend: StorageBackend, log: logging.Logger):
     """
-    Print the information about the model.
+    Print the information about the models. The models are read in parallel and printed \
+    in the order of the inputs.
 
     :param args: :class:`argparse.Namespace` with "input", "backend", "args", "username", \
                  "password", "remote_repo" and "log_level".
     :param backend: Backend which is responsible for working with model files.
     :param log: Logger supplied by supply_backend
-    :return: None
+    :return: None if successful, 1 otherwise.
     """
-    model = _load_generic_model(args.input, backend, log)
-    if model is None:
-        return 1
-    print(model)
+    inputs = args.input if isinstance(args.input, (list, tuple)) else [args.input]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(inputs), os.cpu_count() or 1))) as pool:
+        dumps = list(pool.map(lambda source: _dump_model(source, backend, log), inputs))
+    result = None
+    for dump in dumps:
+        if dump is None:
+            result = 1
+        else:
+            print(dump)
+    return result
@@ -43,6 +43,7 @@ setup(
                       "pygtrie>=1.0,<3.0",
                       "xxhash>=1.0,<2.0",
                       "spdx>=2.0,<3.0"],
+    extras_require={"zstd": ["zstandard>=0.11,<1.0"]},
     entry_points={
         "console_scripts": ["modelforge=modelforge.__main__:main"],
     },